@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Activity, Notification
+from .models import User, Activity, ActivityRollup, ArchivedActivity, Notification, Job
 
 # Customizing the User admin interface
 @admin.register(User)
@@ -17,6 +17,34 @@ class ActivityAdmin(admin.ModelAdmin):
     list_filter = ('activity_type', 'date')
     ordering = ('-date',)  # Order by date descending
 
+# Archived activities are read-only; listing them does not slow down the Activity list
+@admin.register(ArchivedActivity)
+class ArchivedActivityAdmin(admin.ModelAdmin):
+    list_display = ('user', 'activity_type', 'duration', 'distance', 'calories_burned', 'date')
+    search_fields = ('user__username', 'activity_type')
+    list_filter = ('activity_type',)
+    ordering = ('-date',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+# Rollups are maintained automatically, so they are listed read-only
+@admin.register(ActivityRollup)
+class ActivityRollupAdmin(admin.ModelAdmin):
+    list_display = ('user', 'activity_type', 'day', 'activity_count', 'total_duration', 'total_distance', 'total_calories')
+    search_fields = ('user__username', 'activity_type')
+    list_filter = ('activity_type', 'day')
+    ordering = ('-day',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 # Customizing the Notification admin interface
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
@@ -24,3 +52,14 @@ class NotificationAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'message', 'notification_type')
     list_filter = ('is_read', 'notification_type', 'date')
     ordering = ('-date',)  # Order by date descending
+
+# Background jobs, listed to inspect failures and the queue backlog
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'status', 'attempts', 'run_after', 'locked_at', 'created_at')
+    list_filter = ('kind', 'status')
+    readonly_fields = ('kind', 'payload', 'attempts', 'locked_by', 'locked_at', 'last_error', 'created_at')
+    ordering = ('run_after',)
+
+    def has_add_permission(self, request):
+        return False
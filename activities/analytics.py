@@ -0,0 +1,136 @@
+import math
+from bisect import bisect, bisect_left, bisect_right
+from itertools import accumulate, compress, repeat
+from operator import eq, gt, sub, truediv
+from django.conf import settings
+from .tracks import segment_distances_km
+
+
+def timed_route(columns):
+    """
+    The timestamped points of a track as `(times, distances, cumulative)` lists plus
+    their heart rates: `distances` holds the km between consecutive points and
+    `cumulative` the km from the start to each point. Times are made non-decreasing,
+    so a clock stepping back never yields a negative duration.
+    """
+    keep = list(map(math.isfinite, columns['time']))
+    lat, lon, times, heart_rates = (
+        list(compress(columns[name], keep)) for name in ('lat', 'lon', 'time', 'heart_rate')
+    )
+    times = list(accumulate(times, max))
+    distances = segment_distances_km(lat, lon)
+    return times, distances, list(accumulate(distances, initial=0.0)), heart_rates
+
+
+def splits(times, cumulative, heart_rates, split_km):
+    """
+    Time, pace (seconds per km) and average heart rate of every `split_km` of the
+    route, plus the partial split left at the end. Split boundaries are found by
+    binary search and their times interpolated between the two points around them.
+    """
+    total = cumulative[-1]
+    marks = [split_km * number for number in range(1, math.floor(total / split_km + 1e-9) + 1)]
+    if total - (marks[-1] if marks else 0) >= 0.005:  # Remainders under 5 m are GPS noise
+        marks.append(total)
+    last = len(cumulative) - 1
+    ends = [min(end, last) for end in map(bisect_left, repeat(cumulative), marks)]
+    heart_rate_totals = list(accumulate(heart_rates, initial=0))
+    heart_rate_counts = list(accumulate(map(bool, heart_rates), initial=0))
+
+    result = []
+    start_time, start_mark, first = times[0], 0.0, 0
+    for number, (mark, end) in enumerate(zip(marks, ends), start=1):
+        span = cumulative[end] - cumulative[end - 1]
+        fraction = (mark - cumulative[end - 1]) / span if span else 1.0
+        end_time = times[end - 1] + fraction * (times[end] - times[end - 1])
+        seconds, length = end_time - start_time, mark - start_mark
+        readings = heart_rate_counts[end + 1] - heart_rate_counts[first]
+        result.append({
+            'split': number,
+            'distance': round(length, 3),
+            'seconds': round(seconds, 1),
+            'pace': round(seconds / length, 1),
+            'average_heart_rate': (
+                round((heart_rate_totals[end + 1] - heart_rate_totals[first]) / readings) if readings else None
+            ),
+        })
+        start_time, start_mark, first = end_time, mark, end + 1
+    return result
+
+
+def best_efforts(times, cumulative, efforts):
+    """
+    The fastest stretch of the route covering each distance in `efforts` (name: km).
+    For every point, the latest earlier point at least that distance behind it is
+    found by a binary search over the cumulative distances, and the shortest of
+    those windows wins. Distances longer than the route are left out.
+    """
+    result = []
+    for name, km in efforts.items():
+        if km > cumulative[-1]:
+            continue
+        first = bisect_left(cumulative, km)  # The first point that far from the start
+        starts = list(map(sub, map(bisect_right, repeat(cumulative), map(sub, cumulative[first:], repeat(km))), repeat(1)))
+        durations = list(map(sub, times[first:], map(times.__getitem__, starts)))
+        best = min(range(len(durations)), key=durations.__getitem__)
+        start, seconds = starts[best], durations[best]
+        result.append({
+            'name': name,
+            'distance': km,
+            'seconds': round(seconds, 1),
+            'pace': round(seconds / km, 1),
+            'start_distance': round(cumulative[start], 3),
+            'start_offset': round(times[start] - times[0], 1),
+        })
+    return result
+
+
+def zone_times(bounds, readings, seconds):
+    """
+    Seconds spent in each zone delimited by the ascending `bounds`, given one reading
+    and its duration per segment: zone 1 lies below the first bound, the last zone
+    at or above the last one.
+    """
+    zones = list(map(bisect, repeat(bounds), readings))
+    totals = [sum(compress(seconds, map(eq, zones, repeat(zone)))) for zone in range(len(bounds) + 1)]
+    lower, upper = [None, *bounds], [*bounds, None]
+    return [
+        {'zone': zone, 'min': low, 'max': high, 'seconds': round(total, 1)}
+        for zone, (low, high, total) in enumerate(zip(lower, upper, totals), start=1)
+    ]
+
+
+def track_analytics(columns, activity_type, max_heart_rate):
+    """
+    Splits, best efforts and the time spent in pace and heart rate zones of a track,
+    computed over whole columns rather than point by point. Only timestamped points
+    count; segments without movement are left out of the pace zones and segments
+    without a heart rate reading out of the heart rate zones.
+    """
+    times, distances, cumulative, heart_rates = timed_route(columns)
+    heart_rate_bounds = [round(max_heart_rate * share) for share in settings.ACTIVITY_HEART_RATE_ZONES]
+    pace_bounds = settings.ACTIVITY_PACE_ZONES.get(activity_type)
+    if len(times) < 2 or cumulative[-1] <= 0:
+        return {
+            'distance': 0.0, 'elapsed_seconds': 0.0, 'moving_seconds': 0.0, 'splits': [], 'best_efforts': [],
+            'pace_zones': [], 'heart_rate_zones': [], 'max_heart_rate': max_heart_rate,
+        }
+
+    seconds = list(map(sub, times[1:], times))
+    moving = list(map(gt, distances, repeat(0)))
+    moving_seconds = list(compress(seconds, moving))
+    paces = map(truediv, moving_seconds, compress(distances, moving))
+    has_heart_rate = list(map(bool, heart_rates[1:]))  # A segment takes the reading at its end
+    return {
+        'distance': round(cumulative[-1], 3),
+        'elapsed_seconds': round(times[-1] - times[0], 1),
+        'moving_seconds': round(sum(moving_seconds), 1),
+        'splits': splits(times, cumulative, heart_rates, settings.ACTIVITY_SPLIT_KM),
+        'best_efforts': best_efforts(times, cumulative, settings.ACTIVITY_BEST_EFFORTS),
+        'pace_zones': zone_times(pace_bounds, paces, moving_seconds) if pace_bounds else [],
+        'heart_rate_zones': (
+            zone_times(heart_rate_bounds, compress(heart_rates[1:], has_heart_rate), list(compress(seconds, has_heart_rate)))
+            if any(has_heart_rate) else []
+        ),
+        'max_heart_rate': max_heart_rate,
+    }
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ActivitiesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'activities'
+
+    def ready(self):
+        from . import signals  # noqa: F401  Registers the model signal handlers
+        from . import rules  # noqa: F401  Registers the notification rule job handler
+        from . import leaderboards  # noqa: F401  Registers the leaderboard job handlers
+        from . import idempotency  # noqa: F401  Registers the idempotency key purge job
+        from . import checks  # noqa: F401  Registers the deployment checks
@@ -0,0 +1,177 @@
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .jobs import register
+from .models import Activity, ArchivedActivity
+
+ARCHIVE_JOB = 'activity_archive'
+# Columns copied to the archive; both tables have them in this order
+ARCHIVE_FIELDS = [field.attname for field in ArchivedActivity._meta.concrete_fields]
+
+
+def archive_horizon(now=None):
+    """Activities before this moment are (or are being) archived; None when archival is disabled."""
+    if settings.ACTIVITY_ARCHIVE_AFTER_DAYS is None:
+        return None
+    return (now or timezone.now()) - timedelta(days=settings.ACTIVITY_ARCHIVE_AFTER_DAYS)
+
+
+def parse_start(value):
+    """Parses a query parameter holding a date or datetime into an aware datetime, or None."""
+    if isinstance(value, str):
+        value = parse_datetime(value) or parse_date(value)
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, time.min)
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+
+def reaches_archive(start):
+    """
+    Whether reads of activities since `start` (a datetime, date or query parameter;
+    None for the whole history) need the archive. Unparsable starts are assumed to reach it.
+    """
+    horizon = archive_horizon()
+    if horizon is None:
+        return False
+    start = parse_start(start) if start is not None else None
+    return start is None or start < horizon
+
+
+def activity_models(start=None):
+    """The models holding the activities since `start`: Activity, plus ArchivedActivity if it is reached."""
+    return (Activity, ArchivedActivity) if reaches_archive(start) else (Activity,)
+
+
+class ActivityHistory:
+    """
+    Live and archived activities read together as one queryset: a UNION ALL of the
+    two tables whose rows come back as Activity instances. Filters and orderings
+    are applied to both sides before they are combined, so the paginators and
+    exports can use it as they use a queryset.
+    """
+
+    def __init__(self, live, archived, ordering=None):
+        self.live = live.order_by()
+        self.archived = archived.order_by()
+        # Defaults to the ordering the live side was given, e.g. by the ordering filter
+        self.ordering = tuple(live.query.order_by if ordering is None else ordering)
+        self.model = live.model
+
+    def filter(self, *args, **kwargs):
+        return ActivityHistory(self.live.filter(*args, **kwargs), self.archived.filter(*args, **kwargs), self.ordering)
+
+    def exclude(self, *args, **kwargs):
+        return ActivityHistory(self.live.exclude(*args, **kwargs), self.archived.exclude(*args, **kwargs), self.ordering)
+
+    def order_by(self, *fields):
+        return ActivityHistory(self.live, self.archived, fields)
+
+    def all(self):
+        return self
+
+    @property
+    def ordered(self):
+        return bool(self.ordering)
+
+    def get(self, *args, **kwargs):
+        return self.filter(*args, **kwargs).combined().get()
+
+    def combined(self):
+        queryset = self.live.union(self.archived, all=True)
+        return queryset.order_by(*self.ordering) if self.ordering else queryset
+
+    def __getitem__(self, key):
+        return self.combined()[key]
+
+    def __iter__(self):
+        return iter(self.combined())
+
+    def __len__(self):
+        return len(self.combined())
+
+    def __getattr__(self, name):
+        # count(), exists(), values_list(), iterator() ... are supported on the union itself
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.combined(), name)
+
+
+def user_history(user):
+    """All of the user's activities, live and archived, as one ActivityHistory."""
+    return ActivityHistory(Activity.objects.filter(user=user), ArchivedActivity.objects.filter(user=user))
+
+
+def archive_batch(horizon, after=0, batch_size=None):
+    """
+    Moves up to `batch_size` activities dated before `horizon`, with ids above
+    `after`, into the archive in one transaction. Rows are deleted without signals:
+    the rollups, stats and change markers still count them, as they remain readable.
+    Returns the number of activities moved and the last id moved.
+    """
+    batch_size = batch_size or settings.ACTIVITY_ARCHIVE_BATCH_SIZE
+    with transaction.atomic():
+        due = Activity.objects.filter(date__lt=horizon, pk__gt=after).order_by('pk')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)  # Leave rows being edited for the next run
+        rows = list(due.values_list(*ARCHIVE_FIELDS)[:batch_size])
+        if not rows:
+            return 0, after
+        ArchivedActivity.objects.bulk_create(ArchivedActivity(*row) for row in rows)
+        delete_without_signals(Activity, [row[0] for row in rows])
+    return len(rows), rows[-1][0]
+
+
+def delete_without_signals(model, ids):
+    """Deletes the rows with the given ids with one DELETE, sending no signals and cascading nothing."""
+    table, pk = (connection.ops.quote_name(name) for name in (model._meta.db_table, model._meta.pk.column))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {pk} IN ({", ".join(["%s"] * len(ids))})', ids)
+
+
+def restore_activity(user, pk):
+    """
+    Moves one of the user's archived activities back to the Activity table, so it
+    can be edited or deleted like any other, and returns whether it was found. No
+    signals are sent: the rollups and stats still count archived activities. The
+    next archive run moves it back if it is still past the horizon.
+    """
+    with transaction.atomic():
+        archived = ArchivedActivity.objects.filter(user=user, pk=pk).first()
+        if archived is None:
+            return False
+        Activity.objects.bulk_create([Activity(**{name: getattr(archived, name) for name in ARCHIVE_FIELDS})])
+        # The insert gave the activity today's date (auto_now_add), put the original one back
+        Activity.objects.filter(pk=archived.pk).update(date=archived.date)
+        delete_without_signals(ArchivedActivity, [archived.pk])
+    return True
+
+
+def archive_activities(max_batches=None, batch_size=None, progress=None):
+    """
+    Archives the activities older than the horizon, batch by batch in id order. Each
+    batch is committed on its own, so an interrupted run loses no work and the next
+    run resumes with the activities that are left. `progress` is called with the
+    running total after each batch. Returns the number of activities moved.
+    """
+    horizon = archive_horizon()
+    if horizon is None:
+        return 0
+    moved = batches = last_id = 0
+    while max_batches is None or batches < max_batches:
+        count, last_id = archive_batch(horizon, last_id, batch_size)
+        if not count:
+            break
+        moved += count
+        batches += 1
+        if progress:
+            progress(moved)
+    return moved
+
+
+@register(ARCHIVE_JOB, every=settings.ACTIVITY_ARCHIVE_INTERVAL)
+def archive_activities_job(payloads):
+    archive_activities(max_batches=settings.ACTIVITY_ARCHIVE_MAX_BATCHES)
@@ -0,0 +1,97 @@
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.http import require_GET
+from rest_framework.response import Response
+from .caching import acached_metrics
+from .conditional import achange_marker, aconditional_response, make_etag
+from .rollups import ametrics_since, awindow_expiry
+from .serializers import ActivityMetricsSerializer
+from .streams import authenticated_user
+from .views import ActivityMetricsView, ActivityViewSet, NotificationViewSet
+
+MEDIA_TYPE = 'application/json'
+
+
+async def viewset_list(viewset_class, request):
+    """
+    Answers a list request exactly as the list action of `viewset_class` does (its
+    authentication, permission and throttle checks, get_queryset() and filter
+    backends, pagination class and error responses), with the conditional GET of
+    ConditionalGetMixin. The checks and the page read run in a worker thread, as
+    the async ORM runs its queries; the change marker is read with the async ORM.
+    """
+    view = viewset_class(action_map={'get': 'list'}, args=(), kwargs={})
+    view.headers = view.default_response_headers
+    request = view.request = view.initialize_request(request)
+    try:
+        await sync_to_async(view.initial)(request)
+        resource = view.conditional_resource
+        writes, changed_at = await achange_marker(request.user.pk, resource)
+        etag = make_etag(
+            resource, request.user.pk, writes, changed_at, request.get_full_path(), request.accepted_media_type,
+        )
+
+        async def respond():
+            queryset = view.filter_queryset(view.get_queryset())
+            page = await sync_to_async(view.paginate_queryset)(queryset)
+            return view.get_paginated_response(view.get_serializer(page, many=True).data)
+
+        response = await aconditional_response(request, etag, changed_at, respond)
+    except Exception as exc:
+        response = view.handle_exception(exc)
+    response = view.finalize_response(request, response)
+    # Rendered here rather than by the handler, which would render it in a thread
+    return response.render() if isinstance(response, Response) else response
+
+
+@require_GET
+async def activity_list(request):
+    """
+    Async version of the activity list: the user's activities as ActivityViewSet
+    lists them, with its filters, ordering, archive reads and pagination (page
+    numbers, or keyset pages with `?cursor=`).
+    """
+    return await viewset_list(ActivityViewSet, request)
+
+
+@require_GET
+async def notification_list(request):
+    """Async version of the notification list, as NotificationViewSet lists them."""
+    return await viewset_list(NotificationViewSet, request)
+
+
+@require_GET
+async def activity_metrics(request):
+    """
+    Async version of ActivityMetricsView: the user's total duration, distance and
+    calories over the `?period=` ('weekly' or 'monthly'), summed with aaggregate()
+    on a miss of the metrics cache, which both versions share.
+    """
+    user, error = await authenticated_user(request, throttle=True)
+    if error is not None:
+        return error
+
+    period = request.GET.get('period', 'weekly')
+    if period not in ActivityMetricsView.PERIODS:
+        return JsonResponse({"error": "Invalid period specified. Use 'weekly' or 'monthly'."}, status=400)
+    length = ActivityMetricsView.PERIODS[period]
+
+    async def compute():
+        start_date = timezone.now() - length
+        metrics = await ametrics_since(user, start_date)
+        data = ActivityMetricsSerializer({
+            'period': period,
+            'total_duration': timedelta(minutes=metrics['total_duration']),  # Durations are stored in minutes
+            'total_distance': metrics['total_distance'],
+            'total_calories': metrics['total_calories'],
+        }).data
+        return dict(data), await awindow_expiry(user, start_date, length)
+
+    metrics_data, etag, last_modified = await acached_metrics(user.pk, 'period', {'period': period}, compute)
+
+    async def respond():
+        return JsonResponse(metrics_data)
+
+    return await aconditional_response(request, make_etag(etag, MEDIA_TYPE), last_modified, respond)
@@ -0,0 +1,697 @@
+import asyncio
+import math
+import os
+import platform
+import sqlite3
+import tempfile
+import threading
+import statistics
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import BytesIO
+from urllib.parse import urlencode
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory, override_settings
+from django.test.utils import (
+    CaptureQueriesContext, setup_databases, setup_test_environment, teardown_databases,
+    teardown_test_environment,
+)
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import RefreshToken
+from .authentication import CachedJWTAuthentication
+from .database import WAL_PRAGMAS, sqlite_pragmas
+from .seeding import seed
+from .analytics import track_analytics
+from .models import Activity, ActivityTrack
+from .throttling import TokenBucketThrottle, throttle_cache
+from .tracks import EARTH_RADIUS_KM, empty_columns, pack_track, read_track
+
+User = get_user_model()
+
+
+@contextmanager
+def benchmark_database():
+    """
+    Runs the enclosed benchmark against a throwaway test database, so benchmarks
+    never read or write the real data. Rate limits are disabled, so only the
+    request path is measured.
+    """
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+    try:
+        with override_settings(THROTTLE_RATES={}):
+            yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def authenticated_client(username='benchmark'):
+    """Returns an API client logged in as a (new) benchmark user, and that user."""
+    user = User.objects.create_user(username=username, email=f'{username}@example.com', password='benchmark')
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client, user
+
+
+def throughput(count, seconds):
+    return {'seconds': round(seconds, 4), 'items_per_second': round(count / seconds, 1) if seconds else None}
+
+
+def compare_ingestion(count):
+    """
+    Uploads `count` activities once as individual POSTs and once as a single bulk
+    request, returning the throughput of both paths.
+    """
+    client, _ = authenticated_client('ingestion')
+    payload = [
+        {'activity_type': 'Running', 'duration': 30 + i % 60, 'distance': 5.0, 'calories_burned': 300}
+        for i in range(count)
+    ]
+
+    start = time.perf_counter()
+    for item in payload:
+        client.post(reverse('activity-list'), item, format='json')
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    client.post(reverse('activity-bulk-create'), payload, format='json')
+    bulk = time.perf_counter() - start
+
+    return {
+        'items': count,
+        'single_post': throughput(count, single),
+        'bulk': throughput(count, bulk),
+        'speedup': round(single / bulk, 1) if bulk else None,
+    }
+
+
+def percentile(ordered, q):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, queries):
+    """Summarizes per-request latencies (seconds) and query counts."""
+    ordered = sorted(latencies)
+    total = sum(ordered)
+    return {
+        'requests': len(ordered),
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+        'mean_ms': round(total / len(ordered) * 1000, 3),
+        'throughput_rps': round(len(ordered) / total, 1) if total else None,
+        'queries_per_request': round(statistics.mean(queries), 2),
+    }
+
+
+def measure(send, iterations, before_each=None):
+    """
+    Calls `send(i)` `iterations` times, timing each request and counting its queries.
+    `before_each` runs untimed before every request (e.g. to clear a cache).
+    """
+    latencies, queries = [], []
+    for i in range(iterations):
+        if before_each:
+            before_each()
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = send(i)
+            latencies.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            raise RuntimeError(f"Benchmark request failed with {response.status_code}: {response.content[:200]}")
+        queries.append(len(captured))
+    return summarize(latencies, queries)
+
+
+def token_client(user):
+    """Returns an API client sending a real JWT, so authentication is part of what is measured."""
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+    return client
+
+
+# name: (request sender, setup run before each request, iteration cap)
+SCENARIOS = {
+    'activity_list': (lambda client, user, i: client.get(reverse('activity-list')), None, None),
+    'activity_list_cursor': (lambda client, user, i: client.get(reverse('activity-list'), {'cursor': ''}), None, None),
+    'activity_create': (
+        lambda client, user, i: client.post(reverse('activity-list'), {
+            'activity_type': 'Running', 'duration': 30 + i % 30, 'distance': 5.0, 'calories_burned': 300,
+        }, format='json'),
+        None, None,
+    ),
+    'metrics': (lambda client, user, i: client.get(reverse('activity-metrics'), {'period': 'monthly'}), None, None),
+    'metrics_uncached': (
+        lambda client, user, i: client.get(reverse('activity-metrics'), {'period': 'monthly'}), cache.clear, None,
+    ),
+    'notification_list': (lambda client, user, i: client.get(reverse('notification-list')), None, None),
+    # Password hashing dominates logins, so fewer iterations are enough
+    'token': (
+        lambda client, user, i: APIClient().post(reverse('token_obtain_pair'), {
+            'username': user.username, 'password': 'benchmark',
+        }),
+        None, 5,
+    ),
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes, users=5, iterations=50, scenarios=None):
+    """
+    Runs the benchmark scenarios at several data sizes (activities per user), each on a
+    freshly seeded throwaway database, and returns machine-readable results.
+    """
+    scenarios = scenarios or list(SCENARIOS)
+    results = []
+    for size in sizes:
+        with benchmark_database():
+            seeded = seed(users, size, max(1, size // 10), seed=size, prefix='bench')
+            user = seeded[0]
+            client = token_client(user)
+            for name in scenarios:
+                send, before_each, cap = SCENARIOS[name]
+                count = min(iterations, cap) if cap else iterations
+                summary = measure(lambda i: send(client, user, i), count, before_each)
+                results.append({'scenario': name, 'activities_per_user': size, 'users': users, **summary})
+
+    return {'meta': suite_meta(), 'results': results}
+
+
+def suite_meta(**extra):
+    """What a benchmark ran against, so results of different commits and machines can be compared."""
+    return {
+        'commit': git_commit(),
+        'timestamp': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        **extra,
+    }
+
+
+def compare_authentication(iterations=1000):
+    """
+    Authenticates the same JWT request `iterations` times with the stock
+    JWTAuthentication and with CachedJWTAuthentication, reporting the latency and
+    queries spent in authentication alone.
+    """
+    user = User.objects.create_user(username='auth-bench', email='auth-bench@example.com', password='benchmark')
+    token = str(RefreshToken.for_user(user).access_token)
+    request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    results = {}
+    for name, authentication in [('jwt', JWTAuthentication), ('cached_jwt', CachedJWTAuthentication)]:
+        authenticator = authentication()
+        latencies, queries = [], []
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                authenticator.authenticate(Request(request))
+                latencies.append(time.perf_counter() - start)
+            queries.append(len(captured))
+        results[name] = summarize(latencies, queries)
+    return results
+
+
+# name: (pragmas, BEGIN statement); 'stock' is what a new SQLite connection gets without tuning
+SQLITE_CONFIGS = {
+    'stock': ({'journal_mode': 'DELETE', 'synchronous': 'FULL'}, 'BEGIN'),
+    'tuned': (None, 'BEGIN IMMEDIATE'),  # SQLITE_PRAGMAS with WAL (as with SQLITE_WAL=1) and the transaction_mode from settings
+}
+
+SQLITE_SCHEMA = [
+    'CREATE TABLE activity (id INTEGER PRIMARY KEY, user_id INTEGER, day TEXT, distance REAL)',
+    'CREATE TABLE rollup (user_id INTEGER, day TEXT, activity_count INTEGER, total_distance REAL, '
+    'PRIMARY KEY (user_id, day))',
+]
+
+
+def sqlite_writer(path, pragmas, begin, user_id, writes, barrier, latencies, failures):
+    """
+    Performs `writes` transactions shaped like an activity create: read the rollup
+    bucket, insert the activity, then update or create the bucket. Failed
+    transactions are rolled back and counted, as a request would fail with them.
+    """
+    db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    sqlite_pragmas(db.cursor(), pragmas)
+    barrier.wait()
+    for i in range(writes):
+        day = f'2024-01-{i % 28 + 1:02d}'
+        start = time.perf_counter()
+        try:
+            db.execute(begin)
+            row = db.execute('SELECT activity_count FROM rollup WHERE user_id = ? AND day = ?', (user_id, day)).fetchone()
+            db.execute('INSERT INTO activity (user_id, day, distance) VALUES (?, ?, 5.0)', (user_id, day))
+            if row:
+                db.execute('UPDATE rollup SET activity_count = activity_count + 1, total_distance = total_distance + 5.0 '
+                           'WHERE user_id = ? AND day = ?', (user_id, day))
+            else:
+                db.execute('INSERT INTO rollup VALUES (?, ?, 1, 5.0)', (user_id, day))
+            db.execute('COMMIT')
+            latencies.append(time.perf_counter() - start)
+        except sqlite3.OperationalError:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            failures.append(time.perf_counter() - start)
+    db.close()
+
+
+def sqlite_reader(path, pragmas, stop, barrier, reads):
+    """Sums a user's distance over and over while the writers run."""
+    db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    sqlite_pragmas(db.cursor(), pragmas)
+    barrier.wait()
+    while not stop.is_set():
+        try:
+            db.execute('SELECT SUM(distance) FROM activity WHERE user_id = 0').fetchone()
+            reads.append(1)
+        except sqlite3.OperationalError:
+            pass
+    db.close()
+
+
+def compare_sqlite_writers(threads=8, writes=200, readers=2):
+    """
+    Runs `threads` concurrent writers (plus `readers` readers) against a fresh SQLite
+    file, once with stock connection settings and once with the tuned pragmas and
+    BEGIN IMMEDIATE, reporting committed and failed writes, write latency and throughput.
+    """
+    results = {}
+    for name, (pragmas, begin) in SQLITE_CONFIGS.items():
+        pragmas = {**settings.SQLITE_PRAGMAS, **WAL_PRAGMAS} if pragmas is None else pragmas
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'writers.sqlite3')
+            setup = sqlite3.connect(path, isolation_level=None)
+            sqlite_pragmas(setup.cursor(), pragmas)
+            for statement in SQLITE_SCHEMA:
+                setup.execute(statement)
+            setup.close()
+
+            latencies, failures, reads = [], [], []
+            stop = threading.Event()
+            barrier = threading.Barrier(threads + readers + 1)
+            workers = [
+                threading.Thread(target=sqlite_writer, args=(path, pragmas, begin, n, writes, barrier, latencies, failures))
+                for n in range(threads)
+            ] + [
+                threading.Thread(target=sqlite_reader, args=(path, pragmas, stop, barrier, reads))
+                for _ in range(readers)
+            ]
+            for worker in workers:
+                worker.start()
+            barrier.wait()
+            start = time.perf_counter()
+            for worker in workers[:threads]:
+                worker.join()
+            elapsed = time.perf_counter() - start
+            stop.set()
+            for worker in workers[threads:]:
+                worker.join()
+
+        ordered = sorted(latencies) or [0]
+        results[name] = {
+            'committed': len(latencies),
+            'failed': len(failures),
+            'writes_per_second': round(len(latencies) / elapsed, 1),
+            'reads_per_second': round(len(reads) / elapsed, 1),
+            'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+        }
+    return {'threads': threads, 'writes_per_thread': writes, 'readers': readers, **results}
+
+
+# Trackpoints the import must read per second: a 300k-point recording in under a second
+TRACK_POINTS_PER_SECOND = 300_000
+
+
+def gpx_document(points):
+    """A GPX file of `points` one-second trackpoints with elevation and heart rate, as devices write them."""
+    start = 1714550400
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n<gpx version="1.1" creator="benchmark" '
+        'xmlns="http://www.topografix.com/GPX/1/1" '
+        'xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1">\n'
+        '<trk><type>running</type><trkseg>\n'
+    ]
+    for i in range(points):
+        lines.append(
+            f'<trkpt lat="{52 + i * 1e-5:.7f}" lon="{13 + i * 1e-5:.7f}"><ele>{30 + i % 50:.1f}</ele>'
+            f'<time>{time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(start + i))}</time>'
+            f'<extensions><gpxtpx:TrackPointExtension><gpxtpx:hr>{120 + i % 60}</gpxtpx:hr>'
+            f'</gpxtpx:TrackPointExtension></extensions></trkpt>\n'
+        )
+    lines.append('</trkseg></trk>\n</gpx>\n')
+    return ''.join(lines).encode()
+
+
+def compare_track_imports(sizes, iterations=3):
+    """
+    Parses and imports generated GPX files of each size in `sizes` (trackpoints),
+    reporting the best of `iterations` parse times (with the route length), the
+    end-to-end import request and the packed size against the file size. Fails
+    when parsing is slower than TRACK_POINTS_PER_SECOND, with a second allowed
+    for small files.
+    """
+    client, _ = authenticated_client('tracks')
+    results = {}
+    for points in sizes:
+        document = gpx_document(points)
+        parse_times = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            track = read_track(BytesIO(document))
+            track.distance
+            parse_times.append(time.perf_counter() - start)
+        budget = max(points, TRACK_POINTS_PER_SECOND) / TRACK_POINTS_PER_SECOND
+        if min(parse_times) > budget:
+            raise RuntimeError(f"Reading {points} trackpoints took {min(parse_times):.2f}s, over {budget:.2f}s.")
+
+        start = time.perf_counter()
+        response = client.generic('POST', reverse('activity-import-track'), document, content_type='application/gpx+xml')
+        request_seconds = time.perf_counter() - start
+        if response.status_code >= 400:
+            raise RuntimeError(f"Benchmark import failed with {response.status_code}: {response.content[:200]}")
+
+        results[str(points)] = {
+            'file_bytes': len(document),
+            'packed_bytes': len(pack_track(track.columns)),
+            'parse': throughput(points, min(parse_times)),
+            'import_request': throughput(points, request_seconds),
+        }
+    return results
+
+
+def ultra_track(points):
+    """
+    Track columns of an ultra-distance run sampled every second, with the pace
+    and heart rate drifting over the hours: a 24-hour race is 86,400 points.
+    """
+    columns = empty_columns()
+    degrees_per_km = 180 / (math.pi * EARTH_RADIUS_KM)
+    lat = 45.0
+    for i in range(points):
+        speed = 3.0 - math.sin(i / 1800) * 0.8 - i / points  # m/s, slowing down over the race
+        lat += speed / 1000 * degrees_per_km
+        columns['lat'].append(lat)
+        columns['lon'].append(6.0 + math.sin(i / 600) * 0.001)
+        columns['elevation'].append(1000 + math.sin(i / 900) * 300)
+        columns['time'].append(1714550400.0 + i)
+        columns['heart_rate'].append(int(135 + math.sin(i / 1800) * 15 + (i % 7)))
+    return columns
+
+
+def compare_analytics(sizes, iterations=3):
+    """
+    Computes the analytics of generated ultra-distance tracks of each size in
+    `sizes` (points), reporting the best of `iterations` computations, and the
+    analytics request without and with a cached result.
+    """
+    client, user = authenticated_client('analytics')
+    results = {}
+    for points in sizes:
+        columns = ultra_track(points)
+        compute_times = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            analytics = track_analytics(columns, 'Running', settings.ACTIVITY_MAX_HEART_RATE)
+            compute_times.append(time.perf_counter() - start)
+
+        activity = Activity.objects.create(
+            user=user, activity_type='Running', duration=max(1, points // 60),
+            distance=analytics['distance'], calories_burned=0,
+        )
+        ActivityTrack.objects.create(activity=activity, user=user, point_count=points, data=pack_track(columns))
+        url = reverse('activity-analytics', args=[activity.pk])
+        results[str(points)] = {
+            'distance_km': analytics['distance'],
+            'compute': throughput(points, min(compute_times)),
+            'request_uncached': measure(lambda i: client.get(url), 1),
+            'request_cached': measure(lambda i: client.get(url), iterations),
+        }
+    return results
+
+
+def compare_throttling(iterations=1000):
+    """
+    Measures the rate limiter's own cost: the throttle check alone, on allowed and
+    on rejected requests, and the activity list request with and without rate
+    limits, using the cache configured by THROTTLE_CACHE_ALIAS.
+    """
+    client, user = authenticated_client('throttle')
+    request = Request(RequestFactory().get('/'))
+    request.user = user
+    throttle_cache().clear()
+
+    checks = {}
+    for name, rate in [('allowed', f'{iterations * 10}/s'), ('rejected', '1/day')]:
+        with override_settings(THROTTLE_RATES={'read': rate}):
+            TokenBucketThrottle().allow_request(request, None)  # Creates the bucket, so only steady state is timed
+            latencies = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                TokenBucketThrottle().allow_request(request, None)
+                latencies.append(time.perf_counter() - start)
+        checks[name] = summarize(latencies, [0])
+        throttle_cache().clear()
+
+    url = reverse('activity-list')
+    with override_settings(THROTTLE_RATES={}):
+        unthrottled = measure(lambda i: client.get(url), iterations)
+    with override_settings(THROTTLE_RATES={'read': f'{iterations * 10}/s'}):
+        throttled = measure(lambda i: client.get(url), iterations)
+    return {
+        'cache_backend': settings.CACHES[settings.THROTTLE_CACHE_ALIAS]['BACKEND'],
+        'check': checks,
+        'activity_list': {'unthrottled': unthrottled, 'throttled': throttled},
+        'overhead_p50_ms': round(throttled['p50_ms'] - unthrottled['p50_ms'], 3),
+    }
+
+
+# name: (sync view, async view, query parameters), compared by the 'asgi' suite
+SERVER_SCENARIOS = {
+    'activity_list': ('activity-list', 'async-activity-list', {}),
+    'notification_list': ('notification-list', 'async-notification-list', {}),
+    'metrics': ('activity-metrics', 'async-activity-metrics', {'period': 'monthly'}),
+}
+
+
+@contextmanager
+def simulated_db_latency(seconds):
+    """
+    Delays every query of the connections opened in the enclosed block by `seconds`,
+    standing in for the network round trip to a database server, which the
+    in-process SQLite test database does not have.
+    """
+    def delay(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        connection.execute_wrappers.insert(0, delay)
+
+    if seconds:
+        connection_created.connect(install)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(install)
+
+
+def concurrent_summary(latencies, statuses, seconds):
+    """Summarizes the requests of a concurrent run; throughput is requests per second of wall time."""
+    failed = [code for code in statuses if code >= 400]
+    if failed:
+        raise RuntimeError(f"Benchmark request failed with {failed[0]}")
+    summary = summarize(latencies, [0])
+    del summary['queries_per_request']  # Queries run in many threads, which CaptureQueriesContext does not see
+    summary['throughput_rps'] = round(len(latencies) / seconds, 1)
+    return summary
+
+
+def serve_wsgi(path, query, tokens, requests, concurrency, threads):
+    """
+    Serves `requests` GETs with Django's WSGI handler to `concurrency` clients
+    sending one request after another, while at most `threads` requests are
+    handled at a time, as by a threaded WSGI server (gunicorn's gthread worker).
+    Requests wait for a free thread in arrival order, and latencies include that wait.
+    """
+    handler = WSGIHandler()
+    factory = RequestFactory()
+    latencies, statuses = [], []
+
+    def serve(environ):
+        status = []
+        body = handler(environ, lambda code, headers, exc_info=None: status.append(code))
+        b''.join(body)
+        body.close()
+        return int(status[0].split()[0])
+
+    def client(first):
+        for i in range(first, requests, concurrency):
+            environ = factory.get(path, query, headers={'Authorization': f'Bearer {tokens[i % len(tokens)]}'}).environ
+            start = time.perf_counter()
+            statuses.append(workers.submit(serve, environ).result())
+            latencies.append(time.perf_counter() - start)
+
+    clients = [threading.Thread(target=client, args=(first,)) for first in range(concurrency)]
+    with ThreadPoolExecutor(threads) as workers:
+        start = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+    return concurrent_summary(latencies, statuses, time.perf_counter() - start)
+
+
+async def asgi_request(handler, path, query, token):
+    """Sends one GET through an ASGI application, returning its status once the whole body was sent."""
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'root_path': '', 'query_string': query.encode(),
+        'headers': [(b'host', b'testserver'), (b'authorization', f'Bearer {token}'.encode())],
+        'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+    }
+    received, status = False, []
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await asyncio.get_running_loop().create_future()  # The client stays connected
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await handler(scope, receive, send)
+    return status[0]
+
+
+def serve_asgi(path, query, tokens, requests, concurrency):
+    """
+    Serves `requests` GETs with Django's ASGI handler to `concurrency` clients
+    sending one request after another, all on one event loop, as a single
+    uvicorn worker would.
+    """
+    handler = ASGIHandler()
+    query = urlencode(query)
+    latencies, statuses = [], []
+
+    async def client(first):
+        for i in range(first, requests, concurrency):
+            start = time.perf_counter()
+            statuses.append(await asgi_request(handler, path, query, tokens[i % len(tokens)]))
+            latencies.append(time.perf_counter() - start)
+
+    async def run():
+        await asyncio.gather(*(client(first) for first in range(concurrency)))
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    return concurrent_summary(latencies, statuses, time.perf_counter() - start)
+
+
+def compare_servers(sizes, users=5, requests=1000, concurrency=256, threads=8, db_latency_ms=1.0):
+    """
+    Serves each read-heavy endpoint to `concurrency` concurrent clients twice: the
+    sync view through the WSGI handler with `threads` worker threads, and its async
+    version through the ASGI handler. Reports latency percentiles and throughput
+    of both at each data size, with `db_latency_ms` added to every query.
+    """
+    results = []
+    for size in sizes:
+        with benchmark_database():
+            seeded = seed(users, size, max(1, size // 10), seed=size, prefix='bench')
+            tokens = [str(RefreshToken.for_user(user).access_token) for user in seeded]
+            with simulated_db_latency(db_latency_ms / 1000):
+                for name, (sync_view, async_view, query) in SERVER_SCENARIOS.items():
+                    wsgi = serve_wsgi(reverse(sync_view), query, tokens, requests, concurrency, threads)
+                    asgi = serve_asgi(reverse(async_view), query, tokens, requests, concurrency)
+                    results.append({
+                        'scenario': name, 'activities_per_user': size, 'users': users, 'wsgi': wsgi, 'asgi': asgi,
+                        'throughput_ratio': round(asgi['throughput_rps'] / wsgi['throughput_rps'], 2),
+                    })
+    return {
+        'meta': suite_meta(concurrency=concurrency, wsgi_threads=threads, db_latency_ms=db_latency_ms),
+        'results': results,
+    }
+
+
+def endpoints_suite(options):
+    return run_suite(options['sizes'], users=options['users'], iterations=options['iterations'],
+                     scenarios=options['scenarios'])
+
+
+def ingest_suite(options):
+    with benchmark_database():
+        return compare_ingestion(options['iterations'])
+
+
+def auth_suite(options):
+    with benchmark_database():
+        return compare_authentication(options['iterations'])
+
+
+def tracks_suite(options):
+    with benchmark_database():
+        return compare_track_imports(options['sizes'])
+
+
+def analytics_suite(options):
+    with benchmark_database():
+        return compare_analytics(options['sizes'])
+
+
+def throttle_suite(options):
+    with benchmark_database():
+        return compare_throttling(options['iterations'])
+
+
+def asgi_suite(options):
+    return compare_servers(options['sizes'], users=options['users'], requests=options['iterations'],
+                           concurrency=options['concurrency'], threads=options['threads'],
+                           db_latency_ms=options['db_latency'])
+
+
+def writers_suite(options):
+    return compare_sqlite_writers(threads=options['threads'], writes=options['iterations'])
+
+
+# Suites selectable with `manage.py benchmark --suite`
+SUITES = {
+    'endpoints': endpoints_suite,
+    'ingest': ingest_suite,
+    'auth': auth_suite,
+    'writers': writers_suite,
+    'tracks': tracks_suite,
+    'analytics': analytics_suite,
+    'throttle': throttle_suite,
+    'asgi': asgi_suite,
+}
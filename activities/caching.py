@@ -0,0 +1,189 @@
+import hashlib
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from .conditional import achange_marker, change_marker, make_etag
+
+
+class CacheStats:
+    """Thread-safe in-process hit and miss counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def snapshot(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {'hits': hits, 'misses': misses, 'hit_ratio': round(hits / total, 4) if total else None}
+
+    def reset(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+metrics_cache_stats = CacheStats()
+
+
+def metrics_cache():
+    return caches[settings.METRICS_CACHE_ALIAS]
+
+
+def _version_key(namespace, owner_id):
+    return f'{namespace}:version:{owner_id}'
+
+
+def cache_version(cache, namespace, owner_id):
+    """
+    Returns the current cache version of an owner (a user, an activity) in a
+    namespace. A missing version starts at the current time in nanoseconds rather
+    than 1, so a version lost to eviction can never come back and match entries
+    cached before it was lost.
+    """
+    key = _version_key(namespace, owner_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def acache_version(cache, namespace, owner_id):
+    """Async version of cache_version()."""
+    key = _version_key(namespace, owner_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_cache_version(cache, namespace, owner_id):
+    """Moves the owner to a new cache version, orphaning every entry cached under the old one."""
+    key = _version_key(namespace, owner_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def metrics_version(user_id):
+    """Returns the current metrics cache version of a user."""
+    return cache_version(metrics_cache(), 'metrics', user_id)
+
+
+def invalidate_metrics(user_id):
+    """Moves the user to a new metrics cache version, orphaning every cached entry of theirs."""
+    bump_cache_version(metrics_cache(), 'metrics', user_id)
+
+
+def _params_digest(params):
+    return hashlib.md5(repr(sorted(params.items())).encode()).hexdigest()
+
+
+def _is_fresh(entry, now):
+    return entry is not None and (entry['valid_until'] is None or entry['valid_until'] > now)
+
+
+def _metrics_entry(user_id, name, digest, marker, data, valid_until):
+    writes, changed_at = marker
+    return {
+        'data': data,
+        'valid_until': valid_until,
+        'etag': make_etag('metrics', user_id, name, digest, writes, changed_at, valid_until),
+        'last_modified': changed_at,
+    }
+
+
+def _metrics_timeout(valid_until, now):
+    timeout = settings.METRICS_CACHE_TIMEOUT
+    if valid_until is not None:
+        timeout = min(timeout, max(1, int((valid_until - now) / timedelta(seconds=1)) + 1))
+    return timeout
+
+
+def cached_metrics(user_id, name, params, compute):
+    """
+    Returns `(data, etag, last_modified)` for the user, metric name and parameters,
+    computing and caching the result on a miss. `compute` returns `(data, valid_until)`
+    where `valid_until` is the moment the result would change without any write (for
+    example when an activity slides out of a "last 7 days" window), or None.
+    """
+    cache = metrics_cache()
+    digest = _params_digest(params)
+    key = f'metrics:{user_id}:{metrics_version(user_id)}:{name}:{digest}'
+    now = timezone.now()
+
+    entry = cache.get(key)
+    if _is_fresh(entry, now):
+        metrics_cache_stats.record(hit=True)
+        return entry['data'], entry['etag'], entry['last_modified']
+
+    metrics_cache_stats.record(hit=False)
+    # Read the marker before computing, so a concurrent write can only make the ETag older than the data
+    marker = change_marker(user_id, 'activities')
+    data, valid_until = compute()
+    entry = _metrics_entry(user_id, name, digest, marker, data, valid_until)
+    cache.set(key, entry, _metrics_timeout(valid_until, now))
+    return data, entry['etag'], entry['last_modified']
+
+
+async def acached_metrics(user_id, name, params, compute):
+    """
+    Async version of cached_metrics(), sharing its cache entries: `compute` is a
+    coroutine function, and the cache is read and written with its async methods.
+    """
+    cache = metrics_cache()
+    digest = _params_digest(params)
+    key = f'metrics:{user_id}:{await acache_version(cache, "metrics", user_id)}:{name}:{digest}'
+    now = timezone.now()
+
+    entry = await cache.aget(key)
+    if _is_fresh(entry, now):
+        metrics_cache_stats.record(hit=True)
+        return entry['data'], entry['etag'], entry['last_modified']
+
+    metrics_cache_stats.record(hit=False)
+    marker = await achange_marker(user_id, 'activities')
+    data, valid_until = await compute()
+    entry = _metrics_entry(user_id, name, digest, marker, data, valid_until)
+    await cache.aset(key, entry, _metrics_timeout(valid_until, now))
+    return data, entry['etag'], entry['last_modified']
+
+
+def analytics_cache():
+    return caches[settings.ANALYTICS_CACHE_ALIAS]
+
+
+def invalidate_analytics(activity_id):
+    """Drops every cached analytics result of the activity, e.g. once its samples change."""
+    bump_cache_version(analytics_cache(), 'analytics', activity_id)
+
+
+def cached_analytics(activity_id, params, compute):
+    """
+    Returns the analytics of an activity for the given parameters, computing and
+    caching them on a miss. `compute` may return None (nothing to analyse), which
+    is not cached.
+    """
+    cache = analytics_cache()
+    digest = _params_digest(params)
+    key = f'analytics:{activity_id}:{cache_version(cache, "analytics", activity_id)}:{digest}'
+    data = cache.get(key)
+    if data is None:
+        data = compute()
+        if data is not None:
+            cache.set(key, data, settings.ANALYTICS_CACHE_TIMEOUT)
+    return data
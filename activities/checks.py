@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Caches whose entries are invalidated or counted across requests, so every process must see the same ones
+SHARED_CACHE_SETTINGS = (
+    'METRICS_CACHE_ALIAS',  # Versioned metrics keys, bumped on activity writes
+    'ANALYTICS_CACHE_ALIAS',  # Track analytics, dropped when a track changes
+    'AUTH_USER_CACHE_ALIAS',  # Users resolved from JWTs, evicted when a User changes
+    'THROTTLE_CACHE_ALIAS',  # Rate limit token buckets
+    'REPLICA_PIN_CACHE_ALIAS',  # Users whose reads stay on the primary after a write
+)
+PROCESS_LOCAL_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_caches(app_configs, **kwargs):
+    """
+    Warns (with `manage.py check --deploy`) when a cache that must be shared by all
+    processes is process-local: an invalidation or eviction made by one process would
+    not reach the others, which would serve stale metrics or deleted users' tokens.
+    """
+    warnings = []
+    for name in SHARED_CACHE_SETTINGS:
+        alias = getattr(settings, name)
+        if settings.CACHES[alias]['BACKEND'] in PROCESS_LOCAL_BACKENDS:
+            warnings.append(Warning(
+                f"{name} uses the process-local cache '{alias}'.",
+                hint="Point CACHE_BACKEND/CACHE_LOCATION at a shared cache such as Redis or Memcached "
+                     "when running more than one process.",
+                id='activities.W001',
+            ))
+    return warnings
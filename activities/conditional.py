@@ -0,0 +1,96 @@
+import hashlib
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from .models import ChangeMarker
+
+# resource: (write counter field, last change field)
+MARKER_FIELDS = {
+    'activities': ('activity_writes', 'activities_changed_at'),
+    'notifications': ('notification_writes', 'notifications_changed_at'),
+}
+
+
+def touch(user_id, resource):
+    """Records a write to one of the user's resources ('activities' or 'notifications')."""
+    writes, changed_at = MARKER_FIELDS[resource]
+    changes = {writes: F(writes) + 1, changed_at: timezone.now()}
+
+    if not ChangeMarker.objects.filter(user_id=user_id).update(**changes):
+        try:
+            with transaction.atomic():
+                ChangeMarker.objects.create(user_id=user_id, **{writes: 1, changed_at: changes[changed_at]})
+        except IntegrityError:
+            ChangeMarker.objects.filter(user_id=user_id).update(**changes)
+
+
+def change_marker(user_id, resource):
+    """Returns `(write count, last change)` of one of the user's resources, `(0, None)` before any write."""
+    marker = ChangeMarker.objects.filter(user_id=user_id).values_list(*MARKER_FIELDS[resource]).first()
+    return marker or (0, None)
+
+
+async def achange_marker(user_id, resource):
+    """Async version of change_marker()."""
+    marker = await ChangeMarker.objects.filter(user_id=user_id).values_list(*MARKER_FIELDS[resource]).afirst()
+    return marker or (0, None)
+
+
+def make_etag(*parts):
+    """Builds a strong ETag from the given parts."""
+    return quote_etag(hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest())
+
+
+def conditional_response(request, etag, last_modified, handler):
+    """
+    Returns `304 Not Modified` when the request's validators match, without calling
+    `handler`; otherwise returns `handler()` with ETag and Last-Modified headers set.
+    """
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = handler()
+    return set_validators(response, etag, timestamp)
+
+
+async def aconditional_response(request, etag, last_modified, handler):
+    """Async version of conditional_response(), awaiting `handler()`."""
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = await handler()
+    return set_validators(response, etag, timestamp)
+
+
+def set_validators(response, etag, timestamp):
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag/Last-Modified support to a viewset's list and retrieve actions. The
+    validators come from the user's change marker for `conditional_resource`, the
+    request path and the negotiated media type, so an unchanged resource is answered
+    with a 304 before any queryset is evaluated or serialized.
+    """
+    conditional_resource = None
+
+    def conditional_get(self, request, handler, *args, **kwargs):
+        writes, changed_at = change_marker(request.user.pk, self.conditional_resource)
+        etag = make_etag(
+            self.conditional_resource, request.user.pk, writes, changed_at,
+            request.get_full_path(), request.accepted_media_type,
+        )
+        return conditional_response(request, etag, changed_at, lambda: handler(request, *args, **kwargs))
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_get(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_get(request, super().retrieve, *args, **kwargs)
@@ -0,0 +1,15 @@
+from django.conf import settings
+
+# The pragmas SQLITE_WAL adds to SQLITE_PRAGMAS
+WAL_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL'}
+
+
+def sqlite_pragmas(cursor, pragmas=None):
+    """
+    Applies SQLITE_PRAGMAS (or the given pragmas) to a new SQLite connection: a
+    busy timeout so writers wait for the lock instead of failing and, with
+    SQLITE_WAL, WAL so readers no longer block on writers and synchronous=NORMAL,
+    which is durable under WAL for everything but a power loss.
+    """
+    for name, value in (settings.SQLITE_PRAGMAS if pragmas is None else pragmas).items():
+        cursor.execute(f'PRAGMA {name} = {value}')
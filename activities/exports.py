@@ -0,0 +1,33 @@
+import csv
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+
+EXPORT_FIELDS = ['id', 'activity_type', 'duration', 'distance', 'calories_burned', 'date']
+
+
+class Echo:
+    """A file-like object whose write() hands the written line straight back, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, username):
+    """Yields the CSV header and one CSV line per (values_list) row."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(['user'] + EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow([username, *row[:-1], row[-1].isoformat()])
+
+
+def ndjson_lines(rows, username):
+    """Yields one JSON document per (values_list) row, newline terminated."""
+    for row in rows:
+        yield json.dumps({'user': username, **dict(zip(EXPORT_FIELDS, row))}, cls=DjangoJSONEncoder) + '\n'
+
+
+EXPORT_FORMATS = {
+    # output: (line generator, content type, file extension)
+    'csv': (csv_lines, 'text/csv', 'csv'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson', 'ndjson'),
+}
@@ -0,0 +1,115 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from .jobs import register
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+PURGE_JOB = 'idempotency_key_purge'
+# Responses that are not stored, as a retry may succeed
+RETRYABLE_STATUSES = (status.HTTP_409_CONFLICT, status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+def request_fingerprint(request):
+    """SHA-256 of the request's method, path and parsed body, to tell a retry from another request reusing its key."""
+    body = json.dumps(request.data, sort_keys=True, separators=(',', ':'), cls=DjangoJSONEncoder)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def replay(stored, fingerprint):
+    """The response to a request whose key is already stored."""
+    if stored.fingerprint != fingerprint:
+        return Response(
+            {"error": f"This {IDEMPOTENCY_HEADER} was already used for a different request."},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    if stored.status_code is None:
+        return Response(
+            {"error": f"A request with this {IDEMPOTENCY_HEADER} is still being processed."},
+            status=status.HTTP_409_CONFLICT,
+        )
+    response = Response(stored.response, status=stored.status_code)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotent(view_method):
+    """
+    Makes a view method safe to retry when the client sends an Idempotency-Key
+    header. The first request claims the key (one indexed lookup, then an insert
+    that the unique constraint settles between concurrent requests) and stores
+    its response; retries with the same key and body get that response back,
+    marked with an Idempotent-Replayed header, without running the view again.
+    Responses asking for a retry (conflicts and server errors) and exceptions
+    release the key, so the request can be retried.
+    Requests without the header are handled as usual.
+    """
+    @wraps(view_method)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return view_method(view, request, *args, **kwargs)
+        if not key or len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            return Response(
+                {"error": f"{IDEMPOTENCY_HEADER} must be between 1 and 255 characters."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        fingerprint = request_fingerprint(request)
+        now = timezone.now()
+        stored = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+        if stored is not None:
+            expired = stored.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+            # A claim never completed, e.g. by a worker that died, is taken over eventually
+            abandoned = stored.status_code is None and (
+                stored.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_PENDING_TIMEOUT)
+            )
+            if not (expired or abandoned):
+                return replay(stored, fingerprint)
+            stored.delete()
+
+        try:
+            with transaction.atomic():
+                claim = IdempotencyKey.objects.create(user=request.user, key=key, fingerprint=fingerprint)
+        except IntegrityError:
+            # Claimed by a concurrent request with the same key, which may have released it since
+            stored = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+            if stored is None:
+                return Response(
+                    {"error": f"A request with this {IDEMPOTENCY_HEADER} failed; retry it."},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            return replay(stored, fingerprint)
+
+        try:
+            response = view_method(view, request, *args, **kwargs)
+        except BaseException:
+            claim.delete()
+            raise
+        if response.status_code in RETRYABLE_STATUSES or response.status_code >= 500:
+            claim.delete()
+        else:
+            claim.status_code, claim.response = response.status_code, response.data
+            claim.save(update_fields=['status_code', 'response'])
+        return response
+    return wrapper
+
+
+def purge_idempotency_keys():
+    """Deletes the keys older than IDEMPOTENCY_KEY_TTL. Returns the number of keys deleted."""
+    horizon = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=horizon).delete()
+    return deleted
+
+
+@register(PURGE_JOB, every=settings.IDEMPOTENCY_PURGE_INTERVAL)
+def purge_idempotency_keys_job(payloads):
+    purge_idempotency_keys()
@@ -0,0 +1,178 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Upper bounds of the histogram buckets for each recorded measurement
+BUCKETS = {
+    'wall_seconds': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'db_seconds': (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    'db_queries': (0, 1, 2, 3, 5, 10, 20, 50, 100, 200),
+    'serializer_seconds': (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+    'response_bytes': (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+}
+
+current_record = ContextVar('current_request_record', default=None)
+
+
+class Histogram:
+    """A fixed-bucket histogram (Prometheus style): a count per bucket, plus the total count and sum."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last slot counts values above every bound
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimates a quantile as the upper bound of the bucket holding it."""
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+class RequestRecord:
+    """Measurements collected while a single request is being handled."""
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    A connection.execute_wrapper() hook counting and timing the queries of the
+    request being recorded. It stays installed on every connection (see
+    install_query_recorder) and finds the request through `current_record`, so
+    it also sees the queries the async ORM runs in worker threads, whose
+    connections a per-request wrapper could not reach.
+    """
+    record = current_record.get()
+    if record is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record.db_seconds += time.perf_counter() - start
+        record.db_queries += 1
+
+
+def install_query_recorder(connection):
+    """Installs record_query on a connection, once."""
+    if record_query not in connection.execute_wrappers:
+        # First in the list, so wrappers pushed and popped by execute_wrapper() stay last
+        connection.execute_wrappers.insert(0, record_query)
+
+
+class RequestStats:
+    """In-process histograms of request measurements, kept per view."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.views = {}
+
+    def observe(self, view, measurements, over_budget=False):
+        with self._lock:
+            stats = self.views.get(view)
+            if stats is None:
+                stats = self.views[view] = {
+                    'histograms': {name: Histogram(bounds) for name, bounds in BUCKETS.items()},
+                    'over_query_budget': 0,
+                }
+            for name, value in measurements.items():
+                if value is not None:
+                    stats['histograms'][name].observe(value)
+            if over_budget:
+                stats['over_query_budget'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                view: {
+                    'requests': stats['histograms']['wall_seconds'].count,
+                    'over_query_budget': stats['over_query_budget'],
+                    **{name: histogram.snapshot() for name, histogram in stats['histograms'].items()},
+                }
+                for view, stats in sorted(self.views.items())
+            }
+
+    def prometheus(self):
+        """Renders every histogram in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name in BUCKETS:
+                metric = f'fitness_request_{name}'
+                lines += [f'# HELP {metric} Per-request {name.replace("_", " ")}.', f'# TYPE {metric} histogram']
+                for view, stats in sorted(self.views.items()):
+                    histogram = stats['histograms'][name]
+                    cumulative = 0
+                    for bound, count in zip(histogram.bounds + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{metric}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{metric}_sum{{view="{view}"}} {histogram.sum}')
+                    lines.append(f'{metric}_count{{view="{view}"}} {histogram.count}')
+            metric = 'fitness_request_over_query_budget_total'
+            lines += [f'# HELP {metric} Requests that ran more queries than the budget.', f'# TYPE {metric} counter']
+            for view, stats in sorted(self.views.items()):
+                lines.append(f'{metric}{{view="{view}"}} {stats["over_query_budget"]}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self.views = {}
+
+
+request_stats = RequestStats()
+
+
+@contextmanager
+def serializer_timer():
+    """Adds the time spent in the enclosed block to the current request's serializer time."""
+    record = current_record.get()
+    if record is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record.serializer_seconds += time.perf_counter() - start
+
+
+def view_name(request):
+    """
+    Names the view that handled the request, e.g. 'ActivityViewSet.list' or
+    'ActivityMetricsView.get'.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is None:
+        return match.func.__name__
+    actions = getattr(match.func, 'actions', None) or {}
+    handler = actions.get(request.method.lower(), request.method.lower())
+    return f'{view_class.__name__}.{handler}'
@@ -0,0 +1,227 @@
+import logging
+import threading
+import traceback
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# kind: handler called with the payloads of a batch of claimed jobs of that kind
+JOB_HANDLERS = {}
+# kind: seconds between runs, for jobs that reschedule themselves
+PERIODIC_JOBS = {}
+
+
+def register(kind, every=None):
+    """
+    Registers a batch handler for a job kind. With `every` (seconds) the job is
+    periodic: each successful run queues the next one.
+    """
+    def decorator(handler):
+        JOB_HANDLERS[kind] = handler
+        if every is not None:
+            PERIODIC_JOBS[kind] = every
+        return handler
+    return decorator
+
+
+def reschedule(kind):
+    """
+    Queues the next run of a periodic job kind, unless one is already pending: the
+    unique_pending_periodic_job constraint keeps a single run per kind, so
+    concurrent schedulers cannot multiply it.
+    """
+    if kind in PERIODIC_JOBS:
+        run_after = timezone.now() + timedelta(seconds=PERIODIC_JOBS[kind])
+        Job.objects.bulk_create([Job(kind=kind, periodic=True, run_after=run_after)], ignore_conflicts=True)
+
+
+def ensure_periodic_jobs():
+    """Queues a run of every periodic job kind that has none pending, e.g. after its last run failed."""
+    active = set(
+        Job.objects.filter(kind__in=PERIODIC_JOBS, status__in=[Job.PENDING, Job.RUNNING])
+        .values_list('kind', flat=True)
+    )
+    Job.objects.bulk_create(
+        (Job(kind=kind, periodic=True) for kind in PERIODIC_JOBS if kind not in active), ignore_conflicts=True,
+    )
+
+
+def enqueue(payloads):
+    """
+    Queues one job per payload of each kind in `payloads` ({kind: [payload, ...]})
+    with a single insert, inside the current transaction, so the jobs only exist if
+    the write that caused them commits, and wakes the workers on commit.
+    """
+    jobs = Job.objects.bulk_create(
+        Job(kind=kind, payload=payload) for kind, kind_payloads in payloads.items() for payload in kind_payloads
+    )
+    if jobs:
+        transaction.on_commit(wake_workers)
+    return jobs
+
+
+def claim(batch_size):
+    """
+    Marks up to `batch_size` due jobs as running under a fresh claim token and
+    returns them. Jobs left running past JOB_LOCK_TIMEOUT (their worker died) are
+    claimed again. The token makes claiming safe even on databases without
+    SELECT ... FOR UPDATE SKIP LOCKED: only rows this call actually updated are returned.
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    claimable = (
+        Q(status=Job.PENDING, run_after__lte=now)
+        | Q(status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT))
+    )
+
+    with transaction.atomic():
+        due = Job.objects.filter(claimable).order_by('run_after', 'pk')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list('pk', flat=True)[:batch_size])
+        Job.objects.filter(claimable, pk__in=ids).update(
+            status=Job.RUNNING, locked_by=token, locked_at=now, attempts=F('attempts') + 1,
+        )
+    return list(Job.objects.filter(locked_by=token).order_by('pk'))
+
+
+def retry_delay(attempts):
+    """Exponential backoff between attempts: 2, 4, 8, ... seconds, capped at an hour."""
+    return timedelta(seconds=min(2 ** attempts, 3600))
+
+
+def execute(kind, jobs):
+    """
+    Runs the handler of `kind` on the jobs and deletes them in the same transaction
+    as the handler's writes. On failure the jobs are retried later, or marked
+    failed after JOB_MAX_ATTEMPTS. Returns whether the handler succeeded.
+    """
+    ids = [job.pk for job in jobs]
+    try:
+        handler = JOB_HANDLERS[kind]
+        with transaction.atomic():
+            handler([job.payload for job in jobs])
+            Job.objects.filter(pk__in=ids).delete()
+            reschedule(kind)
+        return True
+    except Exception:
+        logger.exception("%d %s job(s) failed", len(jobs), kind)
+        error = traceback.format_exc()
+        attempts = max(job.attempts for job in jobs)
+        if attempts >= settings.JOB_MAX_ATTEMPTS:
+            Job.objects.filter(pk__in=ids).update(status=Job.FAILED, locked_by='', last_error=error)
+        else:
+            Job.objects.filter(pk__in=ids).update(
+                status=Job.PENDING, locked_by='', last_error=error,
+                run_after=timezone.now() + retry_delay(attempts),
+            )
+        return False
+
+
+def run_jobs(batch_size=None):
+    """
+    Claims a batch of due jobs and runs them with one handler call per job kind.
+    When a batch fails, its jobs are run one by one, so a single bad job does not
+    hold back the others. Returns the number of jobs claimed.
+    """
+    jobs = claim(batch_size or settings.JOB_BATCH_SIZE)
+    by_kind = {}
+    for job in jobs:
+        by_kind.setdefault(job.kind, []).append(job)
+
+    for kind, batch in by_kind.items():
+        if len(batch) == 1:
+            execute(kind, batch)
+            continue
+        try:
+            with transaction.atomic():
+                JOB_HANDLERS[kind]([job.payload for job in batch])
+                Job.objects.filter(pk__in=[job.pk for job in batch]).delete()
+                reschedule(kind)
+            continue
+        except Exception:
+            logger.warning("Batch of %d %s jobs failed, running them one by one", len(batch), kind, exc_info=True)
+        for job in batch:
+            execute(kind, [job])
+    return len(jobs)
+
+
+class WorkerPool:
+    """
+    In-process worker threads draining the job queue. Workers sleep until woken
+    by a commit that queued jobs, or for JOB_POLL_INTERVAL seconds so jobs queued
+    by other processes and retries that became due are picked up too.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.threads = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.threads:
+                return
+            self._stop.clear()
+            for number in range(self.size):
+                thread = threading.Thread(target=self.work, name=f'job-worker-{number}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def wake(self):
+        self._wake.set()
+
+    def work(self):
+        try:
+            ensure_periodic_jobs()
+        except Exception:
+            logger.exception("Could not schedule the periodic jobs")
+        while not self._stop.is_set():
+            try:
+                claimed = run_jobs()
+            except Exception:
+                logger.exception("Job worker iteration failed")
+                claimed = 0
+            finally:
+                close_old_connections()
+            if not claimed:
+                self._wake.wait(settings.JOB_POLL_INTERVAL)
+                self._wake.clear()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def worker_pool():
+    """Returns the process-wide worker pool, started on first use. None when JOB_WORKERS is 0."""
+    global _pool
+    if not settings.JOB_WORKERS:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = WorkerPool(settings.JOB_WORKERS)
+                _pool.start()
+    return _pool
+
+
+def wake_workers():
+    pool = worker_pool()
+    if pool is not None:
+        pool.wake()
@@ -0,0 +1,183 @@
+from datetime import date, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Q, Sum
+from django.utils import timezone
+from .jobs import register
+from .models import ActivityRollup, LeaderboardEntry
+from .rollups import activity_day, bucket_start
+
+# metric: rollup field it is summed from
+METRICS = {
+    'distance': 'total_distance',
+    'duration': 'total_duration',
+    'calories': 'total_calories',
+}
+ALL_TYPES = ''  # activity_type of the leaderboard combining every activity type
+
+LEADERBOARD_UPDATE_JOB = 'leaderboard_update'
+LEADERBOARD_REFRESH_JOB = 'leaderboard_refresh'
+
+
+def ranked_weeks(today=None):
+    """Returns the start of every week that has leaderboards, newest first."""
+    current = bucket_start(today or timezone.localdate(), 'week')
+    return [current - timedelta(weeks=n) for n in range(settings.LEADERBOARD_WEEKS)]
+
+
+def affected_weeks(*activities):
+    """The ranked weeks the given activities fall into, as ISO dates for job payloads."""
+    weeks = set(ranked_weeks())
+    return sorted({
+        week.isoformat() for week in (bucket_start(activity_day(activity.date), 'week') for activity in activities)
+        if week in weeks
+    })
+
+
+def weekly_totals(week, user_ids=None):
+    """
+    Sums the rollups of a week into `{(activity type, user id): {metric: value}}`,
+    including the all-types leaderboard under ALL_TYPES.
+    """
+    rollups = ActivityRollup.objects.filter(day__gte=week, day__lt=week + timedelta(weeks=1))
+    if user_ids is not None:
+        rollups = rollups.filter(user_id__in=user_ids)
+    rows = rollups.values('activity_type', 'user_id').annotate(
+        **{metric: Sum(field) for metric, field in METRICS.items()}
+    ).order_by()
+
+    totals = {}
+    for row in rows:
+        for activity_type in (row['activity_type'], ALL_TYPES):
+            values = totals.setdefault((activity_type, row['user_id']), dict.fromkeys(METRICS, 0))
+            for metric in METRICS:
+                values[metric] += row[metric]
+    return totals
+
+
+def refresh_week(week):
+    """
+    Recomputes every leaderboard of a week from the rollups with one grouped query,
+    ranking users by each metric (ties go to the lower user id). Returns the number
+    of entries written.
+    """
+    boards = {}
+    for (activity_type, user_id), values in weekly_totals(week).items():
+        boards.setdefault(activity_type, []).append((user_id, values))
+
+    entries = []
+    for activity_type, users in boards.items():
+        ranks = {user_id: {} for user_id, _ in users}
+        for metric in METRICS:
+            ordered = sorted(users, key=lambda item: (-item[1][metric], item[0]))
+            for rank, (user_id, _) in enumerate(ordered, start=1):
+                ranks[user_id][f'{metric}_rank'] = rank
+        entries += [
+            LeaderboardEntry(week=week, activity_type=activity_type, user_id=user_id, **values, **ranks[user_id])
+            for user_id, values in users
+        ]
+
+    with transaction.atomic():
+        LeaderboardEntry.objects.filter(week=week).delete()
+        LeaderboardEntry.objects.bulk_create(entries, batch_size=settings.LEADERBOARD_BATCH_SIZE)
+    return len(entries)
+
+
+def refresh_leaderboards(today=None):
+    """Rebuilds the leaderboards of every ranked week and drops older weeks."""
+    weeks = ranked_weeks(today)
+    LeaderboardEntry.objects.filter(week__lt=weeks[-1]).delete()
+    return sum(refresh_week(week) for week in weeks)
+
+
+def board(week, activity_type):
+    return LeaderboardEntry.objects.filter(week=week, activity_type=activity_type)
+
+
+def reposition(entry, metric, old_rank):
+    """
+    Moves an entry whose `metric` changed from `old_rank` to its new place,
+    shifting only the entries between the two positions by one.
+    """
+    value = getattr(entry, metric)
+    field = f'{metric}_rank'
+    others = board(entry.week, entry.activity_type).exclude(pk=entry.pk)
+    ahead = others.filter(Q(**{f'{metric}__gt': value}) | Q(**{metric: value, 'user_id__lt': entry.user_id})).count()
+    new_rank = ahead + 1
+
+    if new_rank < old_rank:
+        others.filter(**{f'{field}__gte': new_rank, f'{field}__lt': old_rank}).update(**{field: F(field) + 1})
+    elif new_rank > old_rank:
+        others.filter(**{f'{field}__gt': old_rank, f'{field}__lte': new_rank}).update(**{field: F(field) - 1})
+    setattr(entry, field, new_rank)
+
+
+def update_user(user_id, week):
+    """
+    Brings one user's entries for a week in line with their rollups. Entries are
+    added at the bottom, removed, or moved in rank without re-ranking whole boards.
+    """
+    totals = weekly_totals(week, [user_id])
+    entries = {entry.activity_type: entry for entry in LeaderboardEntry.objects.filter(week=week, user_id=user_id)}
+
+    for activity_type in set(entries) | {activity_type for activity_type, _ in totals}:
+        values = totals.get((activity_type, user_id))
+        entry = entries.get(activity_type)
+        if values is None:
+            # No activity left on this board: close the gap below the entry
+            for metric in METRICS:
+                field = f'{metric}_rank'
+                board(week, activity_type).filter(**{f'{field}__gt': getattr(entry, field)}).update(
+                    **{field: F(field) - 1}
+                )
+            entry.delete()
+            continue
+
+        if entry is None:
+            last = board(week, activity_type).aggregate(
+                **{metric: Max(f'{metric}_rank') for metric in METRICS}
+            )
+            entry = LeaderboardEntry(week=week, activity_type=activity_type, user_id=user_id, **{
+                f'{metric}_rank': (last[metric] or 0) + 1 for metric in METRICS
+            })
+        old_ranks = {metric: getattr(entry, f'{metric}_rank') for metric in METRICS}
+        changed = [metric for metric in METRICS if entry.pk is None or getattr(entry, metric) != values[metric]]
+        for metric, value in values.items():
+            setattr(entry, metric, value)
+        entry.save()
+        for metric in changed:
+            reposition(entry, metric, old_ranks[metric])
+        entry.save(update_fields=[f'{metric}_rank' for metric in METRICS])
+
+
+@register(LEADERBOARD_UPDATE_JOB)
+def apply_leaderboard_updates(payloads):
+    """
+    Applies a batch of activity writes to the leaderboards, once per user and week.
+    Drift from updates racing each other is repaired by the next full refresh.
+    """
+    weeks = set(ranked_weeks())
+    pairs = {
+        (payload['user_id'], date.fromisoformat(week)) for payload in payloads for week in payload['weeks']
+    }
+    for user_id, week in sorted(pairs):
+        if week in weeks:
+            with transaction.atomic():
+                update_user(user_id, week)
+
+
+@register(LEADERBOARD_REFRESH_JOB, every=settings.LEADERBOARD_REFRESH_INTERVAL)
+def refresh_leaderboards_job(payloads):
+    refresh_leaderboards()
+
+
+def top(week, activity_type, metric, limit):
+    """The first `limit` entries of a leaderboard, read in rank order from its index."""
+    return list(
+        board(week, activity_type).select_related('user').order_by(f'{metric}_rank')[:limit]
+    )
+
+
+def rank_of(user_id, week, activity_type):
+    """A user's entry on a leaderboard (with all their ranks), or None if they are not on it."""
+    return board(week, activity_type).select_related('user').filter(user_id=user_id).first()
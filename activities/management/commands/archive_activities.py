@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from activities.archive import archive_activities, archive_horizon
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves activities older than ACTIVITY_ARCHIVE_AFTER_DAYS into the archive table, in batches. "
+        "Every batch is committed on its own, so an interrupted run can simply be started again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.ACTIVITY_ARCHIVE_BATCH_SIZE,
+                            help="Activities moved per transaction.")
+        parser.add_argument('--max-batches', type=int, help="Stop after this many batches.")
+
+    def handle(self, *args, **options):
+        horizon = archive_horizon()
+        if horizon is None:
+            raise CommandError("Archival is disabled: set ACTIVITY_ARCHIVE_AFTER_DAYS.")
+
+        self.stdout.write(f"Archiving activities before {horizon.isoformat()}")
+        moved = archive_activities(
+            max_batches=options['max_batches'], batch_size=options['batch_size'],
+            progress=lambda moved: self.stdout.write(f"Archived {moved} activities"),
+        )
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} activities."))
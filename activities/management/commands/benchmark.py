@@ -0,0 +1,41 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from activities.benchmarks import SCENARIOS, SUITES
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a benchmark suite on throwaway databases and reports the results as JSON. The default "
+        "'endpoints' suite measures the main API endpoints at several data sizes (p50/p95/p99 latency, "
+        "throughput and queries per request)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--suite', default='endpoints', choices=sorted(SUITES), help="Benchmark suite to run.")
+        parser.add_argument('--sizes', default='100,1000',
+                            help="Comma separated activities per user (trackpoints per file for 'tracks'), one run each.")
+        parser.add_argument('--users', type=int, default=5, help="Seeded users per run.")
+        parser.add_argument('--iterations', type=int, default=50, help="Requests (or items) per scenario.")
+        parser.add_argument('--threads', type=int, default=8,
+                            help="Concurrent writers in the 'writers' suite, WSGI worker threads in the 'asgi' suite.")
+        parser.add_argument('--concurrency', type=int, default=256, help="Concurrent clients in the 'asgi' suite.")
+        parser.add_argument('--db-latency', type=float, default=1.0,
+                            help="Milliseconds added to every query in the 'asgi' suite, standing in for the network.")
+        parser.add_argument('--scenario', action='append', dest='scenarios', choices=sorted(SCENARIOS),
+                            help="Only run the given endpoint scenario(s).")
+        parser.add_argument('--output', help="Write the JSON results to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        try:
+            options['sizes'] = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError("--sizes must be a comma separated list of integers.")
+
+        results = SUITES[options['suite']](options)
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote results to {options['output']}"))
+        else:
+            self.stdout.write(output)
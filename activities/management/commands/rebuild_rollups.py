@@ -0,0 +1,44 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from activities.models import ActivityRollup
+from activities.rollups import rebuild_rollups
+from activities.stats import rebuild_stats
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Rebuilds (or backfills) the activity rollups and user stats from the raw Activity table, in batches of users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of users rebuilt per transaction.")
+        parser.add_argument('--user', action='append', dest='usernames', help="Only rebuild the given user(s).")
+        parser.add_argument(
+            '--backfill', action='store_true',
+            help="Only build rollups for users that have activities but no rollups yet.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        has_activities = Q(activities__isnull=False) | Q(archived_activities__isnull=False)
+        if options['backfill']:
+            users = User.objects.filter(has_activities).exclude(
+                pk__in=ActivityRollup.objects.values('user_id')
+            )
+        else:
+            # Users with stale rollups but no activities left are rebuilt too, which clears them
+            users = User.objects.filter(has_activities | Q(activity_rollups__isnull=False))
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        users = users.distinct()
+
+        user_ids = list(users.order_by('pk').values_list('pk', flat=True))
+        written = 0
+        for offset in range(0, len(user_ids), batch_size):
+            batch = user_ids[offset:offset + batch_size]
+            written += rebuild_rollups(batch)
+            rebuild_stats(batch)
+            self.stdout.write(f"Rebuilt {min(offset + batch_size, len(user_ids))}/{len(user_ids)} users")
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} rollup buckets for {len(user_ids)} users."))
@@ -0,0 +1,30 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from activities.jobs import WorkerPool, ensure_periodic_jobs, run_jobs
+
+
+class Command(BaseCommand):
+    help = "Runs background jobs from the database queue, for deployments that keep them out of the web processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help="Number of worker threads.")
+        parser.add_argument('--once', action='store_true', help="Run every due job, then exit.")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            ensure_periodic_jobs()
+            total = 0
+            while claimed := run_jobs():
+                total += claimed
+            self.stdout.write(self.style.SUCCESS(f"Ran {total} jobs."))
+            return
+
+        pool = WorkerPool(options['workers'])
+        pool.start()
+        self.stdout.write(f"Running jobs with {options['workers']} workers, press CTRL-C to stop.")
+        try:
+            while True:
+                time.sleep(settings.JOB_POLL_INTERVAL)
+        except KeyboardInterrupt:
+            pool.stop()
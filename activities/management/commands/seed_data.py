@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from activities.seeding import seed
+
+
+class Command(BaseCommand):
+    help = "Seeds synthetic users with activities and notifications spread over the past year, using bulk inserts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="Number of users to create.")
+        parser.add_argument('--activities', type=int, default=200, help="Activities per user.")
+        parser.add_argument('--notifications', type=int, default=20, help="Notifications per user.")
+        parser.add_argument('--days', type=int, default=365, help="How far back activity dates are spread.")
+        parser.add_argument('--seed', type=int, default=None, help="Random seed, for reproducible data.")
+        parser.add_argument('--prefix', default='seed', help="Username prefix of the created users.")
+
+    def handle(self, *args, **options):
+        users = seed(
+            options['users'], options['activities'], options['notifications'],
+            days=options['days'], seed=options['seed'], prefix=options['prefix'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(users)} users with {options['activities']} activities "
+            f"and {options['notifications']} notifications each."
+        ))
@@ -0,0 +1,106 @@
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from whitenoise.middleware import WhiteNoiseMiddleware
+from .instrumentation import RequestRecord, current_record, install_query_recorder, request_stats, view_name
+
+logger = logging.getLogger(__name__)
+
+
+class RequestInstrumentationMiddleware:
+    """
+    Records, for every request, the resolved view, wall time, number and duration of
+    database queries, serializer time and response size into in-process histograms
+    (see activities.instrumentation). Requests running more queries than
+    REQUEST_QUERY_BUDGET are logged and flagged with an X-Query-Budget-Exceeded header.
+    Runs in both the sync (WSGI) and async (ASGI) middleware chains.
+
+    Enabled with the REQUEST_INSTRUMENTATION setting.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        # Connections opened from now on get the query recorder from the connection_created signal
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        record = RequestRecord()
+        token = current_record.set(record)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_record.reset(token)
+        return self.observe(request, response, record, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        record = RequestRecord()
+        token = current_record.set(record)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_record.reset(token)
+        return self.observe(request, response, record, time.perf_counter() - start)
+
+    def observe(self, request, response, record, wall_seconds):
+        view = view_name(request)
+        budget = settings.REQUEST_QUERY_BUDGET
+        over_budget = budget is not None and record.db_queries > budget
+        if over_budget:
+            logger.warning("%s ran %d queries (budget %d): %s", view, record.db_queries, budget, request.path)
+            response['X-Query-Budget-Exceeded'] = f'{record.db_queries}/{budget}'
+
+        request_stats.observe(view, {
+            'wall_seconds': wall_seconds,
+            'db_seconds': record.db_seconds,
+            'db_queries': record.db_queries,
+            'serializer_seconds': record.serializer_seconds,
+            # Streaming responses are not buffered, so their size is unknown here
+            'response_bytes': None if response.streaming else len(response.content),
+        }, over_budget=over_budget)
+        return response
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise's static file serving, usable in both the sync (WSGI) and async
+    (ASGI) middleware chains. WhiteNoise's own middleware is sync-only, and a
+    single sync-only middleware makes Django run every middleware and view of an
+    ASGI request in a worker thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('activity_type', models.CharField(choices=[('Running', 'Running'), ('Cycling', 'Cycling'), ('Swimming', 'Swimming'), ('Walking', 'Walking'), ('Weightlifting', 'Weightlifting')], max_length=100)),
+                ('day', models.DateField()),
+                ('activity_count', models.PositiveIntegerField(default=0)),
+                ('total_duration', models.IntegerField(default=0)),
+                ('total_distance', models.FloatField(default=0)),
+                ('total_calories', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'activity_type', 'day'), name='unique_activity_rollup')],
+            },
+        ),
+    ]
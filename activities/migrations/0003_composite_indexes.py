@@ -0,0 +1,36 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:48
+
+from django.db import migrations, models
+from activities.operations import AddIndexOnline
+
+
+class Migration(migrations.Migration):
+    # Indexes are built concurrently on PostgreSQL, which cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('activities', '0002_activityrollup'),
+    ]
+
+    operations = [
+        AddIndexOnline(
+            model_name='activity',
+            index=models.Index(fields=['user', 'date'], name='activity_user_date_idx'),
+        ),
+        AddIndexOnline(
+            model_name='activity',
+            index=models.Index(fields=['user', 'activity_type', 'date'], name='activity_user_type_date_idx'),
+        ),
+        AddIndexOnline(
+            model_name='activityrollup',
+            index=models.Index(fields=['user', 'day'], name='rollup_user_day_idx'),
+        ),
+        AddIndexOnline(
+            model_name='notification',
+            index=models.Index(fields=['user', 'date'], name='notification_user_date_idx'),
+        ),
+        AddIndexOnline(
+            model_name='notification',
+            index=models.Index(fields=['user', 'is_read', 'date'], name='notification_user_read_idx'),
+        ),
+    ]
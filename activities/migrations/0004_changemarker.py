@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0003_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeMarker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('activity_writes', models.PositiveBigIntegerField(default=0)),
+                ('activities_changed_at', models.DateTimeField(null=True)),
+                ('notification_writes', models.PositiveBigIntegerField(default=0)),
+                ('notifications_changed_at', models.DateTimeField(null=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='change_marker', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0007_userstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('week', models.DateField()),
+                ('activity_type', models.CharField(blank=True, max_length=100)),
+                ('distance', models.FloatField(default=0)),
+                ('duration', models.IntegerField(default=0)),
+                ('calories', models.PositiveIntegerField(default=0)),
+                ('distance_rank', models.PositiveIntegerField()),
+                ('duration_rank', models.PositiveIntegerField()),
+                ('calories_rank', models.PositiveIntegerField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['week', 'activity_type', 'distance_rank'], name='leaderboard_distance_idx'), models.Index(fields=['week', 'activity_type', 'duration_rank'], name='leaderboard_duration_idx'), models.Index(fields=['week', 'activity_type', 'calories_rank'], name='leaderboard_calories_idx')],
+                'constraints': [models.UniqueConstraint(fields=('week', 'activity_type', 'user'), name='unique_leaderboard_entry')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0008_leaderboardentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedActivity',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('activity_type', models.CharField(choices=[('Running', 'Running'), ('Cycling', 'Cycling'), ('Swimming', 'Swimming'), ('Walking', 'Walking'), ('Weightlifting', 'Weightlifting')], max_length=100)),
+                ('duration', models.IntegerField()),
+                ('distance', models.FloatField()),
+                ('calories_burned', models.PositiveIntegerField()),
+                ('date', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_activities', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'date'], name='archived_user_date_idx'), models.Index(fields=['user', 'activity_type', 'date'], name='archived_user_type_date_idx')],
+            },
+        ),
+    ]
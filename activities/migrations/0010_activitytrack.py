@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0009_archivedactivity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('point_count', models.PositiveIntegerField()),
+                ('started_at', models.DateTimeField(null=True)),
+                ('data', models.BinaryField()),
+                ('activity', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='track', to='activities.activity')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_tracks', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0011_idempotency'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='archivedactivity',
+            constraint=models.UniqueConstraint(condition=models.Q(('external_id__isnull', False)), fields=('user', 'external_id'), name='unique_archived_external_id'),
+        ),
+    ]
@@ -1,4 +1,6 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
 class User(AbstractUser):
@@ -31,9 +33,142 @@ class Activity(models.Model):
     distance = models.FloatField() #km or miles
     calories_burned = models.PositiveIntegerField() #ensures the value cannot be negative
     date = models.DateTimeField(auto_now_add=True) #Stores date of activity
+    external_id = models.CharField(max_length=100, null=True, blank=True) #Client's own id, unique per user; retried uploads are recognised by it
+
+    class Meta:
+        constraints = [
+            # Also the index behind the duplicate lookup of uploads
+            models.UniqueConstraint(
+                fields=['user', 'external_id'], condition=models.Q(external_id__isnull=False),
+                name='unique_activity_external_id',
+            ),
+        ]
+        indexes = [
+            # Per-user date range lookups and ordering (activity list, metrics, exports)
+            models.Index(fields=['user', 'date'], name='activity_user_date_idx'),
+            # Same access pattern when also filtering by activity type
+            models.Index(fields=['user', 'activity_type', 'date'], name='activity_user_type_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.activity_type} by {self.user.username} on {self.date}"
+
+class ActivityTrack(models.Model):
+    """
+    The GPS route of an activity: latitude, longitude, elevation, time and heart rate
+    per trackpoint, packed as column arrays into a single binary blob (see
+    activities.tracks) instead of one row per point. The activity reference has no
+    database constraint, so the track stays attached when the activity is archived.
+    """
+
+    activity = models.OneToOneField(Activity, on_delete=models.CASCADE, related_name='track', db_constraint=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='activity_tracks')
+    point_count = models.PositiveIntegerField()
+    started_at = models.DateTimeField(null=True) #Time of the first trackpoint, if the points are timed
+    data = models.BinaryField() #Packed trackpoints
+
+    def __str__(self):
+        return f"Track of activity {self.activity_id} ({self.point_count} points)"
+
+class ArchivedActivity(models.Model):
+    """
+    An activity older than the archive horizon, moved out of the Activity table by
+    activities.archive to keep it and its indexes small. Has the same columns, in
+    the same order, so both tables can be read together with UNION ALL. Archived
+    activities keep their id; edits and deletes move them back first (see
+    activities.archive.restore_activity).
+    """
+
+    id = models.BigIntegerField(primary_key=True) #Id the activity had in the Activity table
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_activities')
+    activity_type = models.CharField(max_length=100, choices=Activity.ACTIVITY_CHOICES)
+    duration = models.IntegerField() #minutes
+    distance = models.FloatField()
+    calories_burned = models.PositiveIntegerField()
+    date = models.DateTimeField()
+    external_id = models.CharField(max_length=100, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # Uploads are deduplicated on the external id across both tables
+            models.UniqueConstraint(
+                fields=['user', 'external_id'], condition=models.Q(external_id__isnull=False),
+                name='unique_archived_external_id',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'date'], name='archived_user_date_idx'),
+            models.Index(fields=['user', 'activity_type', 'date'], name='archived_user_type_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived {self.activity_type} by {self.user_id} on {self.date}"
+
+class ActivityRollup(models.Model):
+    """
+    Pre-aggregated activity totals for one user, activity type and day.
+    Kept up to date incrementally whenever an Activity is saved or deleted, so
+    metrics can be answered without scanning the user's full activity history.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='activity_rollups')
+    activity_type = models.CharField(max_length=100, choices=Activity.ACTIVITY_CHOICES)
+    day = models.DateField() #Day bucket the totals belong to
+    activity_count = models.PositiveIntegerField(default=0)
+    total_duration = models.IntegerField(default=0) #minutes
+    total_distance = models.FloatField(default=0)
+    total_calories = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'activity_type', 'day'], name='unique_activity_rollup'),
+        ]
+        indexes = [
+            # Metrics sum every activity type of a user over a day range
+            models.Index(fields=['user', 'day'], name='rollup_user_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.activity_type} rollup for {self.user_id} on {self.day}"
+
+class UserStats(models.Model):
+    """
+    Lifetime summary of a user's activities: totals, the best distance, duration and
+    calories per activity type, and daily streaks. Maintained incrementally on every
+    activity write (see activities.stats), so it is read with a single-row lookup.
+    """
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='stats')
+    activity_count = models.PositiveIntegerField(default=0)
+    total_duration = models.IntegerField(default=0) #minutes
+    total_distance = models.FloatField(default=0)
+    total_calories = models.PositiveIntegerField(default=0)
+    # {activity type: {field: [best value, activity id]}} for distance, duration and calories_burned
+    records = models.JSONField(default=dict)
+    current_streak = models.PositiveIntegerField(default=0) #Consecutive active days ending on last_active_day
+    longest_streak = models.PositiveIntegerField(default=0)
+    last_active_day = models.DateField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Stats for {self.user_id}"
+
+class ChangeMarker(models.Model):
+    """
+    Per-user change marker for activities and notifications: a write counter and the
+    time of the last write for each. Used to derive ETag and Last-Modified headers
+    without querying or serializing the data itself.
+    """
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='change_marker')
+    activity_writes = models.PositiveBigIntegerField(default=0)
+    activities_changed_at = models.DateTimeField(null=True)
+    notification_writes = models.PositiveBigIntegerField(default=0)
+    notifications_changed_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f"Change marker for {self.user_id}"
+
 class Notification(models.Model):
     """
     Model representing a notification for a user.
@@ -46,5 +181,128 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False) #Indicates if the notification have been read
     notification_type = models.CharField(max_length=20, default='general')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date'], name='notification_user_date_idx'),
+            # Unread notifications of a user, newest first
+            models.Index(fields=['user', 'is_read', 'date'], name='notification_user_read_idx'),
+        ]
+
+    def __str__(self):
+        return f"Notification for {self.user.username}: {self.message[:50]} on {self.date.strftime('%Y-%m-%d')}" #Displays first 50 characters of the message
+
+class NotificationCounter(models.Model):
+    """
+    Denormalized number of unread notifications per user, kept in sync on every
+    notification write so the unread count is a single-row lookup.
+    """
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='notification_counter')
+    unread = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.unread} unread notifications for {self.user_id}"
+
+
+class Job(models.Model):
+    """
+    A unit of background work in the database-backed job queue (see activities.jobs).
+    Jobs are claimed by worker threads, retried with a backoff when their handler
+    fails, and deleted once they succeed.
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)  # Name of the registered handler
+    payload = models.JSONField(default=dict)
+    periodic = models.BooleanField(default=False)  # A run of a periodic kind, which queues the next one
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)  # Not claimed before this moment
+    locked_by = models.CharField(max_length=32, blank=True)  # Claim token of the worker running the job
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # Workers racing to schedule a periodic kind queue a single run of it
+            models.UniqueConstraint(
+                fields=['kind'], condition=models.Q(periodic=True, status='pending'),
+                name='unique_pending_periodic_job',
+            ),
+        ]
+        indexes = [
+            # Workers look up the oldest claimable jobs
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+            models.Index(fields=['locked_by'], name='job_locked_by_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.pk} ({self.status})"
+
+
+class LeaderboardEntry(models.Model):
+    """
+    One user's totals for one week on one leaderboard (all activity types combined,
+    or a single type), with their rank by each metric. Ranks are precomputed by the
+    leaderboard refresh job and kept current by incremental updates in between, so
+    top-K and "my rank" lookups are index seeks (see activities.leaderboards).
+    """
+
+    week = models.DateField() #Monday the week starts on
+    activity_type = models.CharField(max_length=100, blank=True) #Empty for the all-types leaderboard
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='leaderboard_entries')
+    distance = models.FloatField(default=0)
+    duration = models.IntegerField(default=0) #minutes
+    calories = models.PositiveIntegerField(default=0)
+    distance_rank = models.PositiveIntegerField()
+    duration_rank = models.PositiveIntegerField()
+    calories_rank = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['week', 'activity_type', 'user'], name='unique_leaderboard_entry'),
+        ]
+        indexes = [
+            # Top-K reads walk a leaderboard in rank order
+            models.Index(fields=['week', 'activity_type', 'distance_rank'], name='leaderboard_distance_idx'),
+            models.Index(fields=['week', 'activity_type', 'duration_rank'], name='leaderboard_duration_idx'),
+            models.Index(fields=['week', 'activity_type', 'calories_rank'], name='leaderboard_calories_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.activity_type or 'All'} leaderboard entry for {self.user_id} in week {self.week}"
+
+class IdempotencyKey(models.Model):
+    """
+    An Idempotency-Key a user sent with a write, and the response it got. Retries
+    with the same key replay that response instead of repeating the write. Keys
+    expire after IDEMPOTENCY_KEY_TTL and are purged by a periodic job (see
+    activities.idempotency).
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64) #SHA-256 of the method, path and body the key was first used with
+    status_code = models.PositiveSmallIntegerField(null=True) #None while the first request is running
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='idempotency_created_idx'),  # Expiry purge
+        ]
+
     def __str__(self):
-        return f"Notification for {self.user.username}: {self.message[:50]} on {self.date.strftime('%Y-%m-%d')}" #Displays first 50 characters of the message
\ No newline at end of file
+        return f"Idempotency key {self.key} of {self.user_id}"
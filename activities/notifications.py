@@ -0,0 +1,65 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .conditional import touch
+from .models import Notification, NotificationCounter
+from .pubsub import get_broker
+from .routers import use_primary
+from .serializers import NotificationSerializer
+
+
+def adjust_unread(user_id, delta):
+    """Adds `delta` to the user's unread notification counter, creating the counter if needed."""
+    if not delta:
+        return
+    if not NotificationCounter.objects.filter(user_id=user_id).update(unread=F('unread') + delta):
+        try:
+            with transaction.atomic():
+                # A missing counter is initialised from the table, which already includes this change
+                NotificationCounter.objects.create(user_id=user_id, unread=count_unread(user_id))
+        except IntegrityError:
+            NotificationCounter.objects.filter(user_id=user_id).update(unread=F('unread') + delta)
+
+
+def count_unread(user_id):
+    """Counts the user's unread notifications with an indexed query."""
+    return Notification.objects.filter(user_id=user_id, is_read=False).count()
+
+
+def unread_count(user_id):
+    """Returns the user's unread notification count from the counter row, creating it on first use."""
+    unread = NotificationCounter.objects.filter(user_id=user_id).values_list('unread', flat=True).first()
+    if unread is None:
+        # Counted on the primary, since the count is stored there
+        with use_primary():
+            unread = count_unread(user_id)
+            NotificationCounter.objects.get_or_create(user_id=user_id, defaults={'unread': unread})
+    return unread
+
+
+def mark_read(user_id, ids=None):
+    """
+    Marks all of the user's notifications, or only those with the given ids, as read
+    with a single UPDATE. Returns the number of notifications that were unread.
+    """
+    notifications = Notification.objects.filter(user_id=user_id, is_read=False)
+    if ids is not None:
+        notifications = notifications.filter(pk__in=ids)
+
+    with transaction.atomic():
+        updated = notifications.update(is_read=True)
+        if updated:
+            adjust_unread(user_id, -updated)
+            touch(user_id, 'notifications')
+    return updated
+
+
+def stream_key(user_id):
+    """Names the pub/sub channel carrying the user's new notifications."""
+    return f'notifications:{user_id}'
+
+
+def publish(notifications):
+    """Pushes newly created notifications to the streams of their users."""
+    broker = get_broker()
+    for notification in notifications:
+        broker.publish(stream_key(notification.user_id), dict(NotificationSerializer(notification).data))
@@ -0,0 +1,32 @@
+from django.db.migrations import AddIndex
+
+
+class AddIndexOnline(AddIndex):
+    """
+    Adds an index without blocking writes to the table while it is built.
+    On PostgreSQL the index is created with CREATE INDEX CONCURRENTLY, which must
+    run outside a transaction, so migrations using it have to set `atomic = False`.
+    Other databases fall back to a regular CREATE INDEX (MySQL/InnoDB already
+    builds secondary indexes online).
+    """
+
+    atomic = False
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            if schema_editor.connection.vendor == 'postgresql':
+                schema_editor.add_index(model, self.index, concurrently=True)
+            else:
+                schema_editor.add_index(model, self.index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            if schema_editor.connection.vendor == 'postgresql':
+                schema_editor.remove_index(model, self.index, concurrently=True)
+            else:
+                schema_editor.remove_index(model, self.index)
+
+    def describe(self):
+        return f"Create index {self.index.name} online on field(s) {', '.join(self.index.fields)} of model {self.model_name}"
@@ -0,0 +1,50 @@
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+
+
+class HistoryCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (date, id), newest first. Each page is fetched with an
+    indexed range query instead of COUNT(*) plus OFFSET, so walking a long history
+    costs the same for every page.
+    """
+    ordering = ('-date', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100 # Upper bound for client-selected page sizes
+
+
+class HistoryPagination(BasePagination):
+    """
+    Uses cursor pagination when the request carries a `cursor` parameter (an empty
+    `?cursor=` starts from the newest item) and regular page-number pagination
+    otherwise, so existing clients keep their `page`-based responses.
+    """
+    cursor_query_param = HistoryCursorPagination.cursor_query_param
+    cursor_class = HistoryCursorPagination
+    page_number_class = PageNumberPagination
+
+    def __init__(self):
+        self.paginator = self.page_number_class()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params:
+            self.paginator = self.cursor_class()
+        else:
+            self.paginator = self.page_number_class()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.paginator.get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        parameters = self.page_number_class().get_schema_operation_parameters(view)
+        return parameters + self.cursor_class().get_schema_operation_parameters(view)
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.paginator, 'display_page_controls', False)
+
+    def to_html(self):
+        return self.paginator.to_html()
@@ -0,0 +1,47 @@
+import json
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from .tracks import TrackError, read_track
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline-delimited JSON (one JSON document per line) into a list.
+    Blank lines are ignored.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        items = []
+        for line_number, line in enumerate(stream, start=1):
+            line = line.decode(encoding).strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as exc:
+                raise ParseError(f"NDJSON parse error on line {line_number} - {exc}")
+        return items
+
+
+class GPXParser(BaseParser):
+    """
+    Parses a GPX (or TCX) upload into a ParsedTrack while it is read, chunk by
+    chunk, so the file is never held in memory. Both formats are recognised from
+    the document itself; the media types only select the parser.
+    """
+    media_type = 'application/gpx+xml'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return read_track(stream)
+        except TrackError as exc:
+            raise ParseError(str(exc))
+
+
+class TCXParser(GPXParser):
+    media_type = 'application/vnd.garmin.tcx+xml'
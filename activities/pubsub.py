@@ -0,0 +1,108 @@
+import asyncio
+import threading
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class Subscription:
+    """
+    A single listener's bounded message queue, bound to the event loop it was
+    created on. When the listener falls behind and the queue fills up, pending
+    messages are dropped and `overflowed` is set, so the listener can catch up
+    from the database instead of holding an unbounded backlog in memory.
+    """
+
+    def __init__(self, key, maxsize):
+        self.key = key
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def deliver(self, message):
+        """Queues a message; must run on the subscription's loop."""
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.overflowed = True
+
+    async def get(self, timeout=None):
+        """Waits up to `timeout` seconds for the next message, returning None on timeout."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Broker:
+    """
+    Interface of the publish/subscribe backends used to push new notifications to
+    connected clients. `subscribe` and `unsubscribe` are called from async code;
+    `publish` may be called from any thread.
+    """
+
+    def subscribe(self, key, maxsize=None):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+    def publish(self, key, message):
+        raise NotImplementedError
+
+
+class InMemoryBroker(Broker):
+    """
+    A broker delivering messages to subscribers of the current process. Publishing
+    hands each message to the subscriber's own loop with call_soon_threadsafe, so it
+    never blocks on a slow listener.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, key, maxsize=None):
+        subscription = Subscription(key, maxsize or settings.NOTIFICATION_STREAM_QUEUE_SIZE)
+        with self._lock:
+            self._subscriptions.setdefault(key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.key)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.key]
+
+    def subscriber_count(self, key=None):
+        with self._lock:
+            if key is not None:
+                return len(self._subscriptions.get(key, ()))
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def publish(self, key, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(key, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError:
+                # The subscriber's loop is closed, it can no longer receive anything
+                self.unsubscribe(subscription)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Returns the process-wide broker configured by the NOTIFICATION_BROKER setting."""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(settings.NOTIFICATION_BROKER)()
+    return _broker
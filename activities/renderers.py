@@ -0,0 +1,34 @@
+import json
+from rest_framework.renderers import BaseRenderer
+from .instrumentation import request_stats
+
+
+class PassthroughRenderer(BaseRenderer):
+    """
+    Accepts any media type for views that return their own (streaming) Django response,
+    so content negotiation does not reject e.g. `Accept: text/csv`. Error responses
+    produced by DRF are still rendered as JSON.
+    """
+    media_type = '*/*'
+    format = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, (bytes, str)):
+            return data
+        return json.dumps(data)
+
+
+class PrometheusRenderer(BaseRenderer):
+    """
+    Renders the request instrumentation histograms in the Prometheus text format
+    (selected with Accept: text/plain or ?format=prometheus).
+    """
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = renderer_context and renderer_context.get('response')
+        if response is not None and response.exception:
+            return json.dumps(data)
+        return request_stats.prometheus()
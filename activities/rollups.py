@@ -0,0 +1,265 @@
+from datetime import datetime, time, timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DateField, F, Min, Sum
+from django.db.models.functions import Trunc, TruncDate
+from django.utils import timezone
+from .models import Activity, ActivityRollup
+from .archive import activity_models
+
+ROLLUP_FIELDS = ('activity_count', 'total_duration', 'total_distance', 'total_calories')
+
+
+def activity_day(date):
+    """Returns the day bucket (in the current time zone) an activity date falls into."""
+    return timezone.localdate(date)
+
+
+def start_of_day(day):
+    """Returns the aware datetime at which the given day begins."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def adjust_rollup(user_id, activity_type, day, activity_count=0, total_duration=0,
+                  total_distance=0, total_calories=0):
+    """
+    Applies a delta to a single rollup bucket, creating the bucket if it does not
+    exist yet and removing it once it no longer holds any activity. Returns whether
+    the bucket still holds activities afterwards.
+    """
+    deltas = {
+        'activity_count': activity_count,
+        'total_duration': total_duration,
+        'total_distance': total_distance,
+        'total_calories': total_calories,
+    }
+    lookup = {'user_id': user_id, 'activity_type': activity_type, 'day': day}
+
+    # No savepoint: a failure here fails the write it belongs to
+    with transaction.atomic(savepoint=False):
+        updated = ActivityRollup.objects.filter(**lookup).update(
+            **{field: F(field) + value for field, value in deltas.items()}
+        )
+        if not updated and activity_count > 0:
+            try:
+                with transaction.atomic():
+                    ActivityRollup.objects.create(**lookup, **deltas)
+            except IntegrityError:
+                # Another writer created the bucket first, add our delta on top of it
+                ActivityRollup.objects.filter(**lookup).update(
+                    **{field: F(field) + value for field, value in deltas.items()}
+                )
+        elif activity_count < 0:
+            deleted, _ = ActivityRollup.objects.filter(**lookup, activity_count__lte=0).delete()
+            return not deleted and bool(updated)
+    return bool(updated) or activity_count > 0
+
+
+def add_activity(activity, sign=1):
+    """
+    Adds (sign=1) or removes (sign=-1) a single activity from its rollup bucket.
+    Returns whether the bucket still holds activities.
+    """
+    return adjust_rollup(
+        activity.user_id,
+        activity.activity_type,
+        activity_day(activity.date),
+        activity_count=sign,
+        total_duration=sign * activity.duration,
+        total_distance=sign * activity.distance,
+        total_calories=sign * activity.calories_burned,
+    )
+
+
+def add_activities(activities):
+    """
+    Adds several newly created activities to their rollup buckets, applying one
+    delta per bucket rather than one per activity.
+    """
+    buckets = {}
+    for activity in activities:
+        key = (activity.user_id, activity.activity_type, activity_day(activity.date))
+        totals = buckets.setdefault(key, [0, 0, 0, 0])
+        totals[0] += 1
+        totals[1] += activity.duration
+        totals[2] += activity.distance
+        totals[3] += activity.calories_burned
+
+    for (user_id, activity_type, day), totals in buckets.items():
+        adjust_rollup(user_id, activity_type, day, *totals)
+
+
+def rollup_sums():
+    return {
+        'total_duration': Sum('total_duration', default=0),
+        'total_distance': Sum('total_distance', default=0),
+        'total_calories': Sum('total_calories', default=0),
+    }
+
+
+def activity_sums():
+    return {
+        'total_duration': Sum('duration', default=0),
+        'total_distance': Sum('distance', default=0),
+        'total_calories': Sum('calories_burned', default=0),
+    }
+
+
+def rollup_totals(queryset):
+    """Sums the rollup buckets in the queryset into metric totals."""
+    return queryset.aggregate(**rollup_sums())
+
+
+def activity_totals(queryset):
+    """Sums raw activities in the queryset into metric totals."""
+    return queryset.aggregate(**activity_sums())
+
+
+def metrics_since(user, start):
+    """
+    Returns total duration, distance and calories for the user's activities since
+    `start`. Whole days are read from the rollups; only the partial day at the
+    start of the window is summed from the raw Activity table.
+    """
+    first_full_day = activity_day(start) + timedelta(days=1)
+
+    totals = rollup_totals(ActivityRollup.objects.filter(user=user, day__gte=first_full_day))
+    for model in activity_models(start):
+        partial = activity_totals(
+            model.objects.filter(user=user, date__gte=start, date__lt=start_of_day(first_full_day))
+        )
+        totals = {key: totals[key] + partial[key] for key in totals}
+    return totals
+
+
+async def ametrics_since(user, start):
+    """Async version of metrics_since(), with the same queries run through aaggregate()."""
+    first_full_day = activity_day(start) + timedelta(days=1)
+
+    totals = await ActivityRollup.objects.filter(user=user, day__gte=first_full_day).aaggregate(**rollup_sums())
+    for model in activity_models(start):
+        partial = await model.objects.filter(
+            user=user, date__gte=start, date__lt=start_of_day(first_full_day)
+        ).aaggregate(**activity_sums())
+        totals = {key: totals[key] + partial[key] for key in totals}
+    return totals
+
+
+def window_expiry(user, start, length):
+    """
+    Returns the moment the oldest activity inside the sliding window starting at
+    `start` drops out of it (changing the window's totals), or None if the window is empty.
+    """
+    oldest = min((
+        oldest for oldest in (
+            model.objects.filter(user=user, date__gte=start).aggregate(oldest=Min('date'))['oldest']
+            for model in activity_models(start)
+        ) if oldest
+    ), default=None)
+    return oldest + length if oldest else None
+
+
+async def awindow_expiry(user, start, length):
+    """Async version of window_expiry()."""
+    oldest = min((
+        oldest for oldest in [
+            (await model.objects.filter(user=user, date__gte=start).aaggregate(oldest=Min('date')))['oldest']
+            for model in activity_models(start)
+        ] if oldest
+    ), default=None)
+    return oldest + length if oldest else None
+
+
+def rebuild_rollups(user_ids):
+    """
+    Recomputes the rollup buckets of the given users from the raw Activity table
+    (and the archive). Returns the number of buckets written.
+    """
+    buckets = {}
+    for model in activity_models():
+        rows = (
+            model.objects.filter(user_id__in=user_ids)
+            .annotate(day=TruncDate('date'))
+            .values('user_id', 'activity_type', 'day')
+            .annotate(
+                activity_count=Count('id'),
+                total_duration=Sum('duration'),
+                total_distance=Sum('distance'),
+                total_calories=Sum('calories_burned'),
+            )
+            .order_by()
+        )
+        for row in rows:
+            key = (row['user_id'], row['activity_type'], row['day'])
+            if key in buckets:
+                for field in ROLLUP_FIELDS:
+                    buckets[key][field] += row[field]
+            else:
+                buckets[key] = row
+
+    with transaction.atomic():
+        ActivityRollup.objects.filter(user_id__in=user_ids).delete()
+        rollups = ActivityRollup.objects.bulk_create(ActivityRollup(**bucket) for bucket in buckets.values())
+    return len(rollups)
+
+
+def bucket_start(day, bucket):
+    """Truncates a day to the start of its 'day', 'week' (Monday) or 'month' bucket."""
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(day, bucket):
+    """Returns the start of the bucket following the one starting on `day`."""
+    if bucket == 'week':
+        return day + timedelta(weeks=1)
+    if bucket == 'month':
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+def bucket_range(start, end, bucket):
+    """Lists the start of every bucket overlapping the inclusive [start, end] day range."""
+    buckets = []
+    current = bucket_start(start, bucket)
+    while current <= end:
+        buckets.append(current)
+        current = next_bucket(current, bucket)
+    return buckets
+
+
+def time_series(user, start, end, bucket='day', group_by=None):
+    """
+    Returns metric totals for every bucket between `start` and `end` (inclusive days),
+    optionally split per activity type. All buckets are read with a single grouped
+    query over the rollups; buckets without activity are filled with zeros.
+    """
+    group_fields = ['bucket'] + (['activity_type'] if group_by else [])
+    rows = (
+        ActivityRollup.objects.filter(user=user, day__range=[start, end])
+        .annotate(bucket=Trunc('day', bucket, output_field=DateField()))
+        .values(*group_fields)
+        .annotate(
+            activity_count=Sum('activity_count'),
+            total_duration=Sum('total_duration'),
+            total_distance=Sum('total_distance'),
+            total_calories=Sum('total_calories'),
+        )
+        .order_by(*group_fields)
+    )
+    found = {tuple(row[field] for field in group_fields): row for row in rows}
+
+    activity_types = [choice for choice, _ in Activity.ACTIVITY_CHOICES] if group_by else [None]
+    series = []
+    for day in bucket_range(start, end, bucket):
+        for activity_type in activity_types:
+            key = (day, activity_type) if group_by else (day,)
+            row = found.get(key, {})
+            point = {'bucket': day}
+            if group_by:
+                point['activity_type'] = activity_type
+            point.update({field: row.get(field, 0) for field in ROLLUP_FIELDS})
+            series.append(point)
+    return series
@@ -0,0 +1,162 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.functional import SimpleLazyObject, empty
+
+PRIMARY = DEFAULT_DB_ALIAS
+
+# State of the request being handled: None outside requests (jobs, shell, tests calling the ORM)
+current_routing = ContextVar('current_replica_routing', default=None)
+
+
+class RoutingState:
+    """Whether the reads of the current request must see the primary's latest writes."""
+
+    def __init__(self, request, pinned=False):
+        self.request = request
+        self.pinned = pinned
+        self.checked_user = None
+
+
+def pin_cache():
+    return caches[settings.REPLICA_PIN_CACHE_ALIAS]
+
+
+def pin_key(user_id):
+    return f'replica:pin:{user_id}'
+
+
+def pin_user(user_id):
+    """Sends the user's reads to the primary for the next REPLICA_PIN_SECONDS."""
+    pin_cache().set(pin_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def request_user_id(request):
+    """
+    The id of the request's user once it is known. DRF stores the user it
+    authenticated on the request; the lazy session user is only used once it has
+    been evaluated, as evaluating it here would itself query the database.
+    """
+    user = request.__dict__.get('user')
+    if user is None or isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+        return None
+    return user.pk if user.is_authenticated else None
+
+
+def pinned_to_primary():
+    """Tells whether reads must go to the primary: outside requests, after writes, or when forced."""
+    state = current_routing.get()
+    if state is None or state.pinned:
+        return True
+    user_id = request_user_id(state.request)
+    if user_id is not None and user_id != state.checked_user:
+        state.checked_user = user_id
+        state.pinned = pin_cache().get(pin_key(user_id)) is not None
+    return state.pinned
+
+
+@contextmanager
+def use_primary():
+    """Sends the enclosed reads to the primary, e.g. when their result is written back."""
+    state = current_routing.get()
+    if state is None or state.pinned:
+        yield
+        return
+    state.pinned = True
+    try:
+        yield
+    finally:
+        state.pinned = False
+
+
+class ReplicaRouter:
+    """
+    Sends writes to the primary and safe reads to a random DATABASE_REPLICAS alias.
+    Reads stay on the primary outside requests, during unsafe requests, and for
+    REPLICA_PIN_SECONDS after the user (or the client, via a cookie) wrote, so users
+    always read their own writes. Pins are set by ReplicaPinningMiddleware.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or pinned_to_primary():
+            return PRIMARY
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        databases = {PRIMARY, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """
+    Tracks the routing state of each request for ReplicaRouter. Unsafe requests are
+    pinned to the primary while they run; afterwards both the client (with a
+    cookie holding the pin's expiry) and the user (in the cache) stay pinned for
+    REPLICA_PIN_SECONDS. Runs in both the sync and async middleware chains.
+    """
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        token = current_routing.set(self.routing_state(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.pin_after_write(request, response)
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+
+        token = current_routing.set(self.routing_state(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.pin_after_write(request, response)
+
+    def routing_state(self, request):
+        writing = request.method not in self.SAFE_METHODS
+        try:
+            cookie_pin = float(request.COOKIES.get(settings.REPLICA_PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            cookie_pin = False
+        return RoutingState(request, pinned=writing or cookie_pin)
+
+    def pin_after_write(self, request, response):
+        if request.method not in self.SAFE_METHODS:
+            expires = time.time() + settings.REPLICA_PIN_SECONDS
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, f'{expires:.3f}', max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax',
+            )
+            user_id = request_user_id(request)
+            if user_id is not None:
+                pin_user(user_id)
+        return response
@@ -0,0 +1,135 @@
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+from .jobs import register
+from .archive import activity_models
+from .models import Activity, Notification
+from .rollups import bucket_start
+from .signals import ACTIVITY_CREATED_JOB, notifications_bulk_created
+
+
+def personal_bests(activities_by_user):
+    """Congratulates users whose new activity is their longest of its type so far."""
+    new_ids = [activity.pk for activities in activities_by_user.values() for activity in activities]
+    previous = {}
+    for model in activity_models():
+        for row in (
+            model.objects.filter(user_id__in=activities_by_user)
+            .exclude(pk__in=new_ids)
+            .values('user_id', 'activity_type')
+            .annotate(best=Max('distance'))
+            .order_by()
+        ):
+            key = (row['user_id'], row['activity_type'])
+            previous[key] = max(row['best'], previous.get(key, row['best']))
+
+    notifications = []
+    for user_id, activities in activities_by_user.items():
+        best = {}
+        for activity in activities:
+            if activity.distance > best.get(activity.activity_type, (0,))[0]:
+                best[activity.activity_type] = (activity.distance, activity)
+        for activity_type, (distance, activity) in best.items():
+            record = previous.get((user_id, activity_type))
+            if record and distance > record:
+                notifications.append(Notification(
+                    user_id=user_id, notification_type='personal_best',
+                    message=f"New personal best: {distance:g} km of {activity_type.lower()}!",
+                ))
+    return notifications
+
+
+def running_totals(activities_by_user, models, value=None, **filters):
+    """
+    Yields (user_id, before, after) for each new activity matching `filters`: the
+    user's total of the `value` field (or count, without one) over their matching
+    activities stored before it, by id, and that total with it included. Unlike
+    totals read when the job runs, these do not move with activities saved after
+    it, so a threshold is crossed by exactly one activity however late jobs run.
+    """
+    first = {user_id: min(activity.pk for activity in activities) for user_id, activities in activities_by_user.items()}
+    earlier = reduce(or_, (Q(user_id=user_id, pk__lt=pk) for user_id, pk in first.items()))
+    since = reduce(or_, (Q(user_id=user_id, pk__gte=pk) for user_id, pk in first.items()))
+    base, later = {}, {}
+    for model in models:
+        queryset = model.objects.filter(user_id__in=first, **filters)
+        for user_id, total in (
+            queryset.filter(earlier).values('user_id')
+            .annotate(total=Count('pk') if value is None else Sum(value))
+            .values_list('user_id', 'total')
+            .order_by()
+        ):
+            base[user_id] = base.get(user_id, 0) + total
+        for user_id, pk, amount in queryset.filter(since).values_list('user_id', 'pk', value or 'pk'):
+            later.setdefault(user_id, []).append((pk, 1 if value is None else amount))
+
+    for user_id, activities in activities_by_user.items():
+        new_ids = {activity.pk for activity in activities}
+        total = base.get(user_id, 0)
+        for pk, amount in sorted(later.get(user_id, [])):
+            if pk in new_ids:
+                yield user_id, total, total + amount
+            total += amount
+
+
+def weekly_distance_goal(activities_by_user):
+    """Notifies users whose new activities take this week's distance past WEEKLY_DISTANCE_GOAL."""
+    goal = settings.WEEKLY_DISTANCE_GOAL
+    week = bucket_start(timezone.localdate(), 'week')
+    reached = {
+        user_id
+        for user_id, before, after in running_totals(
+            activities_by_user, activity_models(week), 'distance', date__date__gte=week,
+        )
+        if before < goal <= after
+    }
+    return [
+        Notification(
+            user_id=user_id, notification_type='goal',
+            message=f"You reached your weekly goal of {goal:g} km. Great work!",
+        )
+        for user_id in reached
+    ]
+
+
+def activity_milestones(activities_by_user):
+    """Celebrates users whose activity count passes one of ACTIVITY_MILESTONES."""
+    reached = {}
+    for user_id, before, after in running_totals(activities_by_user, activity_models()):
+        for milestone in settings.ACTIVITY_MILESTONES:
+            if before < milestone <= after:
+                reached[user_id] = max(milestone, reached.get(user_id, milestone))
+    return [
+        Notification(
+            user_id=user_id, notification_type='milestone',
+            message=f"You have logged {milestone} activities!",
+        )
+        for user_id, milestone in reached.items()
+    ]
+
+
+# Evaluated in order for every batch of new activities
+RULES = [personal_bests, weekly_distance_goal, activity_milestones]
+
+
+@register(ACTIVITY_CREATED_JOB)
+def evaluate_activity_rules(payloads):
+    """
+    Runs every rule once over all activities of a batch of jobs, grouped by user,
+    and writes the resulting notifications with a single bulk insert.
+    """
+    activity_ids = [pk for payload in payloads for pk in payload['activity_ids']]
+    activities_by_user = {}
+    # Activities deleted before the job ran are skipped
+    for activity in Activity.objects.filter(pk__in=activity_ids).order_by('pk'):
+        activities_by_user.setdefault(activity.user_id, []).append(activity)
+    if not activities_by_user:
+        return []
+
+    notifications = [notification for rule in RULES for notification in rule(activities_by_user)]
+    created = Notification.objects.bulk_create(notifications)
+    if created:
+        notifications_bulk_created.send(sender=Notification, notifications=created)
+    return created
@@ -0,0 +1,100 @@
+import random
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+from .models import Activity, Notification
+from .rollups import rebuild_rollups
+from .stats import rebuild_stats
+
+User = get_user_model()
+
+# activity type: (share of all activities, mean duration in minutes, speed in km/h, kcal per minute)
+ACTIVITY_PROFILES = {
+    'Running': (0.35, 40, 10.0, 11),
+    'Walking': (0.25, 50, 5.0, 4),
+    'Cycling': (0.20, 70, 22.0, 8),
+    'Swimming': (0.10, 35, 2.5, 9),
+    'Weightlifting': (0.10, 55, 0.0, 6),
+}
+
+NOTIFICATION_MESSAGES = [
+    ('reminder', "Time for your workout!"),
+    ('goal', "You are close to your weekly goal."),
+    ('general', "New personal best, keep it up!"),
+]
+
+
+def random_date(rng, now, days):
+    """
+    Picks a workout time within the last `days` days: recent days are a little more
+    likely, and workouts cluster around the morning and the evening.
+    """
+    day = int(days * rng.random() ** 1.3)
+    hour = rng.gauss(7, 1) if rng.random() < 0.4 else rng.gauss(18, 1.5)
+    moment = now - timedelta(days=day)
+    moment = moment.replace(hour=int(min(max(hour, 0), 23)), minute=rng.randrange(60), second=rng.randrange(60))
+    return min(moment, now)
+
+
+def insert_with_dates(model, objects, batch_size):
+    """
+    Bulk inserts `objects`, keeping the `date` set on them: auto_now_add overwrites it
+    on insert, so it is written back afterwards with one bulk update per batch.
+    """
+    dates = [obj.date for obj in objects]
+    created = model.objects.bulk_create(objects, batch_size=batch_size)
+    for obj, date in zip(created, dates):
+        obj.date = date
+    model.objects.bulk_update(created, ['date'], batch_size=batch_size)
+    return created
+
+
+def random_activity(rng, user, now, days):
+    types = list(ACTIVITY_PROFILES)
+    activity_type = rng.choices(types, weights=[ACTIVITY_PROFILES[name][0] for name in types])[0]
+    _, mean_duration, speed, kcal_per_minute = ACTIVITY_PROFILES[activity_type]
+    duration = max(5, int(rng.gauss(mean_duration, mean_duration / 4)))
+    return Activity(
+        user=user,
+        activity_type=activity_type,
+        duration=duration,
+        distance=round(speed * duration / 60 * rng.uniform(0.85, 1.15), 2),
+        calories_burned=int(duration * kcal_per_minute * rng.uniform(0.8, 1.2)),
+        date=random_date(rng, now, days),
+    )
+
+
+def seed(users, activities_per_user, notifications_per_user, days=365, seed=None,
+         prefix='seed', batch_size=1000):
+    """
+    Creates `users` users with the given number of activities and notifications each,
+    spread over the last `days` days, using bulk inserts. Rollups and stats are
+    rebuilt for the new users afterwards. Returns the created users.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    password = make_password('benchmark')  # Hashed once, shared by every seeded user
+
+    start = User.objects.filter(username__startswith=f'{prefix}-').count()
+    created_users = User.objects.bulk_create([
+        User(username=f'{prefix}-{start + i}', email=f'{prefix}-{start + i}@example.com', password=password)
+        for i in range(users)
+    ], batch_size=batch_size)
+    if created_users and created_users[0].pk is None:
+        # Databases that do not return primary keys from bulk inserts
+        created_users = list(User.objects.filter(username__in=[user.username for user in created_users]))
+
+    for user in created_users:
+        activities = [random_activity(rng, user, now, days) for _ in range(activities_per_user)]
+        notifications = [
+            Notification(user=user, message=message, notification_type=kind, is_read=rng.random() < 0.7,
+                         date=random_date(rng, now, days))
+            for kind, message in rng.choices(NOTIFICATION_MESSAGES, k=notifications_per_user)
+        ]
+        insert_with_dates(Activity, activities, batch_size)
+        insert_with_dates(Notification, notifications, batch_size)
+
+    rebuild_rollups([user.pk for user in created_users])
+    rebuild_stats([user.pk for user in created_users])
+    return created_users
@@ -1,9 +1,36 @@
+from datetime import timedelta
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 from .models import Activity, Notification
+from .instrumentation import serializer_timer
+from .stats import current_streak
+from .tracks import track_points, unpack_track
 
 User = get_user_model()
 
+
+class InstrumentedListSerializer(serializers.ListSerializer):
+    """List serializer whose `.data` counts towards the request's serializer time."""
+
+    @property
+    def data(self):
+        with serializer_timer():
+            return super().data
+
+
+class InstrumentedSerializerMixin:
+    """
+    Counts the time spent producing `.data` towards the request's serializer time.
+    Serializers using it set `list_serializer_class = InstrumentedListSerializer`
+    in their Meta so `many=True` is timed as well.
+    """
+
+    @property
+    def data(self):
+        with serializer_timer():
+            return super().data
+
 class UserSerializer(serializers.ModelSerializer):
     """
     Serializer for the User model, including fields for username, email, and password.
@@ -25,7 +52,7 @@ class UserSerializer(serializers.ModelSerializer):
         )
         return user
     
-class ActivitySerializer(serializers.ModelSerializer):
+class ActivitySerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
      """
     Serializer for the Activity model, including fields such as activity type, duration, distance,
     and calories burned. The user field is read-only and displays the username.
@@ -34,10 +61,13 @@ class ActivitySerializer(serializers.ModelSerializer):
     """
 
      user = serializers.StringRelatedField(read_only=True)  
+     # Declared so the unique constraint it is part of does not make it required
+     external_id = serializers.CharField(max_length=100, required=False, allow_null=True, allow_blank=True)
      class Meta:
         model = Activity
         fields = '__all__' #Includes all the field from the model
         read_only_fields = ['user_id', 'date'] # User ID and date are set automatically
+        list_serializer_class = InstrumentedListSerializer
         
      def validate_activity_type(self, value):
         if not value:
@@ -51,8 +81,10 @@ class ActivitySerializer(serializers.ModelSerializer):
         if value < 0:
             raise serializers.ValidationError("Distance cannot be negative.")
         return value
+     def validate_external_id(self, value):
+        return value or None #A blank external id is no id
     
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for the Notification model, including all fields from the model.
     The user field is read-only and displays the username, while the date is set automatically.
@@ -62,4 +94,146 @@ class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
         fields = '__all__' #Includes all the field from the model
-        read_only_fields = ['date'] # User ID and date are set automatically
\ No newline at end of file
+        read_only_fields = ['date'] # User ID and date are set automatically
+        list_serializer_class = InstrumentedListSerializer
+
+class NotificationMarkReadSerializer(serializers.Serializer):
+    """
+    Validates the body of the bulk mark-read action. Without `ids` every unread
+    notification of the user is marked as read.
+    """
+    MAX_IDS = 1000
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, allow_empty=False, max_length=MAX_IDS,
+    )
+
+
+class ActivityMetricsSerializer(InstrumentedSerializerMixin, serializers.Serializer):
+    """
+    Serializer for the aggregated activity metrics returned by the metrics endpoint.
+    Total duration is rendered as a duration string (e.g. '01:30:00').
+    """
+    period = serializers.CharField()
+    total_duration = serializers.DurationField()
+    total_distance = serializers.FloatField()
+    total_calories = serializers.IntegerField()
+
+
+class ActivityTimeSeriesQuerySerializer(serializers.Serializer):
+    """
+    Validates the query parameters of the time-series metrics endpoint.
+    `start` and `end` are inclusive dates; `group_by` may only split by activity type.
+    """
+    BUCKET_CHOICES = ['day', 'week', 'month']
+    MAX_DAYS = 3660 # About ten years of daily buckets
+
+    start = serializers.DateField()
+    end = serializers.DateField()
+    bucket = serializers.ChoiceField(choices=BUCKET_CHOICES, default='day')
+    group_by = serializers.ChoiceField(choices=['activity_type'], required=False)
+
+    def validate(self, data):
+        if data['start'] > data['end']:
+            raise serializers.ValidationError("'start' must not be after 'end'.")
+        if (data['end'] - data['start']).days > self.MAX_DAYS:
+            raise serializers.ValidationError(f"The requested range cannot exceed {self.MAX_DAYS} days.")
+        return data
+
+
+class ActivityTimeSeriesPointSerializer(InstrumentedSerializerMixin, serializers.Serializer):
+    """
+    Serializer for a single bucket of the time-series metrics. `activity_type` is only
+    present when the series is grouped by activity type.
+    """
+    bucket = serializers.DateField()
+    activity_type = serializers.CharField(required=False)
+    activity_count = serializers.IntegerField()
+    total_duration = serializers.SerializerMethodField()
+    total_distance = serializers.FloatField()
+    total_calories = serializers.IntegerField()
+
+    class Meta:
+        list_serializer_class = InstrumentedListSerializer
+
+    def get_total_duration(self, point):
+        return serializers.DurationField().to_representation(timedelta(minutes=point['total_duration']))
+
+
+class UserStatsSerializer(InstrumentedSerializerMixin, serializers.Serializer):
+    """
+    Serializer for a user's lifetime stats. `current_streak` is 0 once a whole day
+    has passed without activity; record durations are in minutes, like activities.
+    """
+    activity_count = serializers.IntegerField()
+    total_duration = serializers.SerializerMethodField()
+    total_distance = serializers.FloatField()
+    total_calories = serializers.IntegerField()
+    current_streak = serializers.SerializerMethodField()
+    longest_streak = serializers.IntegerField()
+    last_active_day = serializers.DateField()
+    records = serializers.DictField(child=serializers.DictField())
+
+    def get_total_duration(self, stats):
+        return serializers.DurationField().to_representation(timedelta(minutes=stats.total_duration))
+
+    def get_current_streak(self, stats):
+        return current_streak(stats)
+
+
+class LeaderboardQuerySerializer(serializers.Serializer):
+    """
+    Validates the query parameters of the leaderboard endpoint. `week` may be any
+    day of the week; leaderboards exist for the last LEADERBOARD_WEEKS weeks.
+    """
+    metric = serializers.ChoiceField(choices=['distance', 'duration', 'calories'], default='distance')
+    activity_type = serializers.ChoiceField(choices=Activity.ACTIVITY_CHOICES, required=False)
+    week = serializers.DateField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=settings.LEADERBOARD_MAX_LIMIT, default=10)
+
+
+class LeaderboardEntrySerializer(InstrumentedSerializerMixin, serializers.Serializer):
+    """
+    Serializer for one row of a leaderboard, ranked by the metric given in the
+    context. Durations are in minutes, like activities.
+    """
+    rank = serializers.SerializerMethodField()
+    username = serializers.CharField(source='user.username')
+    value = serializers.SerializerMethodField()
+
+    class Meta:
+        list_serializer_class = InstrumentedListSerializer
+
+    def get_rank(self, entry):
+        return getattr(entry, f"{self.context['metric']}_rank")
+
+    def get_value(self, entry):
+        return getattr(entry, self.context['metric'])
+
+
+class TrackImportQuerySerializer(serializers.Serializer):
+    """
+    Validates the query parameters of a GPX/TCX import. Both default to what the
+    file says: its sport (when it is a known activity type) and its laps' calories.
+    """
+    activity_type = serializers.ChoiceField(choices=Activity.ACTIVITY_CHOICES, required=False)
+    calories_burned = serializers.IntegerField(min_value=0, required=False)
+
+
+class TrackAnalyticsQuerySerializer(serializers.Serializer):
+    """Validates the query parameters of an activity's analytics."""
+    max_heart_rate = serializers.IntegerField(min_value=100, max_value=250, required=False)
+
+
+class ActivityTrackSerializer(serializers.Serializer):
+    """
+    Serializer for an activity's GPS track: one list per column, with times as Unix
+    timestamps, elevations in meters and missing readings as null.
+    """
+    activity = serializers.IntegerField(source='activity_id')
+    point_count = serializers.IntegerField()
+    started_at = serializers.DateTimeField()
+    points = serializers.SerializerMethodField()
+
+    def get_points(self, track):
+        return track_points(unpack_track(track.data))
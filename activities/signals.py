@@ -0,0 +1,237 @@
+from functools import partial
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+from . import jobs, leaderboards, rollups, stats
+from .authentication import forget_user
+from .caching import invalidate_analytics, invalidate_metrics
+from .conditional import touch
+from .database import sqlite_pragmas
+from .instrumentation import install_query_recorder
+from .notifications import adjust_unread, publish
+from .models import Activity, ActivityTrack, Notification, User
+
+# Sent after activities are inserted with bulk_create(), which skips the model signals.
+# Receivers get the list of created activities as `activities`.
+activities_bulk_created = Signal()
+
+# Sent after notifications are inserted with bulk_create(), for example by the
+# notification rules. Receivers get the list of created notifications as `notifications`.
+notifications_bulk_created = Signal()
+
+# Job evaluating the notification rules for new activities (see activities.rules)
+ACTIVITY_CREATED_JOB = 'activity_created'
+
+
+@receiver(pre_save, sender=Activity)
+def remember_previous_activity(sender, instance, **kwargs):
+    """Keeps the stored version of an activity being updated so its old totals can be rolled back."""
+    instance._previous = None
+    if instance.pk and not instance._state.adding:
+        instance._previous = Activity.objects.filter(pk=instance.pk).first()
+
+
+@receiver(post_save, sender=Activity)
+def update_rollups_on_save(sender, instance, created, **kwargs):
+    """Moves the activity's totals into its rollup bucket, replacing the old totals on updates."""
+    previous = getattr(instance, '_previous', None)
+    if previous is not None:
+        rollups.add_activity(previous, sign=-1)
+    rollups.add_activity(instance)
+
+
+@receiver(post_delete, sender=Activity)
+def update_rollups_on_delete(sender, instance, **kwargs):
+    """Removes a deleted activity's totals from its rollup bucket, noting whether that emptied it for the stats."""
+    instance._bucket_emptied = not rollups.add_activity(instance, sign=-1)
+
+
+@receiver(activities_bulk_created)
+def update_rollups_on_bulk_create(sender, activities, **kwargs):
+    """Adds bulk-created activities to their rollup buckets, one update per bucket."""
+    rollups.add_activities(activities)
+
+
+@receiver(post_save, sender=Activity)
+@receiver(post_delete, sender=Activity)
+def invalidate_metrics_on_write(sender, instance, **kwargs):
+    """
+    Drops the user's cached metrics once a change to one of their activities commits.
+    Bumping the version any earlier would let a concurrent request cache the
+    uncommitted state under the new version.
+    """
+    transaction.on_commit(partial(invalidate_metrics, instance.user_id))
+
+
+@receiver(activities_bulk_created)
+def invalidate_metrics_on_bulk_create(sender, activities, **kwargs):
+    for user_id in {activity.user_id for activity in activities}:
+        transaction.on_commit(partial(invalidate_metrics, user_id))
+
+
+@receiver(post_save, sender=ActivityTrack)
+@receiver(post_delete, sender=ActivityTrack)
+def invalidate_analytics_on_track_write(sender, instance, **kwargs):
+    """Drops the cached analytics of an activity once the change to its samples commits."""
+    transaction.on_commit(partial(invalidate_analytics, instance.activity_id))
+
+
+def deleting_user(kwargs):
+    """Tells whether a post_delete signal comes from deleting the whole user (a cascade)."""
+    return isinstance(kwargs.get('origin'), User)
+
+
+@receiver(post_save, sender=Activity)
+@receiver(post_delete, sender=Activity)
+def touch_activities(sender, instance, **kwargs):
+    """Bumps the user's activity change marker, which changes the ETag of their activity responses."""
+    if not deleting_user(kwargs):
+        touch(instance.user_id, 'activities')
+
+
+@receiver(post_save, sender=Notification)
+@receiver(post_delete, sender=Notification)
+def touch_notifications(sender, instance, **kwargs):
+    """Bumps the user's notification change marker."""
+    if not deleting_user(kwargs):
+        touch(instance.user_id, 'notifications')
+
+
+@receiver(activities_bulk_created)
+def touch_activities_on_bulk_create(sender, activities, **kwargs):
+    for user_id in {activity.user_id for activity in activities}:
+        touch(user_id, 'activities')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    """
+    Evicts a changed or deleted user from the JWT authentication cache once the
+    change commits, so a request in between cannot cache the old row again.
+    """
+    transaction.on_commit(partial(forget_user, instance.pk))
+
+
+@receiver(pre_save, sender=Notification)
+def remember_previous_notification(sender, instance, **kwargs):
+    """Keeps the stored read state of a notification being updated."""
+    instance._previous = None
+    if instance.pk and not instance._state.adding:
+        instance._previous = Notification.objects.filter(pk=instance.pk).values('user_id', 'is_read').first()
+
+
+@receiver(post_save, sender=Notification)
+def update_unread_on_save(sender, instance, created, **kwargs):
+    """Keeps the unread counters in sync when a notification is created, read or unread."""
+    deltas = {}
+    previous = getattr(instance, '_previous', None)
+    if previous is not None and not previous['is_read']:
+        deltas[previous['user_id']] = -1
+    if not instance.is_read:
+        deltas[instance.user_id] = deltas.get(instance.user_id, 0) + 1
+    for user_id, delta in deltas.items():
+        adjust_unread(user_id, delta)
+
+
+@receiver(post_delete, sender=Notification)
+def update_unread_on_delete(sender, instance, **kwargs):
+    if not instance.is_read and not deleting_user(kwargs):
+        adjust_unread(instance.user_id, -1)
+
+
+@receiver(post_save, sender=Notification)
+def publish_notification(sender, instance, created, **kwargs):
+    """Pushes a new notification to the user's open streams once it is committed."""
+    if created:
+        transaction.on_commit(partial(publish, [instance]))
+
+
+@receiver(notifications_bulk_created)
+def update_on_notifications_bulk_create(sender, notifications, **kwargs):
+    """Updates the unread counters and change markers once per user, then publishes the notifications."""
+    unread = {}
+    for notification in notifications:
+        unread[notification.user_id] = unread.get(notification.user_id, 0) + (not notification.is_read)
+    for user_id, count in unread.items():
+        adjust_unread(user_id, count)
+        touch(user_id, 'notifications')
+    transaction.on_commit(partial(publish, notifications))
+
+
+@receiver(post_save, sender=Activity)
+def update_stats_on_save(sender, instance, created, **kwargs):
+    """Keeps the user's lifetime stats in sync; runs after the rollups, which it reads."""
+    previous = getattr(instance, '_previous', None)
+    if previous is not None:
+        stats.change_activity(previous, instance)
+    else:
+        stats.add_activities([instance])
+
+
+@receiver(post_delete, sender=Activity)
+def update_stats_on_delete(sender, instance, **kwargs):
+    if not deleting_user(kwargs):
+        stats.remove_activity(instance, bucket_emptied=getattr(instance, '_bucket_emptied', True))
+
+
+@receiver(activities_bulk_created)
+def update_stats_on_bulk_create(sender, activities, **kwargs):
+    stats.add_activities(activities)
+
+
+@receiver(post_save, sender=Activity)
+@receiver(post_delete, sender=Activity)
+def queue_jobs_on_write(sender, instance, **kwargs):
+    """
+    Queues the background work of an activity write with one insert: the notification
+    rules for a new activity, kept off the request path, and a leaderboard update for
+    the ranked weeks the write touched.
+    """
+    if deleting_user(kwargs):
+        return
+    created = kwargs.get('created')
+    previous = getattr(instance, '_previous', None) if created is False else None
+    leaderboard = [{'user_id': instance.user_id, 'weeks': leaderboards.affected_weeks(instance)}]
+    if previous is not None:
+        leaderboard.append({'user_id': previous.user_id, 'weeks': leaderboards.affected_weeks(previous)})
+    jobs.enqueue({
+        ACTIVITY_CREATED_JOB: [{'user_id': instance.user_id, 'activity_ids': [instance.pk]}] if created else [],
+        leaderboards.LEADERBOARD_UPDATE_JOB: [payload for payload in leaderboard if payload['weeks']],
+    })
+
+
+@receiver(activities_bulk_created)
+def queue_jobs_on_bulk_create(sender, activities, **kwargs):
+    """Queues one rules job and one leaderboard update per user for bulk-created activities, with one insert."""
+    by_user = {}
+    for activity in activities:
+        by_user.setdefault(activity.user_id, []).append(activity)
+    jobs.enqueue({
+        ACTIVITY_CREATED_JOB: [
+            {'user_id': user_id, 'activity_ids': [activity.pk for activity in user_activities]}
+            for user_id, user_activities in by_user.items()
+        ],
+        leaderboards.LEADERBOARD_UPDATE_JOB: [
+            {'user_id': user_id, 'weeks': weeks}
+            for user_id, user_activities in by_user.items()
+            if (weeks := leaderboards.affected_weeks(*user_activities))
+        ],
+    })
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    """Applies the SQLite pragmas to every new SQLite connection."""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            sqlite_pragmas(cursor)
+
+
+@receiver(connection_created)
+def record_connection_queries(sender, connection, **kwargs):
+    """Lets the request instrumentation count the queries of every new connection, in any thread."""
+    if settings.REQUEST_INSTRUMENTATION:
+        install_query_recorder(connection)
@@ -0,0 +1,218 @@
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+from .models import ActivityRollup, UserStats
+from .rollups import activity_day
+from .archive import activity_models
+
+RECORD_FIELDS = ('distance', 'duration', 'calories_burned')
+
+
+def streaks(days):
+    """
+    Returns `(current, longest)` streak lengths for a sorted list of distinct active
+    days, where the current streak is the run of consecutive days ending on the last one.
+    """
+    current = longest = 0
+    previous = None
+    for day in days:
+        current = current + 1 if previous is not None and day == previous + timedelta(days=1) else 1
+        longest = max(longest, current)
+        previous = day
+    return current, longest
+
+
+def current_streak(stats, today=None):
+    """The streak as of today: it is broken once a whole day passes without activity."""
+    today = today or timezone.localdate()
+    if stats.last_active_day is None or stats.last_active_day < today - timedelta(days=1):
+        return 0
+    return stats.current_streak
+
+
+def rebuild_stats(user_ids):
+    """
+    Recomputes the stats rows of the given users: totals and active days from the
+    rollups, records from the activities (live and archived). Returns the number of rows written.
+    """
+    stats = {user_id: UserStats(user_id=user_id) for user_id in user_ids}
+
+    totals = (
+        ActivityRollup.objects.filter(user_id__in=user_ids).values('user_id')
+        .annotate(
+            activity_count=Sum('activity_count'),
+            total_duration=Sum('total_duration'),
+            total_distance=Sum('total_distance'),
+            total_calories=Sum('total_calories'),
+        )
+        .order_by()
+    )
+    for row in totals:
+        user_stats = stats[row.pop('user_id')]
+        for field, value in row.items():
+            setattr(user_stats, field, value)
+
+    for model in activity_models():
+        records = (
+            model.objects.filter(user_id__in=user_ids).values('user_id', 'activity_type')
+            .annotate(**{field: Max(field) for field in RECORD_FIELDS})
+            .order_by()
+        )
+        for row in records:
+            add_records(stats[row['user_id']], row['activity_type'], row)
+
+    days = {}
+    for user_id, day in (
+        ActivityRollup.objects.filter(user_id__in=user_ids)
+        .values_list('user_id', 'day').distinct().order_by('user_id', 'day')
+    ):
+        days.setdefault(user_id, []).append(day)
+    for user_id, active_days in days.items():
+        user_stats = stats[user_id]
+        user_stats.current_streak, user_stats.longest_streak = streaks(active_days)
+        user_stats.last_active_day = active_days[-1]
+
+    with transaction.atomic():
+        UserStats.objects.filter(user_id__in=user_ids).delete()
+        return len(UserStats.objects.bulk_create(stats.values()))
+
+
+def recompute_streaks(stats):
+    """Recomputes the streaks of one user from their active days in the rollups."""
+    days = list(
+        ActivityRollup.objects.filter(user_id=stats.user_id)
+        .values_list('day', flat=True).distinct().order_by('day')
+    )
+    stats.current_streak, stats.longest_streak = streaks(days)
+    stats.last_active_day = days[-1] if days else None
+
+
+def recompute_records(stats, activity_type):
+    """Recomputes the records of one activity type of one user from their live and archived activities."""
+    stats.records.pop(activity_type, None)
+    for model in activity_models():
+        best = model.objects.filter(user_id=stats.user_id, activity_type=activity_type).aggregate(
+            **{field: Max(field) for field in RECORD_FIELDS}
+        )
+        if best['distance'] is not None:
+            add_records(stats, activity_type, best)
+
+
+def add_totals(stats, activity, sign=1):
+    stats.activity_count += sign
+    stats.total_duration += sign * activity.duration
+    stats.total_distance += sign * activity.distance
+    stats.total_calories += sign * activity.calories_burned
+
+
+def add_records(stats, activity_type, values):
+    """Raises the records of an activity type to the given values (a dict of RECORD_FIELDS) where they beat them."""
+    records = stats.records.setdefault(activity_type, {})
+    for field in RECORD_FIELDS:
+        value = values[field]
+        if records.get(field) is None or value > records[field]:
+            records[field] = value
+
+
+def activity_records(activity):
+    return {field: getattr(activity, field) for field in RECORD_FIELDS}
+
+
+def holds_record(stats, activity):
+    """Whether the activity might be the one holding a record of its type."""
+    records = stats.records.get(activity.activity_type, {})
+    return any(records.get(field) is not None and getattr(activity, field) >= records[field]
+               for field in RECORD_FIELDS)
+
+
+def extend_streak(stats, day):
+    """
+    Counts a new active day. Days after the last active one extend or restart the
+    current streak; an earlier day may join two streaks, so those are recomputed.
+    Returns False when the streaks need recomputing.
+    """
+    last = stats.last_active_day
+    if last is None or day > last + timedelta(days=1):
+        stats.current_streak = 1
+    elif day == last + timedelta(days=1):
+        stats.current_streak += 1
+    elif day < last:
+        return False
+    stats.last_active_day = max(day, last) if last else day
+    stats.longest_streak = max(stats.longest_streak, stats.current_streak)
+    return True
+
+
+def locked_stats(user_id):
+    """Returns the user's stats row locked for update, or None if it does not exist yet."""
+    return UserStats.objects.select_for_update().filter(user_id=user_id).first()
+
+
+def add_activities(activities):
+    """Adds newly created activities to their users' stats, saving each row once."""
+    by_user = {}
+    for activity in activities:
+        by_user.setdefault(activity.user_id, []).append(activity)
+
+    for user_id, user_activities in by_user.items():
+        with transaction.atomic(savepoint=False):
+            stats = locked_stats(user_id)
+            if stats is None:
+                # First activity, or stats never built for this user: the rebuild includes the new ones
+                rebuild_stats([user_id])
+                continue
+            streaks_valid = True
+            for activity in user_activities:
+                add_totals(stats, activity)
+                add_records(stats, activity.activity_type, activity_records(activity))
+                streaks_valid = extend_streak(stats, activity_day(activity.date)) and streaks_valid
+            if not streaks_valid:
+                recompute_streaks(stats)
+            stats.save()
+
+
+def remove_activity(activity, bucket_emptied=True):
+    """
+    Removes a deleted activity from its user's stats. Records of its type are only
+    recomputed if it may have held one, and streaks only if its day is now empty:
+    the day is only looked up when removing the activity emptied its rollup bucket
+    (`bucket_emptied`, as returned by rollups.add_activity).
+    """
+    with transaction.atomic(savepoint=False):
+        stats = locked_stats(activity.user_id)
+        if stats is None:
+            rebuild_stats([activity.user_id])
+            return
+        add_totals(stats, activity, sign=-1)
+        if holds_record(stats, activity):
+            recompute_records(stats, activity.activity_type)
+        # The rollups were updated before this runs, so an empty day has no bucket left
+        if bucket_emptied and not ActivityRollup.objects.filter(user_id=activity.user_id, day=activity_day(activity.date)).exists():
+            recompute_streaks(stats)
+        stats.save()
+
+
+def change_activity(previous, activity):
+    """Replaces the stored version of an edited activity with its new values in the user's stats."""
+    if previous.user_id != activity.user_id:
+        remove_activity(previous)
+        add_activities([activity])
+        return
+
+    with transaction.atomic(savepoint=False):
+        stats = locked_stats(activity.user_id)
+        if stats is None:
+            rebuild_stats([activity.user_id])
+            return
+        add_totals(stats, previous, sign=-1)
+        add_totals(stats, activity)
+        recomputed = holds_record(stats, previous)
+        if recomputed:
+            # Read after the save, so a recount of the same type already includes the new values
+            recompute_records(stats, previous.activity_type)
+        if not recomputed or activity.activity_type != previous.activity_type:
+            add_records(stats, activity.activity_type, activity_records(activity))
+        if activity_day(activity.date) != activity_day(previous.date):
+            recompute_streaks(stats)
+        stats.save()
@@ -0,0 +1,180 @@
+import asyncio
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import APIException, NotAuthenticated, Throttled
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from .models import Notification
+from .notifications import stream_key
+from .pubsub import get_broker
+from .serializers import NotificationSerializer
+from .throttling import TokenBucketThrottle
+
+
+def authenticate(request, throttle=False):
+    """
+    Authenticates a plain Django request with the API's authentication classes and,
+    with `throttle`, rate limits it as the API views are (see activities.throttling).
+    """
+    authenticators = [authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    api_request = Request(request, authenticators=authenticators)
+    try:
+        user = api_request.user  # Also sets request.user
+    except APIException as exc:
+        return None, exc, authenticators
+    if not user.is_authenticated:
+        return None, NotAuthenticated(), authenticators
+    if throttle:
+        limiter = TokenBucketThrottle()
+        if not limiter.allow_request(request, None):
+            return None, Throttled(limiter.wait()), []
+    return user, None, authenticators
+
+
+async def authenticated_user(request, throttle=False):
+    """Returns `(user, None)`, or `(None, error response)` when the request is not authenticated (or throttled)."""
+    user, error, authenticators = await sync_to_async(authenticate)(request, throttle)
+    if error is None:
+        return user, None
+    response = JsonResponse({'detail': str(error.detail)}, status=error.status_code)
+    if authenticators:
+        response['WWW-Authenticate'] = authenticators[0].authenticate_header(request)
+    if getattr(error, 'wait', None) is not None:
+        response['Retry-After'] = str(error.wait)
+    return None, response
+
+
+def latest_id(user_id):
+    return Notification.objects.filter(user_id=user_id).aggregate(latest=Max('id'))['latest'] or 0
+
+
+def notifications_after(user_id, after):
+    """Returns up to NOTIFICATION_STREAM_REPLAY_LIMIT of the user's notifications newer than id `after`."""
+    notifications = (
+        Notification.objects.filter(user_id=user_id, pk__gt=after)
+        .select_related('user').order_by('pk')[:settings.NOTIFICATION_STREAM_REPLAY_LIMIT]
+    )
+    return [dict(data) for data in NotificationSerializer(notifications, many=True).data]
+
+
+def parse_id(value):
+    """Parses a notification id sent by the client, returning None when it is missing or invalid."""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value >= 0 else None
+
+
+def format_event(message):
+    data = json.dumps(message, cls=DjangoJSONEncoder)
+    return f"id: {message['id']}\nevent: notification\ndata: {data}\n\n"
+
+
+async def event_stream(user_id, last_id):
+    """
+    Yields Server-Sent Events for the user's notifications newer than `last_id`
+    until NOTIFICATION_STREAM_MAX_SECONDS have passed. Notifications created
+    before the subscription started, or dropped because the connection fell
+    behind, are read back from the database; idle periods are filled with
+    keep-alive comments.
+    """
+    broker = get_broker()
+    # Subscribe before reading the database, so nothing created in between is missed
+    subscription = broker.subscribe(stream_key(user_id))
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.NOTIFICATION_STREAM_MAX_SECONDS
+    try:
+        yield f'retry: {settings.NOTIFICATION_STREAM_RETRY_MS}\n\n'
+        pending = await sync_to_async(notifications_after)(user_id, last_id)
+        replaying = True
+
+        while True:
+            for message in pending:
+                if message['id'] > last_id:
+                    last_id = message['id']
+                    yield format_event(message)
+
+            if subscription.overflowed or (replaying and len(pending) == settings.NOTIFICATION_STREAM_REPLAY_LIMIT):
+                subscription.overflowed = False
+                pending = await sync_to_async(notifications_after)(user_id, last_id)
+                replaying = True
+                continue
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            message = await subscription.get(timeout=min(settings.NOTIFICATION_STREAM_HEARTBEAT, remaining))
+            pending, replaying = ([message] if message is not None else []), False
+            if message is None and not subscription.overflowed:
+                yield ': keep-alive\n\n'
+    finally:
+        broker.unsubscribe(subscription)
+
+
+@require_GET
+async def notification_stream(request):
+    """
+    Streams the authenticated user's new notifications as Server-Sent Events
+    (text/event-stream). Reconnecting clients send the standard Last-Event-ID
+    header (or ?last_id=) to receive what they missed. Each open stream costs a
+    bounded queue and an idle coroutine, so it should be served over ASGI.
+    """
+    user, error = await authenticated_user(request)
+    if error is not None:
+        return error
+
+    last_id = parse_id(request.headers.get('Last-Event-ID', request.GET.get('last_id')))
+    if last_id is None:
+        last_id = await sync_to_async(latest_id)(user.pk)
+    response = StreamingHttpResponse(event_stream(user.pk, last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Keep reverse proxies from buffering the events
+    return response
+
+
+@require_GET
+async def notification_poll(request):
+    """
+    Long-poll alternative to the event stream: returns the user's notifications
+    newer than `?after=<id>` as soon as there are any, or an empty list after
+    `?timeout=` seconds (at most NOTIFICATION_POLL_TIMEOUT). Without `after`, only
+    notifications created while the request is waiting are returned.
+    """
+    user, error = await authenticated_user(request)
+    if error is not None:
+        return error
+
+    after = parse_id(request.GET.get('after'))
+    if 'after' in request.GET and after is None:
+        return JsonResponse({'error': "'after' must be a notification id."}, status=400)
+    try:
+        timeout = min(float(request.GET.get('timeout', settings.NOTIFICATION_POLL_TIMEOUT)),
+                      settings.NOTIFICATION_POLL_TIMEOUT)
+    except ValueError:
+        return JsonResponse({'error': "'timeout' must be a number of seconds."}, status=400)
+
+    if after is None:
+        after = await sync_to_async(latest_id)(user.pk)
+    broker = get_broker()
+    subscription = broker.subscribe(stream_key(user.pk))
+    try:
+        results = await sync_to_async(notifications_after)(user.pk, after)
+        if not results and timeout > 0:
+            message = await subscription.get(timeout=timeout)
+            if subscription.overflowed:
+                results = await sync_to_async(notifications_after)(user.pk, after)
+            elif message is not None:
+                results = [message]
+                while not subscription.queue.empty():
+                    results.append(subscription.queue.get_nowait())
+        results = [message for message in results if message['id'] > after]
+    finally:
+        broker.unsubscribe(subscription)
+
+    return JsonResponse({'results': results, 'last_id': results[-1]['id'] if results else after})
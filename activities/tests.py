@@ -1,11 +1,72 @@
+import asyncio
+import json
+import math
+import re
+from datetime import date, timedelta
+from array import array
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, urlsplit
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Max, Min, Sum
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 from rest_framework import status
 from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import get_user_model
-from .models import Activity, Notification
+from .models import Activity, ActivityRollup, Job, Notification, NotificationCounter, UserStats
+from .pagination import HistoryCursorPagination
+from .caching import metrics_cache_stats
+from .authentication import user_cache, user_cache_key
+from .checks import SHARED_CACHE_SETTINGS, check_shared_caches
+from .instrumentation import install_query_recorder, request_stats
+from .benchmarks import compare_sqlite_writers, gpx_document, summarize
+from .notifications import stream_key
+from .pubsub import InMemoryBroker, get_broker
+from .jobs import JOB_HANDLERS, PERIODIC_JOBS, claim, ensure_periodic_jobs, reschedule, run_jobs
+from .stats import rebuild_stats
+from .leaderboards import refresh_leaderboards, ranked_weeks
+from .models import ActivityTrack, ArchivedActivity, IdempotencyKey, LeaderboardEntry
+from .idempotency import purge_idempotency_keys
+from .throttling import TokenBucket
+from .tracks import EARTH_RADIUS_KM, TrackError, TrackReader, empty_columns, haversine_km, pack_track, track_points, unpack_track
+from .archive import archive_activities
+from .rollups import rebuild_rollups
+from .routers import request_user_id
+from .rules import evaluate_activity_rules
 
 User = get_user_model()
 
+
+def log_activity(date, **fields):
+    """
+    Creates an activity on `date`. auto_now_add dates it now on insert, and clients
+    cannot set the (read-only) date, so the row's date is then written directly with
+    save(), whose signals move the derived tables along incrementally.
+    """
+    activity = Activity.objects.create(**fields)
+    activity.date = date
+    activity.save()
+    return activity
+
+
+def empty_cache(test):
+    """
+    Starts `test` from an empty cache and empties it again once the test is done:
+    user and activity ids are reused by later tests, which must not find these entries.
+    """
+    cache.clear()
+    test.addCleanup(cache.clear)
+
+
 class FitnessTrackerApiTests(APITestCase):
 
     def setUp(self):
@@ -81,3 +142,1520 @@ class FitnessTrackerApiTests(APITestCase):
         response = self.client.get(self.activity_url)
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)  # Ensure access is denied
 
+
+class ActivityRollupTests(APITestCase):
+
+    def setUp(self):
+        """Create a user and authenticate with a token."""
+        empty_cache(self)
+        self.user = User.objects.create_user(username='rollupuser', password='testpassword')
+        response = self.client.post(reverse('token_obtain_pair'), {
+            'username': 'rollupuser',
+            'password': 'testpassword'
+        })
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+        self.activity_data = {'activity_type': 'Running', 'duration': 30, 'distance': 5, 'calories_burned': 300}
+
+    def test_rollups_follow_activity_writes(self):
+        """Test that creating, updating and deleting activities keeps the rollups in sync."""
+        response = self.client.post(reverse('activity-list'), self.activity_data)
+        activity_url = reverse('activity-detail', args=[response.data['id']])
+        self.client.post(reverse('activity-list'), self.activity_data)
+
+        rollup = ActivityRollup.objects.get(user=self.user, activity_type='Running')
+        self.assertEqual(rollup.activity_count, 2)
+        self.assertEqual(rollup.total_duration, 60)
+
+        self.client.patch(activity_url, {'activity_type': 'Cycling', 'duration': 45})
+        rollup.refresh_from_db()
+        self.assertEqual(rollup.total_duration, 30)
+        self.assertEqual(ActivityRollup.objects.get(user=self.user, activity_type='Cycling').total_duration, 45)
+
+        self.client.delete(activity_url)
+        self.assertFalse(ActivityRollup.objects.filter(activity_type='Cycling').exists())
+
+    def test_failed_write_leaves_no_derived_rows(self):
+        """Test that a receiver failing partway rolls back the activity and everything derived from it."""
+        with mock.patch('activities.signals.stats.add_activities', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post(reverse('activity-list'), self.activity_data)
+        self.assertFalse(Activity.objects.exists())
+        self.assertFalse(ActivityRollup.objects.exists())
+        self.assertFalse(Job.objects.filter(kind='activity_created').exists())
+
+    def test_metrics_are_answered_from_rollups(self):
+        """Test that the metrics endpoint sums the rollups and the partial first day."""
+        for _ in range(3):
+            self.client.post(reverse('activity-list'), self.activity_data)
+        response = self.client.get(reverse('activity-metrics'), {'period': 'monthly'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_duration'], '01:30:00')
+        self.assertEqual(response.data['total_distance'], 15)
+        self.assertEqual(response.data['total_calories'], 900)
+
+    def test_rebuild_rollups_command(self):
+        """Test that the rebuild command recreates rollups from the raw activities."""
+        Activity.objects.create(user=self.user, **self.activity_data)
+        Activity.objects.create(user=self.user, **self.activity_data)
+        ActivityRollup.objects.all().delete()
+
+        call_command('rebuild_rollups', batch_size=1, stdout=StringIO())
+        rollup = ActivityRollup.objects.get(user=self.user)
+        self.assertEqual(rollup.activity_count, 2)
+        self.assertEqual(rollup.total_calories, 600)
+
+
+class ActivityTimeSeriesTests(APITestCase):
+
+    def setUp(self):
+        """Create a user with rollups on a few days of October 2024."""
+        empty_cache(self)
+        self.user = User.objects.create_user(username='seriesuser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('activity-metrics-series')
+        for day, activity_type, duration in [(1, 'Running', 30), (2, 'Cycling', 60), (9, 'Running', 45)]:
+            ActivityRollup.objects.create(
+                user=self.user, activity_type=activity_type, day=date(2024, 10, day),
+                activity_count=1, total_duration=duration, total_distance=5, total_calories=300,
+            )
+
+    def test_daily_series_is_zero_filled(self):
+        """Test that every day in the range is returned, including days without activity."""
+        response = self.client.get(self.url, {'start': '2024-10-01', 'end': '2024-10-05'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        series = response.data['series']
+        self.assertEqual([point['bucket'] for point in series],
+                         ['2024-10-01', '2024-10-02', '2024-10-03', '2024-10-04', '2024-10-05'])
+        self.assertEqual(series[0]['total_duration'], '00:30:00')
+        self.assertEqual(series[3]['activity_count'], 0)
+
+    def test_weekly_series_grouped_by_activity_type(self):
+        """Test weekly buckets split per activity type."""
+        response = self.client.get(self.url, {
+            'start': '2024-10-01', 'end': '2024-10-13', 'bucket': 'week', 'group_by': 'activity_type',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        running = [point for point in response.data['series'] if point['activity_type'] == 'Running']
+        self.assertEqual([point['bucket'] for point in running], ['2024-09-30', '2024-10-07'])
+        self.assertEqual([point['total_duration'] for point in running], ['00:30:00', '00:45:00'])
+
+    def test_series_uses_a_single_query(self):
+        """Test that all buckets are read with one grouped query regardless of the range."""
+        with self.assertNumQueries(2):  # The change marker for the ETag, then the grouped rollup query
+            response = self.client.get(self.url, {'start': '2024-01-01', 'end': '2024-12-31', 'bucket': 'month'})
+        self.assertEqual(len(response.data['series']), 12)
+
+    def test_invalid_range(self):
+        """Test that an end date before the start date is rejected."""
+        response = self.client.get(self.url, {'start': '2024-10-05', 'end': '2024-10-01'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class UserStatsTests(APITestCase):
+
+    def setUp(self):
+        """Create a user and a helper for activities on a given day."""
+        self.user = User.objects.create_user(username='statsuser', email='stats@example.com', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.now = timezone.now()
+
+    def log(self, days_ago, activity_type='Running', distance=5, duration=30):
+        return log_activity(
+            self.now - timedelta(days=days_ago), user=self.user, activity_type=activity_type,
+            duration=duration, distance=distance, calories_burned=duration * 10,
+        )
+
+    def snapshot(self):
+        stats = UserStats.objects.get(user=self.user)
+        return {field: getattr(stats, field) for field in (
+            'activity_count', 'total_duration', 'total_distance', 'total_calories', 'records',
+            'current_streak', 'longest_streak', 'last_active_day',
+        )}
+
+    def test_incremental_updates_match_a_rebuild(self):
+        """Test that creates, edits and deletes leave the same stats as recomputing them from scratch."""
+        longest = self.log(5, distance=21)
+        self.log(4, distance=8)
+        swim = self.log(1, 'Swimming', distance=1.5, duration=45)
+        self.log(0, distance=6)
+        self.client.post(reverse('activity-bulk-create'), [
+            {'activity_type': 'Cycling', 'duration': 90, 'distance': 40, 'calories_burned': 700},
+        ] * 2, format='json')
+
+        longest.distance = 7  # The record holder gets shorter
+        longest.save()
+        swim.activity_type, swim.date = 'Walking', self.now - timedelta(days=3)
+        swim.save()
+        self.client.delete(reverse('activity-detail', args=[self.log(2).pk]))
+
+        incremental = self.snapshot()
+        rebuild_stats([self.user.pk])
+        self.assertEqual(incremental, self.snapshot())
+        self.assertEqual(incremental['records']['Running']['distance'], 8)
+        self.assertNotIn('Swimming', incremental['records'])
+
+    def test_streaks(self):
+        """Test that streaks grow day by day and that a backdated activity can join two streaks."""
+        for days_ago in (6, 5, 3, 2, 1):
+            self.log(days_ago)
+        stats = self.snapshot()
+        self.assertEqual((stats['current_streak'], stats['longest_streak']), (3, 3))
+        self.log(4)
+        stats = self.snapshot()
+        self.assertEqual((stats['current_streak'], stats['longest_streak']), (6, 6))
+
+    def test_stats_endpoint_is_a_single_lookup(self):
+        """Test that the stats endpoint reads one row, and builds it once for users without one."""
+        self.log(1, distance=10)
+        self.log(0, distance=4)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('activity-stats'))
+        self.assertEqual(response.data['activity_count'], 2)
+        self.assertEqual(response.data['total_duration'], '01:00:00')
+        self.assertEqual(response.data['current_streak'], 2)
+        self.assertEqual(response.data['records']['Running']['distance'], 10)
+
+        UserStats.objects.all().delete()
+        self.assertEqual(self.client.get(reverse('activity-stats')).data['total_distance'], 14)
+
+
+class LeaderboardTests(APITestCase):
+
+    def setUp(self):
+        """Create three users with runs of different lengths this week and rank them."""
+        self.users = [
+            User.objects.create_user(username=f'runner{i}', email=f'runner{i}@example.com', password='testpassword')
+            for i in range(3)
+        ]
+        for user, distance in zip(self.users, [10, 25, 5]):
+            Activity.objects.create(user=user, activity_type='Running', duration=60, distance=distance, calories_burned=500)
+        Activity.objects.create(user=self.users[2], activity_type='Cycling', duration=90, distance=30, calories_burned=600)
+        refresh_leaderboards()
+        self.client.force_authenticate(user=self.users[0])
+
+    def ranking(self):
+        return sorted(LeaderboardEntry.objects.values_list(
+            'activity_type', 'user__username', 'distance', 'distance_rank', 'duration_rank', 'calories_rank',
+        ))
+
+    def test_top_and_own_rank(self):
+        """Test that the leaderboard and the user's own rank are read with one query each."""
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('leaderboard'), {'activity_type': 'Running', 'limit': 2})
+        self.assertEqual([(row['rank'], row['username']) for row in response.data['results']],
+                         [(1, 'runner1'), (2, 'runner0')])
+        self.assertEqual(response.data['me'], {'rank': 2, 'username': 'runner0', 'value': 10})
+
+        response = self.client.get(reverse('leaderboard'))  # All activity types, by distance
+        self.assertEqual(response.data['results'][0]['username'], 'runner2')
+        response = self.client.get(reverse('leaderboard'), {'metric': 'duration'})
+        self.assertEqual(response.data['me']['rank'], 2)
+
+    def test_incremental_updates_match_a_refresh(self):
+        """Test that queued updates move, add and remove entries exactly like a full re-ranking."""
+        Job.objects.all().delete()
+        newcomer = User.objects.create_user(username='newcomer', email='newcomer@example.com', password='testpassword')
+        Activity.objects.create(user=newcomer, activity_type='Running', duration=20, distance=7, calories_burned=150)
+        Activity.objects.create(user=self.users[0], activity_type='Running', duration=60, distance=20, calories_burned=500)
+        Activity.objects.filter(user=self.users[2], activity_type='Cycling').get().delete()
+        while run_jobs():
+            pass
+
+        incremental = self.ranking()
+        refresh_leaderboards()
+        self.assertEqual(incremental, self.ranking())
+        self.assertFalse(LeaderboardEntry.objects.filter(activity_type='Cycling').exists())
+
+    def test_refresh_job_reschedules_itself(self):
+        """Test that the periodic refresh queues its next run after each run."""
+        Job.objects.all().delete()
+        ensure_periodic_jobs()
+        self.assertEqual(run_jobs(), len(PERIODIC_JOBS))
+        job = Job.objects.get(kind='leaderboard_refresh')
+        self.assertGreater(job.run_after, timezone.now())
+        ensure_periodic_jobs()
+        self.assertEqual(Job.objects.count(), len(PERIODIC_JOBS))
+
+    def test_periodic_jobs_are_queued_once(self):
+        """Test that schedulers racing each other (both seeing no pending run) queue a single run per kind."""
+        Job.objects.all().delete()
+        with mock.patch.object(Job.objects, 'filter', return_value=Job.objects.none()):
+            ensure_periodic_jobs()
+            ensure_periodic_jobs()
+        reschedule('leaderboard_refresh')
+        self.assertEqual(Job.objects.count(), len(PERIODIC_JOBS))
+
+    def test_only_recent_weeks_are_ranked(self):
+        week = ranked_weeks()[-1] - timedelta(weeks=1)
+        response = self.client.get(reverse('leaderboard'), {'week': week})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(ACTIVITY_ARCHIVE_AFTER_DAYS=365)
+class ActivityArchiveTests(APITestCase):
+
+    def setUp(self):
+        """Create a user with two activities past the archive horizon and one recent activity."""
+        empty_cache(self)
+        self.user = User.objects.create_user(username='archiveuser', email='archive@example.com', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.now = timezone.now()
+        self.old = [self.log(400, distance=12), self.log(500, activity_type='Cycling', distance=30)]
+        self.recent = self.log(3, distance=8)
+        self.url = reverse('activity-list')
+
+    def log(self, days_ago, activity_type='Running', distance=5):
+        return log_activity(
+            self.now - timedelta(days=days_ago), user=self.user, activity_type=activity_type,
+            duration=30, distance=distance, calories_burned=300,
+        )
+
+    def test_old_activities_are_moved_in_batches(self):
+        """Test that archival moves only activities past the horizon, keeping their ids, and can be rerun."""
+        rollups = list(ActivityRollup.objects.order_by('pk').values())
+        self.assertEqual(archive_activities(batch_size=1, max_batches=1), 1)
+        self.assertEqual(archive_activities(batch_size=1), 1)
+        self.assertEqual(archive_activities(), 0)
+        self.assertEqual(list(Activity.objects.values_list('pk', flat=True)), [self.recent.pk])
+        self.assertEqual(
+            sorted(ArchivedActivity.objects.values_list('pk', flat=True)), sorted(a.pk for a in self.old)
+        )
+        self.assertEqual(list(ActivityRollup.objects.order_by('pk').values()), rollups)
+
+    def test_list_reads_the_archive_only_when_the_range_reaches_it(self):
+        """Test that the list includes archived activities for unbounded or old ranges only."""
+        archive_activities()
+        response = self.client.get(self.url, {'ordering': '-date'})
+        self.assertEqual([item['id'] for item in response.data['results']],
+                         [self.recent.pk] + [a.pk for a in self.old])
+
+        recent = {'start_date': (self.now - timedelta(days=30)).isoformat(), 'end_date': self.now.isoformat()}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, recent)
+        self.assertEqual([item['id'] for item in response.data['results']], [self.recent.pk])
+        self.assertFalse(any('archivedactivity' in query['sql'] for query in queries))
+
+        response = self.client.get(self.url, {'cursor': '', 'activity_type': 'Cycling'})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.old[1].pk])
+        response = self.client.get(reverse('activity-detail', args=[self.old[0].pk]))
+        self.assertEqual(response.data['distance'], 12)
+
+    def test_archived_activities_can_be_edited_and_deleted(self):
+        """Test that edits and deletes of an archived activity move it back first, keeping the rollups right."""
+        archive_activities()
+        response = self.client.patch(reverse('activity-detail', args=[self.old[0].pk]), {'distance': 20})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        activity = Activity.objects.get(pk=self.old[0].pk)
+        self.assertEqual((activity.distance, activity.date), (20, self.old[0].date))
+        self.assertFalse(ArchivedActivity.objects.filter(pk=self.old[0].pk).exists())
+        rollup = ActivityRollup.objects.get(user=self.user, activity_type='Running', day=timezone.localdate(self.old[0].date))
+        self.assertEqual((rollup.activity_count, rollup.total_distance), (1, 20))
+
+        response = self.client.delete(reverse('activity-detail', args=[self.old[1].pk]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Activity.objects.filter(pk=self.old[1].pk).exists())
+        self.assertFalse(ArchivedActivity.objects.filter(pk=self.old[1].pk).exists())
+        self.assertFalse(ActivityRollup.objects.filter(activity_type='Cycling').exists())
+
+        other = User.objects.create_user(username='other', password='testpassword')
+        self.client.force_authenticate(user=other)
+        response = self.client.delete(reverse('activity-detail', args=[self.recent.pk]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_uploads_of_archived_activities_are_recognised(self):
+        """Test that retried uploads match archived activities by external id, one at a time or in bulk."""
+        Activity.objects.filter(pk=self.old[0].pk).update(external_id='watch-1')
+        archive_activities()
+        item = {'activity_type': 'Running', 'duration': 30, 'distance': 12, 'calories_burned': 300, 'external_id': 'watch-1'}
+        response = self.client.post(self.url, item)
+        self.assertEqual((response.status_code, response.data['id']), (status.HTTP_200_OK, self.old[0].pk))
+        response = self.client.post(reverse('activity-bulk-create'), [item], format='json')
+        self.assertEqual(response.data['duplicates'], [{'index': 0, 'id': self.old[0].pk}])
+        self.assertFalse(Activity.objects.filter(external_id='watch-1').exists())
+
+    def test_exports_and_rebuilds_include_the_archive(self):
+        """Test that exports and rollup/stats rebuilds still see archived activities."""
+        rollups = list(ActivityRollup.objects.order_by('user_id', 'activity_type', 'day').values(
+            'activity_type', 'day', 'activity_count', 'total_distance'))
+        stats = UserStats.objects.get(user=self.user).records
+        archive_activities()
+
+        response = self.client.get(reverse('activity-export'), {'output': 'ndjson'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.old[1].pk, self.old[0].pk, self.recent.pk])
+
+        rebuild_rollups([self.user.pk])
+        rebuild_stats([self.user.pk])
+        self.assertEqual(list(ActivityRollup.objects.order_by('user_id', 'activity_type', 'day').values(
+            'activity_type', 'day', 'activity_count', 'total_distance')), rollups)
+        self.assertEqual(UserStats.objects.get(user=self.user).records, stats)
+
+
+class QueryCountTests(APITestCase):
+
+    def setUp(self):
+        """Create a user; authentication is forced so only the endpoint's own queries are counted."""
+        self.user = User.objects.create_user(username='queryuser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+
+    def create_rows(self, count):
+        for _ in range(count):
+            Activity.objects.create(user=self.user, activity_type='Running', duration=30, distance=5, calories_burned=300)
+            Notification.objects.create(user=self.user, message='Keep going!')
+
+    def test_activity_list_query_count_is_constant(self):
+        """Test that listing activities costs a marker lookup, a count and a select, whatever the page size."""
+        for count in (2, 10):
+            self.create_rows(count)
+            with self.assertNumQueries(3):
+                self.client.get(reverse('activity-list'))
+
+    def test_notification_list_query_count_is_constant(self):
+        """Test that listing notifications costs a marker lookup, a count and a select, whatever the page size."""
+        for count in (2, 10):
+            self.create_rows(count)
+            with self.assertNumQueries(3):
+                self.client.get(reverse('notification-list'))
+
+    def test_retrieve_uses_one_query(self):
+        """Test that retrieving a single activity or notification costs a marker lookup and one select."""
+        self.create_rows(1)
+        activity_url = reverse('activity-detail', args=[Activity.objects.get().pk])
+        notification_url = reverse('notification-detail', args=[Notification.objects.get().pk])
+        with self.assertNumQueries(2):
+            self.client.get(activity_url)
+        with self.assertNumQueries(2):
+            self.client.get(notification_url)
+
+    def test_create_query_count(self):
+        """
+        Test that creating an activity costs its insert, the rollup, change marker and
+        stats updates, and one insert for all its jobs, in a single transaction.
+        """
+        data = {'activity_type': 'Running', 'duration': 30, 'distance': 5, 'calories_burned': 300}
+        self.client.post(reverse('activity-list'), data)  # The first activity builds the stats row
+        with self.assertNumQueries(8):  # Including the savepoint pair of the write's transaction
+            response = self.client.post(reverse('activity-list'), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            set(Job.objects.values_list('kind', flat=True)), {'activity_created', 'leaderboard_update'},
+        )
+
+    def test_notifications_are_scoped_to_the_user(self):
+        """Test that users only see their own notifications."""
+        other = User.objects.create_user(username='otheruser', email='other@example.com', password='testpassword')
+        Notification.objects.create(user=other, message='Not yours')
+        response = self.client.get(reverse('notification-list'))
+        self.assertEqual(response.data['count'], 0)
+
+
+class QueryPlanTests(APITestCase):
+    """
+    Runs EXPLAIN on the hot per-user queries and fails if any of them falls back to
+    a full table scan. Supported on SQLite and PostgreSQL.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='planuser', password='testpassword')
+        self.since = timezone.now() - timedelta(days=30)
+        self.until = timezone.now()
+
+    def assertNoFullScan(self, queryset):
+        vendor = connection.vendor
+        if vendor == 'sqlite':
+            plan = queryset.explain()
+            table = queryset.model._meta.db_table
+            # Only index seeks are accepted: "SCAN table" is a full pass even when it walks an index
+            seek = re.compile(rf'SEARCH {table} USING (?:COVERING )?INDEX ')
+            lines = [line for line in plan.splitlines() if re.search(rf'\b{table}\b', line)]
+            self.assertTrue(lines, plan)
+            self.assertEqual([line for line in lines if not seek.search(line)], [], plan)
+        elif vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # Tiny test tables are always cheaper to scan, so forbid it to see which index would be used
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                plan = queryset.explain()
+            self.assertNotIn('Seq Scan', plan, plan)
+        else:
+            self.skipTest(f"No query plan check for {vendor}")
+
+    def test_activity_date_range(self):
+        """Test the activity list and metrics date range filters."""
+        activities = Activity.objects.filter(user=self.user, date__range=[self.since, self.until])
+        self.assertNoFullScan(activities.order_by('-date'))
+        self.assertNoFullScan(activities.filter(activity_type='Running').order_by('date'))
+        self.assertNoFullScan(Activity.objects.filter(user=self.user, date__gte=self.since, date__lt=self.until))
+
+    def test_rollup_day_range(self):
+        """Test the rollup range used by the metrics endpoint."""
+        self.assertNoFullScan(ActivityRollup.objects.filter(user=self.user, day__gte=self.since.date()))
+
+    def test_unread_notifications(self):
+        """Test the per-user unread notification lookup."""
+        self.assertNoFullScan(Notification.objects.filter(user=self.user, is_read=False).order_by('-date'))
+        self.assertNoFullScan(Notification.objects.filter(user=self.user).order_by('-date'))
+
+    @skipUnless(connection.vendor == 'sqlite', "Checks SQLite's plan wording")
+    def test_index_scans_are_full_scans(self):
+        """Test that scans are rejected whether or not they walk an index."""
+        for queryset in (Activity.objects.filter(activity_type='Running'), Activity.objects.values('user_id')):
+            with self.assertRaises(AssertionError):
+                self.assertNoFullScan(queryset)
+
+
+class CursorPaginationTests(APITestCase):
+
+    def setUp(self):
+        """Create a user with a short activity and notification history."""
+        self.user = User.objects.create_user(username='cursoruser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        for _ in range(7):
+            Activity.objects.create(user=self.user, activity_type='Running', duration=30, distance=5, calories_burned=300)
+            Notification.objects.create(user=self.user, message='Keep going!')
+
+    def walk(self, url):
+        ids = []
+        response = self.client.get(url, {'cursor': '', 'page_size': 3})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)  # No COUNT(*) in cursor mode
+            ids += [item['id'] for item in response.data['results']]
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def test_walk_full_history_with_cursor(self):
+        """Test that following 'next' cursors returns every item exactly once, newest first."""
+        expected = list(Activity.objects.order_by('-date', '-id').values_list('id', flat=True))
+        self.assertEqual(self.walk(reverse('activity-list')), expected)
+        expected = list(Notification.objects.order_by('-date', '-id').values_list('id', flat=True))
+        self.assertEqual(self.walk(reverse('notification-list')), expected)
+
+    def test_cursor_page_size_is_capped(self):
+        """Test that client-selected page sizes are limited to the maximum."""
+        with mock.patch.object(HistoryCursorPagination, 'max_page_size', 5):
+            response = self.client.get(reverse('activity-list'), {'cursor': '', 'page_size': 1000})
+        self.assertEqual(len(response.data['results']), 5)
+        with self.assertNumQueries(2):  # The change marker, then a single keyset query with no COUNT(*)
+            self.client.get(reverse('activity-list'), {'cursor': '', 'page_size': 2})
+
+    def test_page_number_pagination_is_kept(self):
+        """Test that requests without a cursor still get page-number responses."""
+        response = self.client.get(reverse('activity-list'), {'page': 1})
+        self.assertEqual(response.data['count'], 7)
+        self.assertEqual(len(response.data['results']), 7)
+
+
+GPX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="test" xmlns="http://www.topografix.com/GPX/1/1"
+     xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1">
+  <metadata><time>2024-05-01T07:00:00Z</time></metadata>
+  <trk><type>running</type><trkseg>
+    <trkpt lat="52.0" lon="13.0"><ele>30.5</ele><time>2024-05-01T08:00:00Z</time>
+      <extensions><gpxtpx:TrackPointExtension><gpxtpx:hr>120</gpxtpx:hr></gpxtpx:TrackPointExtension></extensions>
+    </trkpt>
+    <trkpt lat="52.01" lon="13.0"><time>2024-05-01T08:05:00Z</time></trkpt>
+    <trkpt lon="13.0" lat="52.02"><ele>31</ele><time>2024-05-01T08:10:00Z</time>
+      <extensions><gpxtpx:TrackPointExtension><gpxtpx:hr>150</gpxtpx:hr></gpxtpx:TrackPointExtension></extensions>
+    </trkpt>
+  </trkseg></trk>
+</gpx>
+"""
+
+TCX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">
+  <Activities><Activity Sport="Biking"><Id>2024-05-01T08:00:00Z</Id>
+    <Lap StartTime="2024-05-01T08:00:00Z"><Calories>250</Calories>
+      <AverageHeartRateBpm><Value>130</Value></AverageHeartRateBpm>
+      <Track>
+        <Trackpoint><Time>2024-05-01T08:00:00Z</Time>
+          <Position><LatitudeDegrees>52.0</LatitudeDegrees><LongitudeDegrees>13.0</LongitudeDegrees></Position>
+          <AltitudeMeters>30</AltitudeMeters><HeartRateBpm><Value>110</Value></HeartRateBpm>
+        </Trackpoint>
+        <Trackpoint><Time>2024-05-01T08:10:00Z</Time><HeartRateBpm><Value>115</Value></HeartRateBpm></Trackpoint>
+        <Trackpoint><Time>2024-05-01T08:20:00Z</Time>
+          <Position><LatitudeDegrees>52.1</LatitudeDegrees><LongitudeDegrees>13.0</LongitudeDegrees></Position>
+          <HeartRateBpm><Value>140</Value></HeartRateBpm>
+        </Trackpoint>
+      </Track>
+    </Lap>
+    <Lap StartTime="2024-05-01T08:20:00Z"><Calories>50</Calories></Lap>
+  </Activity></Activities>
+</TrainingCenterDatabase>
+"""
+
+
+class ActivityTrackTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='trackuser', email='track@example.com', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('activity-import-track')
+        empty_cache(self)
+
+    def upload(self, body, content_type='application/gpx+xml', **params):
+        url = self.url + ('?' + '&'.join(f'{key}={value}' for key, value in params.items()) if params else '')
+        return self.client.generic('POST', url, body, content_type=content_type)
+
+    def test_gpx_import_creates_activity_and_track(self):
+        """Test that a GPX upload creates an activity with derived distance and duration and a packed track."""
+        response = self.upload(GPX, calories_burned=200)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['activity_type'], 'Running')
+        self.assertEqual(response.data['duration'], 10)
+        self.assertAlmostEqual(response.data['distance'], 2.224, places=2)  # 0.02 degrees of latitude
+        self.assertEqual(response.data['calories_burned'], 200)
+        self.assertEqual(response.data['points'], 3)
+
+        track = self.client.get(reverse('activity-track', args=[response.data['id']])).data
+        self.assertEqual(track['point_count'], 3)
+        self.assertEqual(track['points']['lat'], [52.0, 52.01, 52.02])
+        self.assertEqual(track['points']['elevation'], [30.5, None, 31.0])
+        self.assertEqual(track['points']['heart_rate'], [120, None, 150])
+        self.assertEqual(track['started_at'], '2024-05-01T08:00:00Z')
+
+    def test_tcx_import_reads_sport_calories_and_skips_unplaced_points(self):
+        """Test that TCX uploads take the sport and lap calories from the file and drop points without a position."""
+        response = self.upload(TCX, content_type='application/vnd.garmin.tcx+xml')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['activity_type'], 'Cycling')
+        self.assertEqual(response.data['calories_burned'], 300)
+        self.assertEqual(response.data['duration'], 20)
+        self.assertEqual(response.data['points'], 2)
+        track = ActivityTrack.objects.get(activity_id=response.data['id'])
+        self.assertEqual(list(unpack_track(track.data)['heart_rate']), [110, 140])
+
+    def test_invalid_uploads_are_rejected(self):
+        """Test that malformed XML, other documents and files without points are rejected."""
+        self.assertEqual(self.upload(GPX[:-20]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.upload(b'<html><body/></html>').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.upload(b'<gpx version="1.1"></gpx>').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.upload(GPX, content_type='text/plain').status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        self.assertFalse(Activity.objects.exists())
+
+    def test_reading_does_not_depend_on_chunk_boundaries(self):
+        """Test that the incremental reader gives the same columns whatever the chunk size."""
+        expected = track_points(TrackReader().read(BytesIO(GPX)).columns)
+        for chunk_size in (1, 7, 64):
+            self.assertEqual(track_points(TrackReader().read(BytesIO(GPX), chunk_size).columns), expected)
+        columns = TrackReader().read(BytesIO(GPX)).columns
+        self.assertEqual(track_points(unpack_track(pack_track(columns))), expected)
+
+    def test_namespace_prefixes_cdata_and_other_points(self):
+        """Test that prefixed tags and CDATA are read, and that waypoints and route points are not trackpoints."""
+        document = b"""<?xml version="1.0"?>
+<g:gpx xmlns:g="http://www.topografix.com/GPX/1/1" version="1.1">
+  <g:wpt lat="10.0" lon="10.0"><g:time>2024-05-01T06:00:00Z</g:time><g:type>water</g:type></g:wpt>
+  <g:rte><g:rtept lat="11.0" lon="11.0"/></g:rte>
+  <g:trk><g:type><![CDATA[running]]></g:type><g:trkseg>
+    <g:trkpt lat="52.0" lon="13.0"><g:time><![CDATA[2024-05-01T08:00:00Z]]></g:time></g:trkpt>
+    <g:trkpt lat="52.01" lon="13.0"><g:ele>31</g:ele><g:time>2024-05-01T08:05:00Z</g:time></g:trkpt>
+  </g:trkseg></g:trk>
+  <g:wpt lat="12.0" lon="12.0"><g:ele>99</g:ele><g:time>2024-05-01T09:00:00Z</g:time></g:wpt>
+</g:gpx>"""
+        for chunk_size in (1, 16, len(document)):
+            track = TrackReader().read(BytesIO(document), chunk_size)
+            points = track_points(track.columns)
+            self.assertEqual(points['lat'], [52.0, 52.01])
+            self.assertEqual(points['elevation'], [None, 31.0])
+            self.assertEqual((track.activity_type, track.elapsed_seconds), ('Running', 300))
+
+    def test_irregular_points_are_read_like_regular_ones(self):
+        """Test that points read with ElementTree, when laid out differently, give the same readings."""
+        document = gpx_document(20)
+        expected = track_points(TrackReader().read(BytesIO(document)).columns)
+        self.assertEqual(len(expected['lat']), 20)
+        irregular = document.replace(b'<trkpt lat="52.0000000" lon="13.0000000">', b'<trkpt lon="13.0000000" lat="52.0000000">')
+        self.assertEqual(track_points(TrackReader().read(BytesIO(irregular)).columns), expected)
+        broken = document.replace(b'<ele>30.0</ele>', b'<ele>30.0</time>')
+        with self.assertRaises(TrackError):
+            TrackReader().read(BytesIO(broken))
+
+    def create_track(self, seconds_per_100m, heart_rates, activity_type='Running'):
+        """Stores a straight track north along a meridian, one point every 100 m, with the given pace and heart rate per step."""
+        columns = empty_columns()
+        step = 0.1 / (EARTH_RADIUS_KM * math.pi / 180)  # 100 m of latitude in degrees
+        moment = 1714550400.0
+        for n in range(len(seconds_per_100m) + 1):
+            columns['lat'].append(n * step)
+            columns['lon'].append(13.0)
+            columns['elevation'].append(math.nan)
+            columns['time'].append(moment)
+            columns['heart_rate'].append(heart_rates[n - 1] if n else 0)
+            if n < len(seconds_per_100m):
+                moment += seconds_per_100m[n]
+        activity = Activity.objects.create(
+            user=self.user, activity_type=activity_type, duration=30, distance=len(seconds_per_100m) / 10,
+            calories_burned=300,
+        )
+        track = ActivityTrack.objects.create(
+            activity=activity, user=self.user, point_count=len(columns['lat']), data=pack_track(columns),
+        )
+        return activity, track
+
+    def test_analytics_splits_best_efforts_and_zones(self):
+        """Test the splits, best efforts and zone times of a 6 km run with a fast third km."""
+        paces = [33] * 20 + [27] * 10 + [33] * 30  # Seconds per 100 m: 5:30/km, 4:30/km in km 3
+        activity, _ = self.create_track(paces, [140 if pace == 33 else 175 for pace in paces])
+        response = self.client.get(reverse('activity-analytics', args=[activity.pk]), {'max_heart_rate': 190})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data
+
+        self.assertAlmostEqual(data['distance'], 6.0, places=3)
+        self.assertEqual(len(data['splits']), 6)
+        self.assertEqual([round(split['pace']) for split in data['splits']], [330, 330, 270, 330, 330, 330])
+        self.assertEqual(data['splits'][2]['average_heart_rate'], 175)
+        efforts = {effort['name']: effort for effort in data['best_efforts']}
+        self.assertEqual(set(efforts), {'1k', '5k'})
+        self.assertAlmostEqual(efforts['1k']['seconds'], 270, places=0)
+        self.assertAlmostEqual(efforts['1k']['start_distance'], 2.0, places=3)
+        self.assertAlmostEqual(efforts['5k']['seconds'], 4 * 330 + 270, places=0)
+
+        pace_zones = {zone['zone']: zone['seconds'] for zone in data['pace_zones']}
+        self.assertEqual(pace_zones, {1: 0, 2: 270, 3: 1650, 4: 0, 5: 0})
+        heart_rate_zones = {zone['zone']: zone['seconds'] for zone in data['heart_rate_zones']}
+        self.assertEqual(heart_rate_zones, {1: 0, 2: 0, 3: 1650, 4: 0, 5: 270})  # Bounds 114, 133, 152, 171
+
+    def test_analytics_are_cached_until_the_track_changes(self):
+        """Test that analytics are served from the cache and recomputed once the track is replaced."""
+        activity, track = self.create_track([30] * 10, [150] * 10)
+        url = reverse('activity-analytics', args=[activity.pk])
+        self.assertAlmostEqual(self.client.get(url).data['splits'][0]['pace'], 300, places=0)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertAlmostEqual(self.client.get(url).data['splits'][0]['pace'], 300, places=0)
+        self.assertFalse(any('activities_activitytrack' in query['sql'] for query in queries.captured_queries))
+
+        columns = unpack_track(track.data)
+        columns['time'] = array('d', (moment * 2 - columns['time'][0] for moment in columns['time']))
+        track.data = pack_track(columns)
+        with self.captureOnCommitCallbacks(execute=True):  # The cache is invalidated once the change commits
+            track.save()
+        self.assertAlmostEqual(self.client.get(url).data['splits'][0]['pace'], 600, places=0)
+
+    def test_analytics_errors(self):
+        """Test that activities without a track give 404 and invalid parameters 400."""
+        activity = Activity.objects.create(
+            user=self.user, activity_type='Running', duration=30, distance=5.0, calories_burned=300,
+        )
+        url = reverse('activity-analytics', args=[activity.pk])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(url, {'max_heart_rate': 20}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_haversine_distance(self):
+        """Test the great-circle distance along a route against known values."""
+        self.assertAlmostEqual(haversine_km(array('d', [0, 1]), array('d', [0, 0])), 111.195, places=2)
+        self.assertAlmostEqual(haversine_km(array('d', [0, 0, 0]), array('d', [0, 90, 180])), 20015.1, places=0)
+
+
+class BulkActivityTests(APITestCase):
+
+    def setUp(self):
+        """Create a user and the bulk endpoint URL."""
+        self.user = User.objects.create_user(username='bulkuser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('activity-bulk-create')
+        self.activity = {'activity_type': 'Running', 'duration': 30, 'distance': 5, 'calories_burned': 300}
+
+    def test_bulk_create_from_json_array(self):
+        """Test that a JSON array is inserted in one request and rolled up."""
+        response = self.client.post(self.url, [self.activity] * 3, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(Activity.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(ActivityRollup.objects.get(user=self.user).activity_count, 3)
+
+    def test_bulk_create_reports_invalid_items(self):
+        """Test that invalid NDJSON items are reported without failing the valid ones."""
+        body = '\n'.join([
+            json.dumps(self.activity),
+            json.dumps(dict(self.activity, duration=-5)),
+            '',
+            json.dumps(self.activity),
+        ])
+        response = self.client.post(self.url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+        self.assertIn('duration', response.data['errors'][0]['errors'])
+
+    def test_bulk_create_requires_a_list(self):
+        """Test that a single object is rejected."""
+        response = self.client.post(self.url, self.activity, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class IdempotentUploadTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='retryuser', email='retry@example.com', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('activity-list')
+        self.activity = {'activity_type': 'Running', 'duration': 30, 'distance': 5, 'calories_burned': 300}
+
+    def test_retried_request_replays_the_response(self):
+        """Test that a retry with the same Idempotency-Key returns the first response without creating anything."""
+        first = self.client.post(self.url, self.activity, format='json', HTTP_IDEMPOTENCY_KEY='upload-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        retry = self.client.post(self.url, self.activity, format='json', HTTP_IDEMPOTENCY_KEY='upload-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Activity.objects.filter(user=self.user).count(), 1)
+
+        other = self.client.post(self.url, {**self.activity, 'duration': 45}, format='json', HTTP_IDEMPOTENCY_KEY='upload-1')
+        self.assertEqual(other.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_failed_request_releases_its_key(self):
+        """Test that a request that failed validation can be retried, corrected, with the same key."""
+        invalid = self.client.post(self.url, {**self.activity, 'duration': 0}, format='json', HTTP_IDEMPOTENCY_KEY='k')
+        self.assertEqual(invalid.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url, self.activity, format='json', HTTP_IDEMPOTENCY_KEY='k')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_expired_keys_are_purged(self):
+        """Test that keys older than the TTL are purged and no longer replay their response."""
+        self.client.post(self.url, self.activity, format='json', HTTP_IDEMPOTENCY_KEY='old')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL + 1))
+        response = self.client.post(self.url, self.activity, format='json', HTTP_IDEMPOTENCY_KEY='old')
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Activity.objects.filter(user=self.user).count(), 2)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL + 1))
+        self.assertEqual(purge_idempotency_keys(), 1)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_external_id_returns_the_existing_activity(self):
+        """Test that an activity is created once per external id and user, and blank ids never match."""
+        first = self.client.post(self.url, {**self.activity, 'external_id': 'watch-42'}, format='json')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        again = self.client.post(self.url, {**self.activity, 'external_id': 'watch-42'}, format='json')
+        self.assertEqual(again.status_code, status.HTTP_200_OK)
+        self.assertEqual(again.data['id'], first.data['id'])
+
+        for _ in range(2):
+            self.client.post(self.url, {**self.activity, 'external_id': ''}, format='json')
+        other = User.objects.create_user(username='otheruser', email='other@example.com', password='testpassword')
+        Activity.objects.create(user=other, external_id='watch-42', **self.activity)
+        self.assertEqual(Activity.objects.filter(user=self.user).count(), 3)
+
+    def test_bulk_upload_reports_duplicates(self):
+        """Test that bulk items the user already has, or that repeat an earlier item, are reported instead of inserted."""
+        url = reverse('activity-bulk-create')
+        existing = Activity.objects.create(user=self.user, external_id='a', **self.activity)
+        items = [
+            {**self.activity, 'external_id': 'a'},
+            {**self.activity, 'external_id': 'b'},
+            {**self.activity, 'external_id': 'b'},
+            self.activity,
+        ]
+        response = self.client.post(url, items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        created_b = Activity.objects.get(user=self.user, external_id='b')
+        self.assertEqual(response.data['duplicates'], [{'index': 0, 'id': existing.pk}, {'index': 2, 'id': created_b.pk}])
+
+        response = self.client.post(url, items[:3], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 0)
+        self.assertEqual(len(response.data['duplicates']), 3)
+        self.assertEqual(Activity.objects.filter(user=self.user).count(), 3)
+
+    def test_bulk_upload_with_idempotency_key(self):
+        """Test that a retried bulk upload replays the first response."""
+        url = reverse('activity-bulk-create')
+        first = self.client.post(url, [self.activity] * 2, format='json', HTTP_IDEMPOTENCY_KEY='batch-1')
+        retry = self.client.post(url, [self.activity] * 2, format='json', HTTP_IDEMPOTENCY_KEY='batch-1')
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(Activity.objects.filter(user=self.user).count(), 2)
+
+
+class ActivityExportTests(APITestCase):
+
+    def setUp(self):
+        """Create a user with a few activities."""
+        self.user = User.objects.create_user(username='exportuser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('activity-export')
+        for activity_type in ['Running', 'Cycling', 'Running']:
+            Activity.objects.create(user=self.user, activity_type=activity_type, duration=30, distance=5, calories_burned=300)
+
+    def test_csv_export_streams_every_activity(self):
+        """Test that the CSV export is streamed with a header and one line per activity."""
+        response = self.client.get(self.url, HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'user,id,activity_type,duration,distance,calories_burned,date')
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[1].startswith('exportuser,'))
+
+    def test_ndjson_export_with_filter(self):
+        """Test the NDJSON export filtered by activity type."""
+        response = self.client.get(self.url, {'output': 'ndjson', 'activity_type': 'Running'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual({row['activity_type'] for row in rows}, {'Running'})
+
+    def test_invalid_output(self):
+        """Test that unknown export formats are rejected."""
+        response = self.client.get(self.url, {'output': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MetricsCacheTests(APITestCase):
+
+    def setUp(self):
+        """Create a user with one activity and start from an empty cache."""
+        empty_cache(self)
+        metrics_cache_stats.reset()
+        self.user = User.objects.create_user(username='cacheuser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('activity-metrics')
+        self.activity = {'activity_type': 'Running', 'duration': 30, 'distance': 5, 'calories_burned': 300}
+        Activity.objects.create(user=self.user, **self.activity)
+
+    def test_deploy_check_requires_a_shared_cache(self):
+        """Test that the deployment check flags process-local caches only."""
+        self.assertEqual(len(check_shared_caches(None)), len(SHARED_CACHE_SETTINGS))
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(check_shared_caches(None), [])
+
+    def test_repeated_requests_are_served_from_cache(self):
+        """Test that an unchanged user's metrics are only computed once."""
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['total_duration'], '00:30:00')
+        self.assertEqual(metrics_cache_stats.snapshot()['hits'], 1)
+        self.assertEqual(metrics_cache_stats.snapshot()['misses'], 1)
+
+    def test_activity_writes_invalidate_the_cache(self):
+        """Test that creating, updating and deleting activities through the API refreshes the metrics."""
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):  # Versions are bumped once the writes commit
+            response = self.client.post(reverse('activity-list'), self.activity)
+        self.assertEqual(self.client.get(self.url).data['total_duration'], '01:00:00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('activity-detail', args=[response.data['id']]), {'duration': 90})
+        self.assertEqual(self.client.get(self.url).data['total_duration'], '02:00:00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('activity-detail', args=[response.data['id']]))
+        self.assertEqual(self.client.get(self.url).data['total_duration'], '00:30:00')
+
+    def test_invalidation_waits_for_the_commit(self):
+        """Test that metrics read while a write is uncommitted are not cached under the new version."""
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Activity.objects.create(user=self.user, **self.activity)
+            self.client.get(self.url)  # Still the cached, committed state
+        self.assertEqual(metrics_cache_stats.snapshot()['hits'], 1)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get(self.url).data['total_duration'], '01:00:00')
+
+    def test_sliding_window_rolls_over(self):
+        """Test that a cached weekly total expires once its activities leave the window."""
+        self.assertEqual(self.client.get(self.url).data['total_duration'], '00:30:00')
+        later = timezone.now() + timedelta(days=8)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertEqual(self.client.get(self.url).data['total_duration'], '00:00:00')
+
+    def test_cache_stats_are_staff_only(self):
+        """Test the hit/miss counters endpoint."""
+        url = reverse('activity-metrics-cache-stats')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.get(self.url)
+        self.assertEqual(self.client.get(url).data['misses'], 1)
+
+
+class ConditionalGetTests(APITestCase):
+
+    def setUp(self):
+        """Create a user with an activity and a notification."""
+        empty_cache(self)
+        self.user = User.objects.create_user(username='etaguser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.activity = {'activity_type': 'Running', 'duration': 30, 'distance': 5, 'calories_burned': 300}
+        Activity.objects.create(user=self.user, **self.activity)
+        Notification.objects.create(user=self.user, message='Keep going!')
+
+    def test_unchanged_list_returns_304(self):
+        """Test that a matching If-None-Match skips the query and serialization."""
+        # Lists only look up the change marker; cached metrics need no query at all
+        for url, queries in [(reverse('activity-list'), 1), (reverse('notification-list'), 1), (reverse('activity-metrics'), 0)]:
+            response = self.client.get(url)
+            self.assertIn('ETag', response)
+            self.assertIn('Last-Modified', response)
+            with self.assertNumQueries(queries):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_writes_change_the_etag(self):
+        """Test that creating or deleting an activity changes the list and metrics ETags."""
+        list_etag = self.client.get(reverse('activity-list'))['ETag']
+        metrics_etag = self.client.get(reverse('activity-metrics'))['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('activity-list'), self.activity)
+        self.assertNotEqual(self.client.get(reverse('activity-list'))['ETag'], list_etag)
+        self.assertNotEqual(self.client.get(reverse('activity-metrics'))['ETag'], metrics_etag)
+
+        list_etag = self.client.get(reverse('activity-list'))['ETag']
+        self.client.delete(reverse('activity-detail', args=[response.data['id']]))
+        response = self.client.get(reverse('activity-list'), HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_etag_depends_on_query(self):
+        """Test that different pages or filters of the same list get different ETags."""
+        first = self.client.get(reverse('activity-list'))['ETag']
+        filtered = self.client.get(reverse('activity-list'), {'activity_type': 'Cycling'})['ETag']
+        self.assertNotEqual(first, filtered)
+
+
+class NotificationCounterTests(APITestCase):
+
+    def setUp(self):
+        """Create a user with three unread notifications and one read notification."""
+        self.user = User.objects.create_user(username='unreaduser', email='unread@example.com', password='testpassword')
+        self.other = User.objects.create_user(username='otherunread', email='otherunread@example.com', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.notifications = [Notification.objects.create(user=self.user, message=f'Note {i}') for i in range(3)]
+        Notification.objects.create(user=self.user, message='Seen', is_read=True)
+        self.foreign = Notification.objects.create(user=self.other, message='Not yours')
+
+    def unread(self):
+        return NotificationCounter.objects.get(user=self.user).unread
+
+    def test_counter_follows_single_writes(self):
+        """Test that creating, reading, unreading and deleting notifications keep the counter exact."""
+        self.assertEqual(self.unread(), 3)
+        url = reverse('notification-detail', args=[self.notifications[0].pk])
+        self.client.patch(url, {'is_read': True})
+        self.assertEqual(self.unread(), 2)
+        self.client.patch(url, {'message': 'Edited'})
+        self.assertEqual(self.unread(), 2)
+        self.client.patch(url, {'is_read': False})
+        self.assertEqual(self.unread(), 3)
+        self.client.delete(url)
+        self.assertEqual(self.unread(), 2)
+
+    def test_unread_count_endpoint(self):
+        """Test that the unread count is a single lookup and is initialised for users without a counter."""
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('notification-unread-count'))
+        self.assertEqual(response.data, {'unread': 3})
+
+        NotificationCounter.objects.filter(user=self.user).delete()
+        response = self.client.get(reverse('notification-unread-count'))
+        self.assertEqual(response.data, {'unread': 3})
+        self.assertEqual(self.unread(), 3)
+
+    def test_mark_read_by_ids(self):
+        """Test that only the listed, owned, unread notifications are marked as read."""
+        ids = [self.notifications[0].pk, self.notifications[1].pk, self.foreign.pk]
+        response = self.client.post(reverse('notification-mark-read'), {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'marked_read': 2, 'unread': 1})
+        self.assertFalse(Notification.objects.get(pk=self.foreign.pk).is_read)
+        self.assertEqual(self.unread(), Notification.objects.filter(user=self.user, is_read=False).count())
+
+    def test_mark_all_read_changes_the_etag(self):
+        """Test that marking everything as read is one UPDATE and invalidates cached lists."""
+        etag = self.client.get(reverse('notification-list'))['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('notification-mark-read'), {}, format='json')
+        self.assertEqual(response.data, {'marked_read': 3, 'unread': 0})
+        self.assertEqual(sum(query['sql'].startswith('UPDATE "activities_notification"') for query in queries), 1)
+        response = self.client.get(reverse('notification-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_mark_read_rejects_invalid_ids(self):
+        response = self.client.post(reverse('notification-mark-read'), {'ids': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(NOTIFICATION_STREAM_HEARTBEAT=0.05, NOTIFICATION_STREAM_MAX_SECONDS=0.5)
+class NotificationStreamTests(APITestCase):
+
+    def setUp(self):
+        """Create a user with one notification and a bearer token for the async views."""
+        self.user = User.objects.create_user(username='streamuser', email='stream@example.com', password='testpassword')
+        self.first = Notification.objects.create(user=self.user, message='Existing')
+        self.headers = {'Authorization': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    def create_notification(self, message):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notification.objects.create(user=self.user, message=message)
+
+    async def next_event(self, chunks):
+        """Reads chunks until the next notification event, skipping keep-alive comments."""
+        while True:
+            chunk = await anext(chunks)
+            chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+            if 'event: notification' in chunk:
+                return chunk
+
+    async def test_stream_pushes_new_notifications(self):
+        """Test that a notification created while connected is pushed to the stream."""
+        response = await self.async_client.get(reverse('notification-stream'), headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        await anext(chunks)  # The retry hint, sent once the stream is subscribed
+
+        notification = await sync_to_async(self.create_notification)('Pushed')
+        event = await self.next_event(chunks)
+        self.assertIn(f'id: {notification.pk}\n', event)
+        self.assertEqual(json.loads(event.split('data: ', 1)[1])['message'], 'Pushed')
+        async for chunk in chunks:
+            pass  # The stream ends on its own after NOTIFICATION_STREAM_MAX_SECONDS
+        self.assertEqual(get_broker().subscriber_count(stream_key(self.user.pk)), 0)
+
+    async def test_stream_replays_after_last_event_id(self):
+        """Test that reconnecting clients receive the notifications they missed."""
+        missed = await sync_to_async(self.create_notification)('Missed')
+        headers = {**self.headers, 'Last-Event-ID': str(self.first.pk)}
+        response = await self.async_client.get(reverse('notification-stream'), headers=headers)
+        chunks = aiter(response.streaming_content)
+        self.assertIn(f'id: {missed.pk}\n', await self.next_event(chunks))
+        await chunks.aclose()
+
+    async def test_stream_requires_authentication(self):
+        response = await self.async_client.get(reverse('notification-stream'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn('WWW-Authenticate', response)
+
+    def test_poll_returns_newer_notifications(self):
+        """Test that long-polling returns newer notifications at once and nothing after the timeout."""
+        second = Notification.objects.create(user=self.user, message='Second')
+        url = reverse('notification-poll')
+        response = self.client.get(url, {'after': self.first.pk}, headers=self.headers)
+        self.assertEqual([item['id'] for item in response.json()['results']], [second.pk])
+
+        response = self.client.get(url, {'after': second.pk, 'timeout': 0}, headers=self.headers)
+        self.assertEqual(response.json(), {'results': [], 'last_id': second.pk})
+        response = self.client.get(url, {'after': 'latest'}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_slow_subscriber_overflows_instead_of_growing(self):
+        """Test that a full subscription queue drops its backlog and flags the overflow."""
+        broker = InMemoryBroker()
+        subscription = broker.subscribe('key', maxsize=2)
+        for i in range(3):
+            broker.publish('key', {'id': i})
+        await asyncio.sleep(0)
+        self.assertTrue(subscription.overflowed)
+        self.assertTrue(subscription.queue.empty())
+        broker.unsubscribe(subscription)
+        self.assertEqual(broker.subscriber_count(), 0)
+
+
+class AsyncViewTests(APITestCase):
+
+    def setUp(self):
+        """Create a user with a dozen dated activities, two notifications and a bearer token for the async views."""
+        empty_cache(self)
+        self.user = User.objects.create_user(username='asyncuser', password='testpassword')
+        now = timezone.now()
+        for i in range(12):
+            activity = Activity.objects.create(
+                user=self.user, activity_type='Running' if i % 3 else 'Cycling',
+                duration=20 + i, distance=2 + i, calories_burned=100 + i,
+            )
+            Activity.objects.filter(pk=activity.pk).update(date=now - timedelta(hours=i * 5))
+        Notification.objects.create(user=self.user, message='First')
+        Notification.objects.create(user=self.user, message='Second')
+        self.headers = {'Authorization': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    def assertSameResponse(self, sync_name, async_name, params=None):
+        sync = self.client.get(reverse(sync_name), params, headers=self.headers)
+        response = self.client.get(reverse(async_name), params, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), json.loads(json.dumps(sync.data).replace(reverse(sync_name), reverse(async_name))))
+        return response
+
+    def test_lists_match_the_sync_views(self):
+        """Test that the async lists return the pages (numbered and keyset), filters and links of the sync ones."""
+        response = self.assertSameResponse('activity-list', 'async-activity-list', {'ordering': '-date'})
+        self.assertEqual(response.json()['count'], 12)
+        self.assertIsNotNone(response.json()['next'])
+        self.assertSameResponse('activity-list', 'async-activity-list', {'ordering': 'date', 'page': 2})
+        self.assertSameResponse('activity-list', 'async-activity-list', {'activity_type': 'Cycling', 'ordering': '-date'})
+        response = self.assertSameResponse('activity-list', 'async-activity-list', {'cursor': '', 'page_size': 5})
+        cursor = parse_qs(urlsplit(response.json()['next']).query)['cursor'][0]
+        self.assertSameResponse('activity-list', 'async-activity-list', {'cursor': cursor, 'page_size': 5})
+        self.assertSameResponse('notification-list', 'async-notification-list')
+        self.assertSameResponse('activity-metrics', 'async-activity-metrics', {'period': 'weekly'})
+
+    def test_metrics_are_computed_on_a_cache_miss(self):
+        """Test that the async metrics sum the rollups and raw activities like the sync view."""
+        response = self.client.get(reverse('async-activity-metrics'), {'period': 'monthly'}, headers=self.headers)
+        totals = Activity.objects.aggregate(distance=Sum('distance'), calories=Sum('calories_burned'))
+        self.assertEqual(response.json()['total_distance'], totals['distance'])
+        self.assertEqual(response.json()['total_calories'], totals['calories'])
+        cache.clear()
+        self.assertSameResponse('activity-metrics', 'async-activity-metrics', {'period': 'monthly'})
+
+    def test_errors(self):
+        """Test authentication, invalid pages, filters and periods, and conditional requests."""
+        url = reverse('async-activity-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn('WWW-Authenticate', response)
+        self.assertEqual(self.client.get(url, {'page': 3}, headers=self.headers).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(url, {'activity_type': 'Rowing'}, headers=self.headers).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('async-activity-metrics'), {'period': 'daily'}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        etag = self.client.get(url, headers=self.headers)['ETag']
+        response = self.client.get(url, headers={**self.headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(THROTTLE_RATES={'read': '1/min'})
+    def test_requests_are_throttled(self):
+        url = reverse('async-notification-list')
+        self.assertEqual(self.client.get(url, headers=self.headers).status_code, status.HTTP_200_OK)
+        response = self.client.get(url, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+
+    @override_settings(REQUEST_INSTRUMENTATION=True)
+    async def test_served_over_asgi(self):
+        """Test the async views through the ASGI handler, whose middleware records their async ORM queries."""
+        request_stats.reset()
+        # The async ORM's connection was opened before instrumentation was enabled
+        await sync_to_async(install_query_recorder)(connection)
+        response = await self.async_client.get(reverse('async-activity-list'), headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 10)
+        stats = request_stats.snapshot()['activity_list']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreater(stats['db_queries']['sum'], 2)
+
+
+@override_settings(WEEKLY_DISTANCE_GOAL=20, ACTIVITY_MILESTONES=(3, 10))
+class NotificationRuleJobTests(APITestCase):
+
+    def setUp(self):
+        """Create a user with an earlier 5 km run from last month."""
+        self.user = User.objects.create_user(username='rulesuser', email='rules@example.com', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.activity = {'activity_type': 'Running', 'duration': 30, 'distance': 5, 'calories_burned': 300}
+        old = Activity.objects.create(user=self.user, **self.activity)
+        Activity.objects.filter(pk=old.pk).update(date=timezone.now() - timedelta(days=40))
+        Job.objects.all().delete()
+
+    def notifications(self):
+        return dict(Notification.objects.filter(user=self.user).values_list('notification_type', 'message'))
+
+    def test_writes_queue_jobs_instead_of_notifying(self):
+        """Test that creating activities only queues jobs: one per activity, or one per user for bulk writes."""
+        self.client.post(reverse('activity-list'), self.activity)
+        self.client.post(reverse('activity-bulk-create'), [self.activity] * 3, format='json')
+        jobs = Job.objects.filter(kind='activity_created').order_by('pk')
+        self.assertEqual([len(job.payload['activity_ids']) for job in jobs], [1, 3])
+        self.assertFalse(Notification.objects.exists())
+
+    def test_rules_run_in_one_batch(self):
+        """Test that a batch of jobs produces the goal, personal best and milestone notifications once."""
+        self.client.post(reverse('activity-list'), {**self.activity, 'distance': 12})
+        self.client.post(reverse('activity-list'), {**self.activity, 'distance': 9})
+        self.assertEqual(run_jobs(), 4)  # A rules job and a leaderboard update per activity
+
+        self.assertEqual(set(self.notifications()), {'personal_best', 'goal', 'milestone'})
+        self.assertIn('12 km', self.notifications()['personal_best'])
+        self.assertIn('3 activities', self.notifications()['milestone'])
+        self.assertEqual(NotificationCounter.objects.get(user=self.user).unread, 3)
+        self.assertFalse(Job.objects.exists())
+
+        # The goal is only reported when it is crossed
+        self.client.post(reverse('activity-list'), {**self.activity, 'distance': 1})
+        run_jobs()
+        self.assertEqual(Notification.objects.filter(user=self.user).count(), 3)
+
+    def test_late_jobs_report_a_crossing_once(self):
+        """Test that jobs run one by one after later activities were saved still notify each crossing once."""
+        self.client.post(reverse('activity-list'), {**self.activity, 'distance': 12})
+        self.client.post(reverse('activity-list'), {**self.activity, 'distance': 9})
+        for job in Job.objects.filter(kind='activity_created').order_by('pk'):
+            evaluate_activity_rules([job.payload])
+        types = Notification.objects.filter(user=self.user).values_list('notification_type', flat=True)
+        self.assertEqual(sorted(types), ['goal', 'milestone', 'personal_best'])
+
+    def test_failed_batch_is_retried_job_by_job(self):
+        """Test that a bad job is retried with a backoff without holding back the rest of its batch."""
+        def handler(payloads):
+            if any(payload.get('bad') for payload in payloads):
+                raise ValueError('bad payload')
+            Notification.objects.bulk_create(Notification(user=self.user, message='ok') for _ in payloads)
+
+        with mock.patch.dict(JOB_HANDLERS, {'test': handler}):
+            Job.objects.bulk_create([Job(kind='test', payload={}), Job(kind='test', payload={'bad': True})])
+            with self.assertLogs('activities.jobs', level='WARNING'):
+                self.assertEqual(run_jobs(), 2)
+
+        self.assertEqual(Notification.objects.filter(user=self.user).count(), 1)
+        failed = Job.objects.get()
+        self.assertEqual((failed.status, failed.attempts), (Job.PENDING, 1))
+        self.assertIn('bad payload', failed.last_error)
+        self.assertGreater(failed.run_after, timezone.now())
+
+    def test_claimed_jobs_are_not_claimed_twice(self):
+        Job.objects.create(kind='test')
+        self.assertEqual(len(claim(10)), 1)
+        self.assertEqual(claim(10), [])
+        Job.objects.update(locked_at=timezone.now() - timedelta(hours=1))  # The worker died
+        self.assertEqual(len(claim(10)), 1)
+
+
+class DatabaseConfigurationTests(APITestCase):
+
+    def test_sqlite_connections_are_tuned(self):
+        """Test that new SQLite connections get the configured pragmas and immediate transactions."""
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1 if settings.SQLITE_WAL else 2)  # NORMAL with WAL, else FULL
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    def test_wal_is_opt_in(self):
+        """Test that only SQLITE_WAL switches connections to WAL, so the database file is left as it is by default."""
+        self.assertEqual('journal_mode' in settings.SQLITE_PRAGMAS, settings.SQLITE_WAL)
+
+    def test_tuned_writers_do_not_fail(self):
+        """Test that concurrent read-then-write transactions all commit with the tuned settings."""
+        results = compare_sqlite_writers(threads=4, writes=20, readers=1)
+        self.assertEqual(results['tuned']['failed'], 0)
+        self.assertEqual(results['tuned']['committed'], 80)
+
+
+@skipUnless('replica' in settings.DATABASES, "needs the 'replica' database of fitness_tracker_api.test_settings")
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(APITestCase):
+    # 'replica' is a separate, empty database: rows only found on the primary show where a read went.
+    # Only the test settings define it; without them the tests are skipped.
+    databases = {'default', 'replica'}.intersection(settings.DATABASES)
+
+    def setUp(self):
+        empty_cache(self)  # Pins are kept in the cache
+        self.user = User.objects.create_user(username='replicauser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('activity-list')
+        Activity.objects.create(
+            user=self.user, activity_type='Running', duration=30, distance=5.0, calories_burned=300,
+            date=timezone.now(),
+        )
+
+    def create_activity(self):
+        return self.client.post(self.url, {
+            'activity_type': 'Cycling', 'duration': 60, 'distance': 20.0, 'calories_burned': 500,
+            'date': timezone.now().isoformat(),
+        })
+
+    def test_safe_reads_use_the_replica(self):
+        """Test that reads in requests go to the replica while reads outside requests stay on the primary."""
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(Activity.objects.count(), 1)
+
+    def test_writer_reads_own_writes(self):
+        """Test that after a write the client's reads are pinned to the primary by a cookie."""
+        response = self.create_activity()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_user_is_pinned_without_cookie(self):
+        """Test that the user stays pinned from another client, until the pin expires."""
+        self.create_activity()
+        self.client.cookies.clear()
+        self.assertEqual(len(self.client.get(self.url).data['results']), 2)
+        cache.clear()
+        self.assertEqual(self.client.get(self.url).data['results'], [])
+
+    def test_expired_cookie_is_ignored(self):
+        """Test that a cookie whose pin has expired no longer pins the client."""
+        self.client.cookies[settings.REPLICA_PIN_COOKIE] = '1'
+        self.assertEqual(self.client.get(self.url).data['results'], [])
+
+    def test_lazy_session_user_is_not_evaluated(self):
+        """Test that the routing only reads the session user once something else has loaded it."""
+        request = RequestFactory().get(self.url)
+        request.user = SimpleLazyObject(lambda: self.user)
+        self.assertIsNone(request_user_id(request))
+        self.assertTrue(request.user.is_authenticated)
+        self.assertEqual(request_user_id(request), self.user.pk)
+
+    def test_lazily_built_rows_are_read_from_the_primary(self):
+        """Test that rows built on first read are computed on and read back from the primary."""
+        UserStats.objects.all().delete()
+        response = self.client.get(reverse('activity-stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['activity_count'], 1)
+
+
+@override_settings(REQUEST_INSTRUMENTATION=True)
+class RequestInstrumentationTests(APITestCase):
+
+    def setUp(self):
+        """Create a staff user and start from empty histograms."""
+        request_stats.reset()
+        self.user = User.objects.create_user(username='opsuser', password='testpassword', is_staff=True)
+        self.client.force_authenticate(user=self.user)
+        Activity.objects.create(user=self.user, activity_type='Running', duration=30, distance=5, calories_burned=300)
+
+    def test_requests_are_recorded_per_view(self):
+        """Test that the view, query count and serializer time of a request are recorded."""
+        self.client.get(reverse('activity-list'))
+        stats = self.client.get(reverse('request-metrics')).data['ActivityViewSet.list']
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['db_queries']['sum'], 3)
+        self.assertGreater(stats['serializer_seconds']['sum'], 0)
+        self.assertGreater(stats['response_bytes']['sum'], 0)
+
+    def test_prometheus_format(self):
+        """Test the Prometheus text exposition of the histograms."""
+        self.client.get(reverse('activity-metrics'))
+        response = self.client.get(reverse('request-metrics'), {'format': 'prometheus'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('fitness_request_wall_seconds_count{view="ActivityMetricsView.get"} 1', response.content.decode())
+
+    @override_settings(REQUEST_QUERY_BUDGET=1)
+    def test_query_budget_is_flagged(self):
+        """Test that requests exceeding the query budget are flagged."""
+        with self.assertLogs('activities.middleware', 'WARNING'):
+            response = self.client.get(reverse('activity-list'))
+        self.assertEqual(response['X-Query-Budget-Exceeded'], '3/1')
+        self.assertEqual(request_stats.snapshot()['ActivityViewSet.list']['over_query_budget'], 1)
+
+    def test_metrics_endpoint_is_staff_only(self):
+        """Test that regular users cannot read the request metrics."""
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('request-metrics')).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class SeedDataTests(APITestCase):
+
+    def test_seed_data_command(self):
+        """Test that seeded users get activities spread over the past, notifications and rollups."""
+        call_command('seed_data', users=2, activities=30, notifications=5, days=90, seed=1, stdout=StringIO())
+        users = User.objects.filter(username__startswith='seed-')
+        self.assertEqual(users.count(), 2)
+        self.assertEqual(Activity.objects.filter(user__in=users).count(), 60)
+        self.assertEqual(Notification.objects.filter(user__in=users).count(), 10)
+
+        dates = Activity.objects.aggregate(first=Min('date'), last=Max('date'))
+        self.assertGreater(dates['last'] - dates['first'], timedelta(days=7))
+        self.assertLessEqual(dates['last'], timezone.now())
+        self.assertEqual(ActivityRollup.objects.aggregate(total=Sum('activity_count'))['total'], 60)
+
+    def test_benchmark_summary(self):
+        """Test the latency percentiles and throughput reported by the benchmarks."""
+        summary = summarize([0.001 * i for i in range(1, 101)], [2] * 100)
+        self.assertEqual(summary['p50_ms'], 50)
+        self.assertEqual(summary['p99_ms'], 99)
+        self.assertEqual(summary['queries_per_request'], 2)
+
+
+class CachedJWTAuthenticationTests(APITestCase):
+
+    def setUp(self):
+        """Create a user and authenticate with a real token."""
+        empty_cache(self)
+        self.user = User.objects.create_user(username='authuser', password='testpassword')
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'authuser', 'password': 'testpassword'})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+        self.url = reverse('activity-metrics')
+
+    def test_user_lookup_is_cached(self):
+        """Test that only the first request loads the user from the database."""
+        self.client.get(self.url)
+        with self.assertNumQueries(0):  # Cached user and cached metrics
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_deactivated_user_is_rejected(self):
+        """Test that saving the user evicts it, so deactivation applies to the next request."""
+        self.client.get(self.url)
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_user_is_rejected(self):
+        """Test that deleting the user evicts it from the cache."""
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_user_is_evicted_once_the_save_commits(self):
+        """Test that a user saved in a transaction stays cached until it commits, and is evicted then."""
+        self.client.get(self.url)
+        key = user_cache_key(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.user.is_active = False
+                self.user.save()
+                self.assertIsNotNone(user_cache().get(key))
+        self.assertIsNone(user_cache().get(key))
+
+
+@override_settings(THROTTLE_RATES={'read': '3/min', 'write': '2/min', 'login': '2/min', 'export': '1/hour'})
+class ThrottlingTests(APITestCase):
+
+    def setUp(self):
+        empty_cache(self)
+        self.user = User.objects.create_user(username='busyuser', email='busy@example.com', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('activity-list')
+
+    def test_token_bucket(self):
+        """Test that a bucket allows bursts up to its capacity and refills at its rate."""
+        bucket = TokenBucket(cache, 'test-bucket', capacity=2, rate=1)
+        self.assertEqual([bucket.take(now=100), bucket.take(now=100)], [0, 0])
+        self.assertEqual(bucket.take(now=100), 1.0)
+        self.assertEqual(bucket.take(now=100.5), 0.5)  # Rejected requests take no token
+        self.assertEqual(bucket.take(now=101), 0)
+        self.assertEqual([bucket.take(now=1000) for _ in range(3)], [0, 0, 1.0])  # Full again, never fuller
+
+    def test_reads_are_limited_with_retry_after(self):
+        """Test that reads beyond the bucket get 429 with Retry-After, without affecting writes or other users."""
+        for _ in range(3):
+            self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '20')
+
+        activity = {'activity_type': 'Running', 'duration': 30, 'distance': 5, 'calories_burned': 300}
+        self.assertEqual(self.client.post(self.url, activity).status_code, status.HTTP_201_CREATED)
+        other = User.objects.create_user(username='calmuser', email='calm@example.com', password='testpassword')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+
+    def test_exports_have_their_own_scope(self):
+        """Test that exports are limited by the export scope, not the read scope."""
+        url = reverse('activity-export')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+
+    def test_logins_are_limited_per_client(self):
+        """Test that login attempts from one client IP are limited, whatever the username."""
+        self.client.force_authenticate(user=None)
+        url = reverse('token_obtain_pair')
+        self.client.post(url, {'username': 'busyuser', 'password': 'wrong'})
+        self.client.post(url, {'username': 'someone', 'password': 'wrong'})
+        response = self.client.post(url, {'username': 'busyuser', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
@@ -0,0 +1,98 @@
+import time
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """Parses a 'tokens/period' rate such as '120/min' into (capacity, tokens per second)."""
+    tokens, period = rate.split('/')
+    tokens = int(tokens)
+    return tokens, tokens / PERIODS[period[0]]
+
+
+def throttle_cache():
+    return caches[settings.THROTTLE_CACHE_ALIAS]
+
+
+class TokenBucket:
+    """
+    A token bucket of `capacity` tokens refilled at `rate` tokens per second, kept
+    in a cache so every process sharing the cache shares the bucket. It is stored
+    as a single integer, the theoretical arrival time of the next request in
+    microseconds (GCRA): each token taken moves it one refill interval forward, and
+    a request is allowed while it stays within `capacity` intervals of now.
+
+    Taking a token is one atomic incr, so concurrent requests never lose an update.
+    Only restarting the schedule of a bucket that refilled completely is a plain
+    set, which concurrent requests may each win, each losing at most one token.
+    """
+
+    def __init__(self, cache, key, capacity, rate):
+        self.cache = cache
+        self.key = key
+        self.interval = max(1, round(1_000_000 / rate))
+        self.burst = capacity * self.interval
+
+    def take(self, now=None):
+        """Takes a token. Returns 0 if one was available, else the seconds until one is."""
+        now = int((time.time() if now is None else now) * 1_000_000)
+        timeout = settings.THROTTLE_STATE_TIMEOUT
+        try:
+            due = self.cache.incr(self.key, self.interval)
+        except ValueError:
+            # New (or expired) bucket, which is full
+            if self.cache.add(self.key, now + self.interval, timeout):
+                return 0
+            due = self.cache.incr(self.key, self.interval)
+        if due - self.interval < now:
+            # The bucket refilled completely since the last token: restart its schedule from now
+            due = now + self.interval
+            self.cache.set(self.key, due, timeout)
+        if due - now <= self.burst:
+            return 0
+        self.cache.decr(self.key, self.interval)  # Rejected requests take no token
+        return (due - now - self.burst) / 1_000_000
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Rate limits each user (or client IP, when anonymous) with a token bucket per
+    scope: the view's `throttle_scope` when it has one ('login', 'export'), else
+    'read' for safe methods and 'write' for the others. Rates come from
+    THROTTLE_RATES; scopes without a rate are not limited. Rejected requests get
+    a 429 with a Retry-After header.
+    """
+
+    def __init__(self):
+        self.wait_seconds = None
+
+    def get_scope(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if scope:
+            return scope
+        return 'read' if request.method in SAFE_METHODS else 'write'
+
+    def get_cache_key(self, request, scope):
+        user = request.user
+        if user is not None and user.is_authenticated:
+            return f'throttle:{scope}:user:{user.pk}'
+        return f'throttle:{scope}:ip:{self.get_ident(request)}'
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(request, view)
+        rate = settings.THROTTLE_RATES.get(scope)
+        if rate is None:
+            return True
+        capacity, refill = parse_rate(rate)
+        bucket = TokenBucket(throttle_cache(), self.get_cache_key(request, scope), capacity, refill)
+        self.wait_seconds = bucket.take()
+        return self.wait_seconds == 0
+
+    def wait(self):
+        return self.wait_seconds
@@ -0,0 +1,439 @@
+import math
+import re
+import struct
+import sys
+from array import array
+from itertools import repeat
+from operator import add, mul, sub
+from datetime import datetime, timedelta, timezone as dt_timezone
+from xml.etree.ElementTree import ParseError, fromstring
+from django.conf import settings
+
+try:
+    import numpy
+except ImportError:  # Distances are then computed with the stdlib, still column by column
+    numpy = None
+
+EARTH_RADIUS_KM = 6371.0088
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# Columns of a packed track, in storage order: (name, array typecode, value of a missing reading)
+TRACK_COLUMNS = (
+    ('lat', 'd', None),
+    ('lon', 'd', None),
+    ('elevation', 'f', math.nan),  # meters
+    ('time', 'd', math.nan),  # Unix timestamp
+    ('heart_rate', 'H', 0),  # bpm
+)
+TRACK_FORMAT_VERSION = 1
+TRACK_HEADER = struct.Struct('<BI')  # format version, point count
+
+
+# Sport names used by devices and apps (TCX Sport, GPX track type), lower-cased: activity type
+SPORTS = {
+    'running': 'Running', 'run': 'Running', 'trail running': 'Running',
+    'biking': 'Cycling', 'cycling': 'Cycling', 'ride': 'Cycling', 'road_biking': 'Cycling',
+    'swimming': 'Swimming', 'swim': 'Swimming', 'open_water_swimming': 'Swimming',
+    'walking': 'Walking', 'walk': 'Walking', 'hiking': 'Walking', 'hike': 'Walking',
+}
+
+
+class TrackError(ValueError):
+    """Raised for track files that cannot be read."""
+
+
+def empty_columns():
+    return {name: array(typecode) for name, typecode, _ in TRACK_COLUMNS}
+
+
+def pack_track(columns):
+    """
+    Packs equally long column arrays into one little-endian blob: a header followed
+    by each column's values back to back, 22 bytes per point.
+    """
+    count = len(columns['lat'])
+    parts = [TRACK_HEADER.pack(TRACK_FORMAT_VERSION, count)]
+    for name, typecode, _ in TRACK_COLUMNS:
+        values = columns[name]
+        if sys.byteorder == 'big':
+            values = array(typecode, values)
+            values.byteswap()
+        parts.append(values.tobytes())
+    return b''.join(parts)
+
+
+def unpack_track(blob):
+    """Unpacks a blob written by pack_track into a dict of column arrays."""
+    blob = memoryview(blob)
+    version, count = TRACK_HEADER.unpack_from(blob)
+    if version != TRACK_FORMAT_VERSION:
+        raise TrackError(f"Unknown track format version {version}.")
+    columns, offset = {}, TRACK_HEADER.size
+    for name, typecode, _ in TRACK_COLUMNS:
+        values = array(typecode)
+        end = offset + count * values.itemsize
+        values.frombytes(blob[offset:end])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        columns[name], offset = values, end
+    return columns
+
+
+def segment_distances_km(lat, lon):
+    """Great-circle distances in km between consecutive points of two coordinate sequences (degrees)."""
+    if len(lat) < 2:
+        return []
+    if numpy is not None:
+        lat = numpy.radians(numpy.asarray(lat, dtype=numpy.float64))
+        lon = numpy.radians(numpy.asarray(lon, dtype=numpy.float64))
+        a = (numpy.sin(numpy.diff(lat) / 2) ** 2
+             + numpy.cos(lat[:-1]) * numpy.cos(lat[1:]) * numpy.sin(numpy.diff(lon) / 2) ** 2)
+        return (2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))).tolist()
+
+    # The same formula over whole columns, with every step mapped in C
+    lat = list(map(math.radians, lat))
+    lon = list(map(math.radians, lon))
+    half_dlat = map(math.sin, map(mul, map(sub, lat[1:], lat), repeat(0.5)))
+    half_dlon = map(math.sin, map(mul, map(sub, lon[1:], lon), repeat(0.5)))
+    cos_lat = list(map(math.cos, lat))
+    a = map(add, map(pow, half_dlat, repeat(2)), map(mul, map(mul, cos_lat, cos_lat[1:]), map(pow, half_dlon, repeat(2))))
+    return list(map(mul, map(math.asin, map(math.sqrt, map(min, a, repeat(1.0)))), repeat(2 * EARTH_RADIUS_KM)))
+
+
+def haversine_km(lat, lon):
+    """Total great-circle distance in km along the points of two coordinate sequences (degrees)."""
+    return sum(segment_distances_km(lat, lon))
+
+
+def parse_time(text):
+    """Parses an ISO 8601 timestamp (UTC when it has no offset) into a Unix timestamp."""
+    moment = datetime.fromisoformat(text)
+    return (moment if moment.tzinfo else moment.replace(tzinfo=dt_timezone.utc)).timestamp()
+
+
+def float_column(values, typecode):
+    """Converts the texts of a column of readings (b'' when missing, read as NaN) into an array."""
+    if b'' in values:
+        return array(typecode, [float(value) if value else math.nan for value in values])
+    return array(typecode, map(float, values))
+
+
+def int_column(values, typecode):
+    """Converts the texts of a column of integer readings (b'' when missing, read as 0) into an array."""
+    if b'' in values:
+        return array(typecode, [int(value) if value else 0 for value in values])
+    return array(typecode, map(int, values))
+
+
+def time_column(values):
+    """Converts the ISO 8601 texts of a column of timestamps (b'' when missing, read as NaN) into Unix timestamps."""
+    if b'' not in values:
+        try:
+            # Naive times (read as UTC by parse_time) cannot be subtracted from the epoch
+            return array('d', map(
+                timedelta.total_seconds, map(sub, map(datetime.fromisoformat, map(bytes.decode, values)), repeat(EPOCH))
+            ))
+        except (TypeError, ValueError):
+            pass
+    return array('d', [parse_time(value.decode().strip()) if value.strip() else math.nan for value in values])
+
+
+def local_name(tag):
+    """An element's tag without its namespace, e.g. 'trkpt' for '{http://www.topografix.com/GPX/1/1}trkpt'."""
+    return tag.rpartition('}')[2]
+
+
+def child_text(element, *path):
+    """The stripped text of the descendant at `path` (local names, one per level), or None."""
+    for name in path:
+        element = next((child for child in element if local_name(child.tag) == name), None)
+        if element is None:
+            return None
+    return (element.text or '').strip() or None
+
+
+def gpx_point(point):
+    """The readings of a GPX trkpt: its lat/lon attributes, ele and time, and the hr of any extension."""
+    heart_rate = next((child.text for child in point.iter() if local_name(child.tag) == 'hr'), None)
+    return {
+        'lat': point.get('lat'),
+        'lon': point.get('lon'),
+        'elevation': child_text(point, 'ele'),
+        'time': child_text(point, 'time'),
+        'heart_rate': heart_rate.strip() if heart_rate else None,
+    }
+
+
+def tcx_point(point):
+    """The readings of a TCX Trackpoint (only its own heart rate, not the laps' averages)."""
+    return {
+        'lat': child_text(point, 'Position', 'LatitudeDegrees'),
+        'lon': child_text(point, 'Position', 'LongitudeDegrees'),
+        'elevation': child_text(point, 'AltitudeMeters'),
+        'time': child_text(point, 'Time'),
+        'heart_rate': child_text(point, 'HeartRateBpm', 'Value'),
+    }
+
+
+# The text of a simple element
+VALUE = rb'([^<]*)'
+# Text that may be wrapped in CDATA and contain spaces
+NAME = rb'\s*(?:<!\[CDATA\[)?([^<\]]*?)(?:\]\]>)?\s*'
+ATTRIBUTE = rb'\s*=\s*["\']([^"\']*)["\']'
+ROOT = re.compile(rb'<(?:([\w.-]+):)?(gpx|TrainingCenterDatabase)([\s/][^>]*)?>')
+XMLNS = re.compile(rb'\bxmlns(?::([\w.-]+))?' + ATTRIBUTE)
+# Namespaces of the Garmin extension holding GPX heart rates
+HEART_RATE_NAMESPACES = (
+    b'http://www.garmin.com/xmlschemas/TrackPointExtension/v1',
+    b'http://www.garmin.com/xmlschemas/TrackPointExtension/v2',
+)
+
+
+class TrackSyntax:
+    """
+    The patterns reading one document, spelled with the namespace prefixes of its root.
+
+    `points` matches a whole point laid out as devices and apps write them: its
+    readings in schema order, without CDATA, among other simple elements and the
+    usual extensions. A chunk in which every point matches is read in one pass;
+    any other chunk has its points parsed one by one with ElementTree.
+    """
+
+    def __init__(self, format, prefix, namespaces):
+        self.format = format
+        tag = (prefix + b':' if prefix else b'').__add__
+        self.declarations = b' '.join(
+            b'xmlns' + (b':' + name if name else b'') + b'="' + uri + b'"' for uri, name in namespaces.items()
+        )
+        p = re.escape(tag(b''))
+
+        def element(name, value=VALUE, prefix=p):
+            return b'<' + prefix + name + b'>' + value + b'</' + prefix + name + rb'>\s*'
+
+        if format == 'gpx':
+            extension = next((namespaces[uri] for uri in HEART_RATE_NAMESPACES if uri in namespaces), None)
+            # The extension may instead be declared on the points themselves
+            x = re.escape(extension + b':') if extension else rb'(?:[\w.-]+:)?'
+            self.points = re.compile(
+                b'<' + p + rb'trkpt\s+lat' + ATTRIBUTE + rb'\s+lon' + ATTRIBUTE + rb'\s*>\s*'
+                + b'(?:' + element(b'ele') + b')?(?:' + element(b'time') + b')?'
+                + b'(?:<' + p + rb'(?!(?:ele|time|extensions)>)(\w+)>[^<]*</' + p + rb'\5>\s*)*'
+                + b'(?:<' + p + rb'extensions>\s*<' + x + rb'TrackPointExtension\b[^>]*>\s*'
+                + b'(?:' + element(rb'(?:atemp|wtemp|depth)', rb'[^<]*', x) + b')*'
+                + b'(?:' + element(b'hr', VALUE, x) + b')?'
+                + b'(?:' + element(rb'(?:cad|speed|course|bearing)', rb'[^<]*', x) + b')*'
+                + b'</' + x + rb'TrackPointExtension>\s*</' + p + rb'extensions>\s*)?'
+                + b'</' + p + b'trkpt>'
+            )
+            self.point = tag(b'trkpt')
+            self.sport = re.compile(
+                b'<' + p + rb'trk\s*>(?:(?!<' + p + rb'trkseg)[\s\S])*?' + element(b'type', NAME)
+            )
+            self.calories = None
+            self.read_point = gpx_point
+        else:
+            self.points = re.compile(
+                b'<' + p + rb'Trackpoint>\s*(?:' + element(b'Time') + b')?'
+                + b'(?:<' + p + rb'Position>\s*' + element(b'LatitudeDegrees') + element(b'LongitudeDegrees')
+                + b'</' + p + rb'Position>\s*)?'
+                + b'(?:' + element(b'AltitudeMeters') + b')?(?:' + element(b'DistanceMeters', rb'[^<]*') + b')?'
+                + b'(?:<' + p + rb'HeartRateBpm\b[^>]*>\s*' + element(b'Value') + b'</' + p + rb'HeartRateBpm>\s*)?'
+                + b'(?:' + element(rb'(?:Cadence|SensorState)', rb'[^<]*') + b')*'
+                + b'(?:<' + p + rb'Extensions>[\s\S]*?</' + p + rb'Extensions>\s*)?'
+                + b'</' + p + b'Trackpoint>'
+            )
+            self.point = tag(b'Trackpoint')
+            self.sport = re.compile(b'<' + p + rb'Activity\s[^>]*?\bSport' + ATTRIBUTE)
+            self.calories = re.compile(
+                b'<' + p + rb'Lap\b[^>]*>(?:(?!<' + p + rb'Track\b)[\s\S])*?' + element(b'Calories', NAME)
+            )
+            self.read_point = tcx_point
+        point = re.escape(self.point)
+        self.point_start = re.compile(b'<' + point + rb'[\s/>]')
+        self.elements = re.compile(b'<' + point + rb'(?:\s[^>]*?)?(?:/>|>[\s\S]*?</' + point + rb'\s*>)')
+        root = re.escape(tag(b'gpx' if format == 'gpx' else b'TrainingCenterDatabase'))
+        self.end = re.compile(b'</' + root + rb'\s*>\s*(?:<!--[\s\S]*?-->\s*)*\Z')
+
+    def read_points(self, text, count):
+        """The columns of readings (texts, b'' when missing) of the `count` points in `text`."""
+        matches = self.points.findall(text)
+        if len(matches) != count:
+            # Some point is laid out differently
+            return self.parse_points(text)
+        if self.format == 'gpx':
+            lat, lon, elevation, time, _, heart_rate = zip(*matches)
+        else:
+            time, lat, lon, elevation, heart_rate = zip(*matches)
+        return {'lat': lat, 'lon': lon, 'elevation': elevation, 'time': time, 'heart_rate': heart_rate}
+
+    def parse_points(self, text):
+        """The columns of readings of the points in `text`, each parsed with ElementTree."""
+        readings = {name: [] for name, _, _ in TRACK_COLUMNS}
+        for element in self.elements.findall(text):
+            try:
+                point = fromstring(b'<points ' + self.declarations + b'>' + element + b'</points>')[0]
+            except ParseError as exc:
+                raise TrackError(f"Invalid XML: {exc}")
+            for name, value in self.read_point(point).items():
+                readings[name].append(value.encode() if value else b'')
+        return readings
+
+
+class TrackReader:
+    """
+    Incremental reader of GPX and TCX files, reading only their trackpoints. Chunks
+    of the upload are buffered until they hold complete points, which are then read
+    with one regular expression match each (see TrackSyntax) and converted column by
+    column straight into arrays. Building an element tree costs several times more
+    than that for the hundreds of thousands of points of a long recording, so
+    ElementTree only parses points laid out differently. Memory grows with the
+    packed points only, never with the file.
+    """
+
+    def __init__(self, max_points=None):
+        self.max_points = max_points or settings.TRACK_MAX_POINTS
+        self.columns = empty_columns()
+        self.format = None
+        self.syntax = None
+        self.sport = None
+        self.calories = 0
+        self.buffer = b''
+        self.seen_point = False
+
+    def feed(self, data, final=False):
+        self.buffer += data
+        if self.syntax is None:
+            root = ROOT.search(self.buffer)
+            if root is None:
+                if final or len(self.buffer) > settings.TRACK_READ_CHUNK_SIZE * 4:
+                    raise TrackError("Expected a GPX or TCX document.")
+                return
+            self.format = 'gpx' if root[2] == b'gpx' else 'tcx'
+            namespaces = {uri: prefix or b'' for prefix, uri in XMLNS.findall(root[3] or b'')}
+            self.syntax = TrackSyntax(self.format, root[1] or b'', namespaces)
+        if not self.seen_point:
+            # Metadata ahead of the first point (the sport) is read with it
+            self.seen_point = self.syntax.point_start.search(self.buffer) is not None
+            if not self.seen_point and not final:
+                return
+
+        if final:
+            if not self.syntax.end.search(self.buffer):
+                raise TrackError("Invalid XML: the document ends before its root element.")
+            end = len(self.buffer)
+        else:
+            end = self.last_point_start()  # The last point may continue in the next chunk
+            if end <= 0:
+                return
+        self.read_points(self.buffer[:end])
+        self.buffer = self.buffer[end:]
+
+    def last_point_start(self):
+        end = len(self.buffer)
+        while (end := self.buffer.rfind(b'<' + self.syntax.point, 0, end)) != -1:
+            if self.syntax.point_start.match(self.buffer, end):
+                break
+        return end
+
+    def read_points(self, text):
+        """Reads the points in `text`, and the metadata around them."""
+        syntax = self.syntax
+        first = syntax.point_start.search(text)
+        if self.sport is None:
+            # Named once per track, ahead of its points
+            sport = syntax.sport.search(text, 0, first.start() if first else len(text))
+            self.sport = sport[1].decode().strip() if sport else ''
+        if syntax.calories is not None:
+            self.calories += sum(int(value) for value in syntax.calories.findall(text) if value.isdigit())
+        if first is None:
+            return
+
+        count = text.count(b'<' + syntax.point)
+        if len(self.columns['lat']) + count > self.max_points:
+            raise TrackError(f"Tracks cannot have more than {self.max_points} points.")
+        readings = syntax.read_points(text, count)
+        try:
+            points = {
+                'lat': float_column(readings['lat'], 'd'),
+                'lon': float_column(readings['lon'], 'd'),
+                'elevation': float_column(readings['elevation'], 'f'),
+                'time': time_column(readings['time']),
+                'heart_rate': int_column(readings['heart_rate'], 'H'),
+            }
+        except (ValueError, OverflowError) as exc:
+            raise TrackError(f"Invalid trackpoint value: {exc}")
+
+        if b'' in readings['lat'] or b'' in readings['lon']:
+            # Points without a position (e.g. TCX points recorded while paused) carry no route
+            placed = [i for i, (lat, lon) in enumerate(zip(readings['lat'], readings['lon'])) if lat and lon]
+            points = {name: array(values.typecode, map(values.__getitem__, placed)) for name, values in points.items()}
+        for name, values in points.items():
+            self.columns[name].extend(values)
+
+    def read(self, stream, chunk_size=None):
+        """Reads the whole stream in chunks and returns a ParsedTrack."""
+        chunk_size = chunk_size or settings.TRACK_READ_CHUNK_SIZE
+        while chunk := stream.read(chunk_size):
+            self.feed(chunk)
+        self.feed(b'', final=True)
+        return ParsedTrack(self.columns, self.format, self.sport or None, self.calories)
+
+
+class ParsedTrack:
+    """The trackpoints of an uploaded file and the activity values derived from them."""
+
+    def __init__(self, columns, format, sport=None, calories=0):
+        self.columns = columns
+        self.format = format
+        self.sport = sport
+        self.calories = calories
+
+    @property
+    def point_count(self):
+        return len(self.columns['lat'])
+
+    @property
+    def activity_type(self):
+        """The activity type named by the file, if it is one of ours."""
+        return SPORTS.get((self.sport or '').strip().lower())
+
+    @property
+    def distance(self):
+        """Route length in km."""
+        return haversine_km(self.columns['lat'], self.columns['lon'])
+
+    @property
+    def started_at(self):
+        """Time of the first timestamped point, or None."""
+        start = next((value for value in self.columns['time'] if not math.isnan(value)), None)
+        return datetime.fromtimestamp(start, dt_timezone.utc) if start is not None else None
+
+    @property
+    def elapsed_seconds(self):
+        """Seconds between the earliest and latest timestamped points."""
+        times = [value for value in self.columns['time'] if not math.isnan(value)]
+        return max(times) - min(times) if times else 0
+
+    @property
+    def duration(self):
+        """Duration in whole minutes, at least one for any timed track."""
+        seconds = self.elapsed_seconds
+        return max(1, round(seconds / 60)) if seconds > 0 else 0
+
+
+def read_track(stream):
+    """Parses a GPX or TCX document from a file-like object, raising TrackError for invalid files."""
+    return TrackReader().read(stream)
+
+
+def track_points(columns):
+    """Column arrays as JSON-ready lists, with missing readings as None."""
+    points = {}
+    for name, _, missing in TRACK_COLUMNS:
+        if missing is None:
+            points[name] = columns[name].tolist()
+        elif name == 'heart_rate':
+            points[name] = [value or None for value in columns[name]]
+        else:
+            points[name] = [None if math.isnan(value) else value for value in columns[name]]
+    return points
@@ -1,7 +1,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import HomeView, UserViewSet, ActivityViewSet, NotificationViewSet, ActivityMetricsView, ApiRootViewAuthenticated, ApiRootViewAllowAny
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from .views import HomeView, UserViewSet, ActivityViewSet, NotificationViewSet, ActivityMetricsView, ActivityTimeSeriesView, ActivityStatsView, LeaderboardView, ActivityMetricsCacheStatsView, RequestMetricsView, ApiRootViewAuthenticated, ApiRootViewAllowAny, LoginView
+from .streams import notification_poll, notification_stream
+from .async_views import activity_list, activity_metrics, notification_list
+from rest_framework_simplejwt.views import TokenRefreshView
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet, basename='user')
@@ -14,7 +16,19 @@ urlpatterns = [
     path('api/', ApiRootViewAllowAny.as_view(), name='api_root_open'),
     path('home/', HomeView.as_view(), name='home'),
     path('activity-metrics/', ActivityMetricsView.as_view(), name='activity-metrics'), 
-    path('login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('activity-metrics/series/', ActivityTimeSeriesView.as_view(), name='activity-metrics-series'),
+    path('activity-metrics/stats/', ActivityStatsView.as_view(), name='activity-stats'),
+    path('activity-metrics/cache-stats/', ActivityMetricsCacheStatsView.as_view(), name='activity-metrics-cache-stats'),
+    path('leaderboard/', LeaderboardView.as_view(), name='leaderboard'),
+    path('request-metrics/', RequestMetricsView.as_view(), name='request-metrics'),
+    path('login/', LoginView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    # Registered before the router, which would otherwise treat 'stream' and 'poll' as notification ids
+    path('notifications/stream/', notification_stream, name='notification-stream'),
+    path('notifications/poll/', notification_poll, name='notification-poll'),
+    # Async versions of the read-heavy views, for ASGI deployments (see activities.async_views)
+    path('async/activities/', activity_list, name='async-activity-list'),
+    path('async/notifications/', notification_list, name='async-notification-list'),
+    path('async/activity-metrics/', activity_metrics, name='async-activity-metrics'),
     path('', include(router.urls)),
 ]
@@ -2,15 +2,43 @@ from rest_framework import permissions, viewsets, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.contrib.auth import get_user_model
-from .models import Activity, Notification
-from .serializers import UserSerializer, ActivitySerializer, NotificationSerializer 
+from .models import Activity, ActivityTrack, ArchivedActivity, Notification, UserStats
+from .serializers import (
+    UserSerializer, ActivitySerializer, NotificationSerializer, ActivityMetricsSerializer,
+    NotificationMarkReadSerializer, UserStatsSerializer, LeaderboardQuerySerializer, LeaderboardEntrySerializer,
+    ActivityTimeSeriesQuerySerializer, ActivityTimeSeriesPointSerializer, ActivityTrackSerializer,
+    TrackImportQuerySerializer, TrackAnalyticsQuerySerializer,
+)
+from .rollups import metrics_since, time_series, window_expiry
+from .caching import cached_analytics, cached_metrics, metrics_cache_stats
+from .conditional import ConditionalGetMixin, conditional_response, make_etag
+from .pagination import HistoryPagination
+from .parsers import GPXParser, NDJSONParser, TCXParser
+from .tracks import ParsedTrack, pack_track, unpack_track
+from .analytics import track_analytics
+from .renderers import PassthroughRenderer, PrometheusRenderer
+from .instrumentation import request_stats
+from .exports import EXPORT_FIELDS, EXPORT_FORMATS
+from .notifications import mark_read, unread_count
+from .stats import rebuild_stats
+from .routers import use_primary
+from .archive import ActivityHistory, reaches_archive, restore_activity, user_history
+from .leaderboards import ALL_TYPES, rank_of, ranked_weeks, top
+from .rollups import bucket_start
+from .signals import activities_bulk_created
+from .idempotency import idempotent
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
-from django.db.models import Sum
 from datetime import timedelta
 from django.utils import timezone
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from django.http import Http404, StreamingHttpResponse
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from rest_framework.reverse import reverse_lazy
+from rest_framework_simplejwt.views import TokenObtainPairView
 
 User = get_user_model()
 
@@ -34,8 +62,10 @@ class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer  # Serializer for retrieving user data
     permission_classes = [permissions.AllowAny]
+    throttle_scope = None  # Rate limit scope, by method unless an action sets one (see activities.throttling)
 
-    @action(detail=False, methods=['post'], permission_classes=[permissions.AllowAny])
+    # Hashes a password like a login does, so it shares the login rate limit
+    @action(detail=False, methods=['post'], permission_classes=[permissions.AllowAny], throttle_scope='login')
     def register(self, request):
         """
         Custom action for user registration.
@@ -47,10 +77,19 @@ class UserViewSet(viewsets.ModelViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class LoginView(TokenObtainPairView):
+    """
+    Obtains a JWT pair for a username and password. Rate limited per client IP
+    under the 'login' scope, as every attempt runs the password hasher.
+    """
+    throttle_scope = 'login'
+
+
+class ActivityViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     A viewset for managing user activities, including retrieving, creating,
-    updating, and deleting activity instances.
+    updating, and deleting activity instances. List and detail responses carry
+    ETag/Last-Modified headers and answer conditional requests with 304.
 
     """
     queryset = Activity.objects.all()  # Queryset for Activity model
@@ -59,6 +98,11 @@ class ActivityViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['activity_type']  # Allows filtering by activity type
     ordering_fields = ['date']  # Optional ordering by date
+    pagination_class = HistoryPagination  # Page numbers by default, keyset pages with ?cursor=
+    conditional_resource = 'activities'
+    throttle_scope = None  # Rate limit scope, by method unless an action sets one (see activities.throttling)
+    ARCHIVE_ACTIONS = ('list', 'retrieve', 'export', 'track', 'analytics')
+    ARCHIVE_WRITE_ACTIONS = ('update', 'partial_update', 'destroy')
 
     def get_queryset(self):
         """
@@ -66,20 +110,248 @@ class ActivityViewSet(viewsets.ModelViewSet):
         date range if 'start_date' and 'end_date' are provided as query parameters.
         
         """
-        queryset = Activity.objects.filter(user=self.request.user) #filters user activities
+        return (
+            Activity.objects.filter(**self.get_filters())
+            .select_related('user') #fetching the user in the same query for the serializer
+            .order_by('-date', '-id') #newest first, with the id making the order stable across pages
+        )
+
+    def get_filters(self):
+        filters = {'user': self.request.user} #filters user activities
 
         """Date Range Filter 
         (if both start date and end date parameters are present in the query request, activites are filtered with the range)"""
         start_date = self.request.query_params.get('start_date')
         end_date = self.request.query_params.get('end_date')
         if start_date and end_date:
-            queryset = queryset.filter(date__range=[start_date, end_date])
+            filters['date__range'] = [start_date, end_date]
+        return filters
 
+    def filter_queryset(self, queryset):
+        """
+        Also reads the archive, with the same filters, when listing, retrieving or
+        exporting a date range that reaches back past the archive horizon. Other
+        actions only see the Activity table (see get_object for edits and deletes).
+        """
+        queryset = super().filter_queryset(queryset)
+        start = self.get_filters().get('date__range', [None])[0]
+        if self.action in self.ARCHIVE_ACTIONS and reaches_archive(start):
+            archived = ArchivedActivity.objects.filter(**self.get_filters()).select_related('user')
+            queryset = ActivityHistory(queryset, super().filter_queryset(archived))
         return queryset
 
+    def get_object(self):
+        """
+        Edits and deletes of an archived activity first move it back to the Activity
+        table, where the usual write path (and its signals) applies.
+        """
+        try:
+            return super().get_object()
+        except Http404:
+            lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+            if self.action not in self.ARCHIVE_WRITE_ACTIONS or not lookup.isdigit():
+                raise
+            if not restore_activity(self.request.user, int(lookup)):
+                raise
+            return super().get_object()
+
+    # Writes run in one transaction with their signal receivers (rollups, stats, change
+    # markers, queued jobs), so the derived tables never diverge from the activity
     def perform_create(self, serializer):
         """Saves the activity with the logged-in user"""
-        serializer.save(user=self.request.user)
+        with transaction.atomic():
+            serializer.save(user=self.request.user)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        """
+        Creates an activity. When the user already has an activity with the given
+        'external_id', that activity is returned (200) instead of a duplicate, so
+        clients can retry uploads safely.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        external_id = serializer.validated_data.get('external_id')
+        if external_id is None:
+            self.perform_create(serializer)
+        else:
+            # Archived activities keep their external id, so retries of old uploads are recognised too
+            existing = user_history(request.user).filter(external_id=external_id).first()
+            if existing is not None:
+                existing.user = request.user
+                return Response(self.get_serializer(existing).data)
+            try:
+                with transaction.atomic():
+                    self.perform_create(serializer)
+            except IntegrityError:
+                # A concurrent upload of the same activity got there first
+                existing = Activity.objects.select_related('user').get(user=request.user, external_id=external_id)
+                return Response(self.get_serializer(existing).data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(serializer.data))
+
+    @action(detail=False, methods=['post'], url_path='bulk', parser_classes=[JSONParser, NDJSONParser])
+    @idempotent
+    def bulk_create(self, request):
+        """
+        Creates many activities in one request. Accepts a JSON array or an NDJSON body
+        (Content-Type: application/x-ndjson). Every item is validated on its own; valid
+        items are inserted with bulk_create in one transaction and invalid ones are
+        reported by their index without failing the rest of the batch. Items whose
+        'external_id' the user already has (or that repeat an earlier item's) are
+        reported as duplicates, with the id of the activity they match.
+        """
+        items = request.data
+        if not isinstance(items, list):
+            return Response({"error": "Expected a list of activities."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.ACTIVITY_BULK_MAX_ITEMS:
+            return Response(
+                {"error": f"A batch cannot contain more than {settings.ACTIVITY_BULK_MAX_ITEMS} activities."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        valid, errors = [], []
+        for index, item in enumerate(items):
+            serializer = self.get_serializer(data=item)
+            if serializer.is_valid():
+                valid.append((index, Activity(user=request.user, **serializer.validated_data)))
+            else:
+                errors.append({'index': index, 'errors': serializer.errors})
+
+        # One lookup on the external id indexes of both tables finds the items uploaded before
+        external_ids = {activity.external_id for _, activity in valid if activity.external_id is not None}
+        known = dict(
+            user_history(request.user).filter(external_id__in=external_ids).values_list('external_id', 'pk')
+        ) if external_ids else {}
+        activities, repeated, batch = [], [], {}
+        for index, activity in valid:
+            if activity.external_id is None:
+                activities.append(activity)
+            elif activity.external_id in known or activity.external_id in batch:
+                repeated.append((index, activity.external_id))
+            else:
+                batch[activity.external_id] = activity
+                activities.append(activity)
+
+        try:
+            with transaction.atomic():
+                created = Activity.objects.bulk_create(activities, batch_size=settings.ACTIVITY_BULK_CREATE_BATCH_SIZE)
+                activities_bulk_created.send(sender=Activity, activities=created)
+        except IntegrityError:
+            # Another request inserted some of the same external ids meanwhile
+            return Response(
+                {"error": "Some of these activities were uploaded concurrently; retry the batch."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        known.update((external_id, activity.pk) for external_id, activity in batch.items())
+        duplicates = [{'index': index, 'id': known[external_id]} for index, external_id in repeated]
+
+        if created or not items:
+            response_status = status.HTTP_201_CREATED
+        else:
+            response_status = status.HTTP_200_OK if duplicates else status.HTTP_400_BAD_REQUEST
+        return Response({
+            'created': len(created),
+            'results': self.get_serializer(created, many=True).data,
+            'duplicates': duplicates,
+            'errors': errors,
+        }, status=response_status)
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[GPXParser, TCXParser])
+    def import_track(self, request):
+        """
+        Creates an activity from an uploaded GPX or TCX file (the request body, with
+        Content-Type application/gpx+xml or application/vnd.garmin.tcx+xml). The file
+        is parsed as it is read; its trackpoints are stored packed with the activity,
+        whose distance and duration are derived from them. 'activity_type' and
+        'calories_burned' query parameters override the values found in the file.
+        """
+        track = request.data
+        if not isinstance(track, ParsedTrack):
+            return Response({"error": "Expected a GPX or TCX file."}, status=status.HTTP_400_BAD_REQUEST)
+        if not track.point_count:
+            return Response({"error": "The file contains no trackpoints."}, status=status.HTTP_400_BAD_REQUEST)
+        query = TrackImportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+
+        serializer = self.get_serializer(data={
+            'activity_type': query.validated_data.get('activity_type', track.activity_type),
+            'duration': track.duration,
+            'distance': round(track.distance, 3),
+            'calories_burned': query.validated_data.get('calories_burned', track.calories),
+        })
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            activity = serializer.save(user=request.user)
+            ActivityTrack.objects.create(
+                activity=activity, user=request.user, point_count=track.point_count,
+                started_at=track.started_at, data=pack_track(track.columns),
+            )
+        return Response({**serializer.data, 'points': track.point_count}, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'])
+    def track(self, request, pk=None):
+        """Returns the GPS track of an activity imported from a file."""
+        activity = self.get_object()
+        track = ActivityTrack.objects.filter(activity_id=activity.pk, user=request.user).first()
+        if track is None:
+            return Response({"error": "This activity has no track."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(ActivityTrackSerializer(track).data)
+
+    @action(detail=True, methods=['get'])
+    def analytics(self, request, pk=None):
+        """
+        Returns the per-km splits, best efforts and time in pace and heart rate zones
+        of an activity imported from a file. Heart rate zones are shares of the
+        'max_heart_rate' query parameter (ACTIVITY_MAX_HEART_RATE by default). Results
+        are cached per activity until its track changes.
+        """
+        activity = self.get_object()
+        query = TrackAnalyticsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        max_heart_rate = query.validated_data.get('max_heart_rate', settings.ACTIVITY_MAX_HEART_RATE)
+
+        def compute():
+            track = ActivityTrack.objects.filter(activity_id=activity.pk, user=request.user).first()
+            if track is None:
+                return None
+            return track_analytics(unpack_track(track.data), activity.activity_type, max_heart_rate)
+
+        data = cached_analytics(
+            activity.pk, {'activity_type': activity.activity_type, 'max_heart_rate': max_heart_rate}, compute,
+        )
+        if data is None:
+            return Response({"error": "This activity has no track."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(data)
+
+    @action(detail=False, methods=['get'], renderer_classes=[JSONRenderer, PassthroughRenderer], throttle_scope='export')
+    def export(self, request):
+        """
+        Streams the user's full activity history as CSV (default) or NDJSON
+        (?output=ndjson), oldest first. Supports the same 'activity_type' and
+        'start_date'/'end_date' filters as the list. Rows are read with a chunked
+        server-side iterator, so memory use does not grow with the export size.
+        """
+        output = request.query_params.get('output', 'csv')
+        if output not in EXPORT_FORMATS:
+            return Response({"error": "Invalid output specified. Use 'csv' or 'ndjson'."}, status=400)
+        encode, content_type, extension = EXPORT_FORMATS[output]
+
+        queryset = self.filter_queryset(self.get_queryset())
+        if filters.OrderingFilter.ordering_param not in request.query_params:
+            queryset = queryset.order_by('date', 'id')
+        rows = queryset.values_list(*EXPORT_FIELDS).iterator(chunk_size=settings.ACTIVITY_EXPORT_CHUNK_SIZE)
+
+        response = StreamingHttpResponse(encode(rows, request.user.username), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="activities.{extension}"'
+        return response
 
         
 class ActivityMetricsView(APIView):
@@ -90,7 +362,10 @@ class ActivityMetricsView(APIView):
     """
     
     permission_classes = [permissions.IsAuthenticated]  # Ensure the user is authenticated
-    
+    PERIODS = {
+        'weekly': timedelta(weeks=1),
+        'monthly': timedelta(days=30),
+    }
 
     def get(self, request,):
         """
@@ -101,46 +376,199 @@ class ActivityMetricsView(APIView):
         user = request.user
         period = request.query_params.get('period', 'weekly')  # Default to weekly if not specified
 
-        if period == 'weekly':
-            start_date = timezone.now() - timedelta(weeks=1)
-        elif period == 'monthly':
-            start_date = timezone.now() - timedelta(days=30)
-        else:
+        if period not in self.PERIODS:
             return Response ({"error": "Invalid period specified. Use 'weekly' or 'monthly'."}, status=400)
+        length = self.PERIODS[period]
+
+        def compute():
+            start_date = timezone.now() - length
+
+            # Whole days come from the precomputed rollups, only the first partial day is read from Activity
+            metrics = metrics_since(user, start_date)
+
+            data = ActivityMetricsSerializer({
+                  'period': period,
+                  'total_duration': timedelta(minutes=metrics['total_duration']), # Durations are stored in minutes
+                  'total_distance': metrics['total_distance'],
+                  'total_calories': metrics['total_calories']
+            }).data
+            # The totals stay valid until a write or until the oldest activity leaves the window
+            return dict(data), window_expiry(user, start_date, length)
+
+        metrics_data, etag, last_modified = cached_metrics(user.pk, 'period', {'period': period}, compute)
         
-        # Filter activities for the user and the specified date range
-        activities = Activity.objects.filter(user=user,date__gte = start_date)
+        return conditional_response(
+            request, make_etag(etag, request.accepted_media_type), last_modified, lambda: Response(metrics_data)
+        )
+
+
+class ActivityStatsView(APIView):
+    """
+    A view that returns the authenticated user's lifetime totals, best distance,
+    duration and calories per activity type, and daily streaks. The summary is kept
+    up to date on every activity write, so it is read with a single-row lookup.
 
-        metrics = activities.aggregate (
-            total_duration=Sum('duration', default=0),  # Total duration of all activities
-            total_distance=Sum('distance', default=0),  # Total distance covered in activities
-            total_calories=Sum('calories_burned', default=0)  # Total calories burned in activities
+    """
+
+    permission_classes = [permissions.IsAuthenticated]  # Ensure the user is authenticated
+
+    def get(self, request):
+        stats = UserStats.objects.filter(user=request.user).first()
+        if stats is None:
+            # Users whose activities predate the stats table get their row built once, from the primary
+            with use_primary():
+                rebuild_stats([request.user.pk])
+                stats = UserStats.objects.get(user=request.user)
+        return Response(UserStatsSerializer(stats).data)
+
+
+class LeaderboardView(APIView):
+    """
+    A view that returns a weekly leaderboard by distance, duration or calories, for
+    all activity types or a single one: the top `limit` users and the requesting
+    user's own rank. Rankings are precomputed in the background, so both parts are
+    index lookups instead of a GROUP BY over every user's activities.
+
+    """
+
+    permission_classes = [permissions.IsAuthenticated]  # Ensure the user is authenticated
+
+    def get(self, request):
+        query = LeaderboardQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        weeks = ranked_weeks()
+        week = bucket_start(params['week'], 'week') if 'week' in params else weeks[0]
+        if week not in weeks:
+            return Response(
+                {"error": f"Leaderboards are only kept for the last {len(weeks)} weeks."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        metric = params['metric']
+        activity_type = params.get('activity_type', ALL_TYPES)
+        context = {'metric': metric}
+        entry = rank_of(request.user.pk, week, activity_type)
+        return Response({
+            'week': week,
+            'metric': metric,
+            'activity_type': activity_type or None,
+            'results': LeaderboardEntrySerializer(
+                top(week, activity_type, metric, params['limit']), many=True, context=context,
+            ).data,
+            'me': LeaderboardEntrySerializer(entry, context=context).data if entry else None,
+        })
+
+
+class ActivityTimeSeriesView(APIView):
+    """
+    A view that returns the authenticated user's activity metrics as a time series
+    between two dates, bucketed by day, week or month and optionally grouped by
+    activity type. Every bucket in the range is returned, including empty ones.
+
+    """
+
+    permission_classes = [permissions.IsAuthenticated]  # Ensure the user is authenticated
+
+    def get(self, request):
+        """
+        Returns one entry per bucket between 'start' and 'end' (inclusive dates).
+        Accepts 'bucket' ('day', 'week' or 'month') and 'group_by=activity_type'.
+
+        """
+        query = ActivityTimeSeriesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        def compute():
+            series = time_series(
+                request.user, params['start'], params['end'],
+                bucket=params['bucket'], group_by=params.get('group_by'),
+            )
+            data = {
+                'start': params['start'],
+                'end': params['end'],
+                'bucket': params['bucket'],
+                'group_by': params.get('group_by'),
+                'series': list(ActivityTimeSeriesPointSerializer(series, many=True).data),
+            }
+            # Fixed date ranges only change when the user's activities do
+            return data, None
+
+        data, etag, last_modified = cached_metrics(request.user.pk, 'series', params, compute)
+        return conditional_response(
+            request, make_etag(etag, request.accepted_media_type), last_modified, lambda: Response(data)
         )
-       
-        metrics_data = {
-              'period': period,
-              'total_duration': timedelta(seconds=metrics['total_duration']),
-              'total_distance': metrics ['total_distance'],
-              'total_calories': metrics ['total_calories']
-        }
-        
-        return Response(metrics_data)
+
+
+class ActivityMetricsCacheStatsView(APIView):
+    """
+    Staff-only view exposing the hit and miss counters of the metrics cache
+    for the current process.
+
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(metrics_cache_stats.snapshot())
+
+
+class RequestMetricsView(APIView):
+    """
+    Staff-only view exposing the per-view request histograms (wall time, query count,
+    database and serializer time, response size) collected by the instrumentation
+    middleware in this process. Also available in the Prometheus text format.
+
+    """
+    permission_classes = [permissions.IsAdminUser]
+    renderer_classes = [JSONRenderer, PrometheusRenderer]
+
+    def get(self, request):
+        return Response(request_stats.snapshot())
 
     
-class NotificationViewSet(viewsets.ModelViewSet):
+class NotificationViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     A viewset for managing user notifications, including retrieving, creating,
     updating, and deleting notification instances. Notifications are linked to the
-    authenticated user.
+    authenticated user. List and detail responses support conditional GET.
 
     """
     queryset = Notification.objects.all()  # Queryset for Notification model
     serializer_class = NotificationSerializer  # Serializer for Notification model
     permission_classes = [permissions.IsAuthenticated]  # Requires authentication
+    pagination_class = HistoryPagination  # Page numbers by default, keyset pages with ?cursor=
+    conditional_resource = 'notifications'
+
+    def get_queryset(self):
+        """
+        Returns the notifications of the authenticated user, fetching the user in the
+        same query so serializing a page costs a constant number of queries.
+
+        """
+        # Newest first; Notification has no created_at, its creation time is `date`
+        return Notification.objects.filter(user=self.request.user).select_related('user').order_by('-date', '-id')
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    @action(detail=False, methods=['get'], url_path='unread-count')
+    def unread_count(self, request):
+        """Returns the number of unread notifications, read from the user's counter row."""
+        return Response({'unread': unread_count(request.user.pk)})
+
+    @action(detail=False, methods=['post'], url_path='mark-read')
+    def mark_read(self, request):
+        """
+        Marks the notifications listed in `ids`, or all of them when `ids` is omitted,
+        as read with a single UPDATE. Ids that are unknown, already read or belong to
+        another user are ignored.
+        """
+        serializer = NotificationMarkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        marked = mark_read(request.user.pk, serializer.validated_data.get('ids'))
+        return Response({'marked_read': marked, 'unread': unread_count(request.user.pk)})
+
 class ApiRootViewAuthenticated(APIView):
     """API root view for authenticated users.
     It requires the user to be authenticated to access the API root.
@@ -154,6 +582,9 @@ class ApiRootViewAuthenticated(APIView):
             'activities': reverse_lazy('activity-list'),
             'notifications': reverse_lazy('notification-list'),
             'activity-metrics': reverse_lazy('activity-metrics'),
+            'activity-metrics-series': reverse_lazy('activity-metrics-series'),
+            'activity-stats': reverse_lazy('activity-stats'),
+            'leaderboard': reverse_lazy('leaderboard'),
         })
 
 class ApiRootViewAllowAny(APIView):
@@ -2,6 +2,8 @@
 ASGI config for fitness_tracker_api project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server, e.g. ``uvicorn fitness_tracker_api.asgi:application
+--workers 4``, for the streaming endpoints and the async views under /async/.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -12,5 +14,10 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fitness_tracker_api.settings')
+# Async requests run their queries in worker threads, each with its own connection, so
+# persistent connections would pile up instead of being reused; close them per request
+# (and use DB_POOL_MAX_SIZE for reuse) unless the deployment sets DB_CONN_MAX_AGE itself.
+# Set before the settings are loaded.
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
@@ -0,0 +1,11 @@
+"""
+Settings for running the test suite:
+
+    python manage.py test --settings=fitness_tracker_api.test_settings
+"""
+
+from .settings import *  # noqa: F401,F403
+
+# A separate, unreplicated database standing in for a replica in the routing tests,
+# which enable it with override_settings(DATABASE_REPLICAS=['replica'])
+DATABASES['replica'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'replica.sqlite3'}  # noqa: F405